@@ -1 +1,16 @@
-from .interface import run_commandline, simulate
+# the engine is only imported when it is first used, so tools that just need a
+# small part of the package do not pay for parsing and compiling all of it.
+_lazy_exports = {
+    "run_commandline": ".interface",
+    "simulate": ".interface",
+}
+
+
+def __getattr__(name):
+    if name not in _lazy_exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_lazy_exports[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,714 @@
+import argparse
+import json
+import logging
+import pathlib
+import sys
+
+from .backends import backend_names
+
+DEFAULT_SCRIPT = (
+    pathlib.Path(__file__).parent.parent / "1966_01_CACM_article_Eliza_script.txt"
+)
+DEFAULT_CONVERSATION = (
+    pathlib.Path(__file__).parent.parent / "original_conversation.txt"
+)
+DEFAULT_CLI = pathlib.Path(__file__).parent.parent / "run_pyliza.py"
+DEFAULT_SLOW_INPUTS = (
+    pathlib.Path(__file__).parent.parent / "benchmarks" / "slow_inputs.json"
+)
+
+
+def _read_script(path):
+    with open(path) as fobj:
+        return fobj.readlines()
+
+
+def _codegen_cache(args):
+    from .codegen import cache_path_for
+
+    return cache_path_for(args.script) if args.backend == "codegen" else None
+
+
+def _capture_writer(args):
+    if args.capture is None:
+        return None
+    from .capture import CaptureWriter
+
+    return CaptureWriter(args.capture)
+
+
+def _shadow_runner(args, script):
+    if not args.shadow:
+        return None
+    from .shadow import ShadowRunner
+
+    max_match_seconds = (
+        args.max_match_ms / 1000 if args.max_match_ms is not None else None
+    )
+    return ShadowRunner(
+        script, args.shadow, not args.eager, args.max_match_steps, max_match_seconds
+    )
+
+
+def _close_shadow(shadow):
+    if shadow is None:
+        return
+    shadow.close()
+    report = shadow.report()
+    level = (
+        logging.WARNING
+        if report.mismatches or report.state_mismatches
+        else logging.INFO
+    )
+    logging.getLogger("shadow").log(level, report.format())
+
+
+def _serve(args):
+    from .server import serve
+
+    if args.workers:
+        return _serve_prefork(args)
+
+    transcript = None
+    if args.transcript is not None:
+        from .transcript import TranscriptWriter
+
+        transcript = TranscriptWriter(
+            args.transcript,
+            max_bytes=args.transcript_max_bytes,
+            max_age=args.transcript_max_age,
+            compress=args.transcript_gzip,
+            overflow=args.transcript_overflow,
+        )
+    max_match_seconds = (
+        args.max_match_ms / 1000 if args.max_match_ms is not None else None
+    )
+    script = _read_script(args.script)
+    capture = _capture_writer(args)
+    shadow = _shadow_runner(args, script)
+    try:
+        serve(
+            script,
+            args.listen,
+            not args.eager,
+            transcript,
+            args.max_match_steps,
+            max_match_seconds,
+            args.backend,
+            _codegen_cache(args),
+            args.profiler,
+            capture,
+            shadow,
+        )
+    finally:
+        if transcript is not None:
+            transcript.close()
+        if capture is not None:
+            capture.close()
+        _close_shadow(shadow)
+
+
+def _serve_prefork(args):
+    from .prefork import serve_prefork
+
+    max_match_seconds = (
+        args.max_match_ms / 1000 if args.max_match_ms is not None else None
+    )
+    max_memory = (
+        int(args.max_memory_mb * 1024 * 1024)
+        if args.max_memory_mb is not None
+        else None
+    )
+    serve_prefork(
+        _read_script(args.script),
+        args.listen,
+        args.workers,
+        args.max_requests,
+        max_memory,
+        args.max_match_steps,
+        max_match_seconds,
+        args.backend,
+        _codegen_cache(args),
+    )
+
+
+def _rpc(args):
+    from .rpc import serve_rpc
+
+    max_match_seconds = (
+        args.max_match_ms / 1000 if args.max_match_ms is not None else None
+    )
+    script = _read_script(args.script)
+    capture = _capture_writer(args)
+    shadow = _shadow_runner(args, script)
+    try:
+        serve_rpc(
+            script,
+            args.path,
+            not args.eager,
+            args.max_match_steps,
+            max_match_seconds,
+            args.store,
+            args.flush_ms / 1000,
+            args.backend,
+            _codegen_cache(args),
+            args.profiler,
+            capture,
+            shadow,
+            args.max_sessions,
+        )
+    finally:
+        if capture is not None:
+            capture.close()
+        _close_shadow(shadow)
+
+
+def _daemon(args):
+    from .daemon import run_daemon
+    from .daemon_client import default_socket_path
+
+    return run_daemon(
+        args.path or default_socket_path(), args.idle_timeout, args.backend
+    )
+
+
+def _route(args):
+    from .router import serve_route
+
+    serve_route(args.path, args.nodes, args.replicas)
+
+
+def _analyse(args):
+    from .analysis import analyse_patterns
+    from .rule_parsing import ScriptParser
+
+    rule_set = ScriptParser.parse(_read_script(args.script))
+    reports = analyse_patterns(rule_set, args.phrase_length, args.max_cost)
+    for report in reports:
+        flag = "RISKY" if report.risky else ""
+        print(
+            f"{report.cost:>12d} {flag:5s} {report.keyword} #{report.index}: {report.pattern}"
+        )
+    return 1 if args.fail_on_risky and any(r.risky for r in reports) else 0
+
+
+def _lint(args):
+    from .optimizer import optimize
+    from .rule_parsing import ScriptParser
+
+    report = optimize(ScriptParser.parse(_read_script(args.script)), args.phrase_length)
+    print(report.format())
+    return 1 if args.fail_on_findings and report.findings else 0
+
+
+def _loadtest(args):
+    from . import loadtest
+
+    if args.connect:
+        target = loadtest.SocketTarget(args.connect)
+    else:
+        target = loadtest.EngineTarget(_read_script(args.script), lazy=not args.eager)
+    test = loadtest.LoadTest(
+        target,
+        loadtest.read_corpus(args.corpus or [DEFAULT_CONVERSATION]),
+        sessions=args.sessions,
+        iterations=args.iterations,
+        rate=args.rate,
+        trace_memory=args.trace_memory,
+    )
+    report = test.run()
+    print(report.format())
+    return 1 if report.errors and args.fail_on_error else 0
+
+
+def _replay(args):
+    from . import capture, loadtest
+
+    if args.connect:
+        target = loadtest.SocketTarget(args.connect)
+    else:
+        target = loadtest.EngineTarget(
+            _read_script(args.script),
+            lazy=not args.eager,
+            backend=args.backend,
+            codegen_cache=_codegen_cache(args),
+            profiler=args.profiler,
+        )
+    report = capture.replay(
+        capture.read_capture(args.log), target, None if args.fast else args.speed
+    )
+    print(report.format())
+    return 1 if (report.mismatches or report.errors) and args.fail_on_diff else 0
+
+
+def _sweep(args):
+    from .loadtest import read_corpus
+    from .sweep import sweep
+
+    corpus_paths = args.corpus or [DEFAULT_CONVERSATION]
+    matrix = open(args.matrix, "w") if args.matrix is not None else None
+    try:
+        report = sweep(
+            {str(path): _read_script(path) for path in args.scripts},
+            dict(zip(map(str, corpus_paths), read_corpus(corpus_paths))),
+            args.jobs,
+            args.backend,
+            matrix,
+            sys.stdout if args.diff else None,
+        )
+    finally:
+        if matrix is not None:
+            matrix.close()
+    print(report.format())
+    changed = any(result.different_turns for result in report.scripts)
+    return 1 if changed and args.fail_on_diff else 0
+
+
+def _bench(args):
+    from . import benchmark
+    from .loadtest import read_corpus
+
+    suites = args.suite or ["memory", "corpus"]
+    conversation = read_corpus([DEFAULT_CONVERSATION])[0]
+    reports = []
+    regressions = []
+    if "memory" in suites:
+        reports += benchmark.memory_suite(
+            _read_script(args.script), conversation, args.synthetic, args.sessions
+        )
+    if "corpus" in suites and pathlib.Path(args.corpus).exists():
+        corpus_report = benchmark.replay_corpus(args.corpus)
+        regressions = corpus_report.regressions
+        reports.append(corpus_report)
+    if "backends" in suites:
+        reports += benchmark.backend_suite(
+            _read_script(args.script), conversation, args.synthetic
+        )
+    if "transports" in suites:
+        reports += benchmark.compare_transports(
+            str(args.script), conversation, str(DEFAULT_CLI)
+        )
+    metrics = {}
+    for report in reports:
+        print(report.format())
+        metrics.update(report.metrics())
+    if args.json is not None:
+        with open(args.json, "w") as fobj:
+            json.dump(metrics, fobj, indent=2, sort_keys=True)
+    over = []
+    if args.budget is not None:
+        over = benchmark.check_budget(metrics, benchmark.load_budget(args.budget))
+    for line in over:
+        print(f"over budget {line}")
+    return 1 if over or regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pyliza")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="Increase verbostity",
+    )
+    parser.add_argument(
+        "-s", "--script", default=DEFAULT_SCRIPT, help="Eliza Script File"
+    )
+    parser.add_argument(
+        "--eager",
+        action="store_true",
+        help="parse every rule at startup instead of when first used",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=backend_names(),
+        default="interpreter",
+        help="how rules are run, codegen compiles them to python and caches "
+        "the result next to the script",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="OUT",
+        help="write pstats to OUT and flamegraph collapsed stacks next to it",
+    )
+    parser.add_argument(
+        "--profile-mode",
+        choices=["cprofile", "sample"],
+        default="cprofile",
+        help="profile every call, or sample the stack every millisecond",
+    )
+    parser.add_argument(
+        "--profile-responses-only",
+        action="store_true",
+        help="only profile answering turns, not parsing the script",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="serve line based conversations")
+    serve_parser.add_argument(
+        "listen", help="host:port or unix socket path to listen on"
+    )
+    serve_parser.add_argument(
+        "--transcript",
+        default=None,
+        help="append every exchange to this file as json lines",
+    )
+    serve_parser.add_argument(
+        "--transcript-max-bytes",
+        type=int,
+        default=None,
+        help="rotate the transcript once it is this big",
+    )
+    serve_parser.add_argument(
+        "--transcript-max-age",
+        type=float,
+        default=None,
+        help="rotate the transcript after this many seconds",
+    )
+    serve_parser.add_argument(
+        "--transcript-gzip", action="store_true", help="gzip rotated transcripts"
+    )
+    serve_parser.add_argument(
+        "--transcript-overflow",
+        choices=["block", "drop-newest", "drop-oldest"],
+        default="block",
+        help="what to do when the transcript writer falls behind",
+    )
+    serve_parser.add_argument(
+        "--max-match-steps",
+        type=int,
+        default=None,
+        help="give up matching a turn after this many steps and use the NONE reply",
+    )
+    serve_parser.add_argument(
+        "--max-match-ms",
+        type=float,
+        default=None,
+        help="give up matching a turn after this many milliseconds",
+    )
+    serve_parser.add_argument(
+        "--shadow",
+        type=float,
+        default=0.0,
+        metavar="FRACTION",
+        help="also answer this fraction of turns on the interpreter in the "
+        "background and report any that differ from --backend",
+    )
+    serve_parser.add_argument(
+        "--capture",
+        default=None,
+        metavar="LOG",
+        help="append every turn to this binary log, see the replay command",
+    )
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="fork this many worker processes that share the parsed script, "
+        "instead of serving from threads in this process",
+    )
+    serve_parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=None,
+        help="with --workers, replace a worker after it has answered this many turns",
+    )
+    serve_parser.add_argument(
+        "--max-memory-mb",
+        type=float,
+        default=None,
+        help="with --workers, replace a worker once its private memory passes this",
+    )
+    serve_parser.set_defaults(func=_serve)
+
+    rpc_parser = commands.add_parser(
+        "rpc", help="answer length prefixed binary requests on a unix socket"
+    )
+    rpc_parser.add_argument("path", help="unix socket path to listen on")
+    rpc_parser.add_argument(
+        "--max-match-steps",
+        type=int,
+        default=None,
+        help="give up matching a turn after this many steps and use the NONE reply",
+    )
+    rpc_parser.add_argument(
+        "--max-match-ms",
+        type=float,
+        default=None,
+        help="give up matching a turn after this many milliseconds",
+    )
+    rpc_parser.add_argument(
+        "--store",
+        default=None,
+        help="sqlite file to keep sessions in, so they survive restarts",
+    )
+    rpc_parser.add_argument(
+        "--flush-ms",
+        type=float,
+        default=1000,
+        help="how often changed sessions are written to the store",
+    )
+    rpc_parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=10000,
+        help="most sessions kept in memory, the least recently used are "
+        "dropped and reloaded from --store if they come back",
+    )
+    rpc_parser.add_argument(
+        "--shadow",
+        type=float,
+        default=0.0,
+        metavar="FRACTION",
+        help="also answer this fraction of turns on the interpreter in the "
+        "background and report any that differ from --backend",
+    )
+    rpc_parser.add_argument(
+        "--capture",
+        default=None,
+        metavar="LOG",
+        help="append every turn to this binary log, see the replay command",
+    )
+    rpc_parser.set_defaults(func=_rpc)
+
+    route_parser = commands.add_parser(
+        "route", help="spread rpc sessions over several rpc servers"
+    )
+    route_parser.add_argument("path", help="unix socket path to listen on")
+    route_parser.add_argument(
+        "nodes",
+        help="file listing the rpc servers' socket paths, read again on SIGHUP",
+    )
+    route_parser.add_argument(
+        "--replicas",
+        type=int,
+        default=64,
+        help="points each node gets on the hash ring",
+    )
+    route_parser.set_defaults(func=_route)
+
+    analyse_parser = commands.add_parser(
+        "analyse", help="estimate the worst case matching cost of every pattern"
+    )
+    analyse_parser.add_argument(
+        "--phrase-length",
+        type=int,
+        default=None,
+        help="phrase length to estimate the cost for",
+    )
+    analyse_parser.add_argument(
+        "--max-cost",
+        type=int,
+        default=None,
+        help="patterns estimated to cost more than this are risky",
+    )
+    analyse_parser.add_argument(
+        "--fail-on-risky",
+        action="store_true",
+        help="exit with an error status if any pattern is risky",
+    )
+    analyse_parser.set_defaults(func=_analyse)
+
+    lint_parser = commands.add_parser(
+        "lint",
+        help="find rules that can never change a reply and the matching work they cost",
+    )
+    lint_parser.add_argument(
+        "--phrase-length",
+        type=int,
+        default=None,
+        help="phrase length to estimate the matching work for",
+    )
+    lint_parser.add_argument(
+        "--fail-on-findings",
+        action="store_true",
+        help="exit with an error status if anything was found",
+    )
+    lint_parser.set_defaults(func=_lint)
+
+    load_parser = commands.add_parser(
+        "loadtest", help="run concurrent synthetic conversations"
+    )
+    load_parser.add_argument(
+        "corpus",
+        nargs="*",
+        help="transcripts to replay, lines starting with # are ignored",
+    )
+    load_parser.add_argument(
+        "-c",
+        "--connect",
+        default=None,
+        help="host:port or unix socket of a server, defaults to the in process engine",
+    )
+    load_parser.add_argument(
+        "-n", "--sessions", type=int, default=10, help="concurrent sessions"
+    )
+    load_parser.add_argument(
+        "-i",
+        "--iterations",
+        type=int,
+        default=1,
+        help="times each session replays its conversation",
+    )
+    load_parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        default=None,
+        help="offered turns per second, closed loop if not given",
+    )
+    load_parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="measure memory kept per session with tracemalloc",
+    )
+    load_parser.add_argument(
+        "--fail-on-error",
+        action="store_true",
+        help="exit with an error status if any turn failed",
+    )
+    load_parser.set_defaults(func=_loadtest)
+
+    replay_parser = commands.add_parser(
+        "replay", help="replay a capture log and compare the replies"
+    )
+    replay_parser.add_argument("log", help="log written by serve or rpc --capture")
+    replay_parser.add_argument(
+        "-c",
+        "--connect",
+        default=None,
+        help="host:port or unix socket of a server, defaults to the in process engine",
+    )
+    pace = replay_parser.add_mutually_exclusive_group()
+    pace.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay this many times faster than the turns were captured",
+    )
+    pace.add_argument(
+        "--fast", action="store_true", help="send every turn as soon as possible"
+    )
+    replay_parser.add_argument(
+        "--fail-on-diff",
+        action="store_true",
+        help="exit with an error status if any reply differs or a turn failed",
+    )
+    replay_parser.set_defaults(func=_replay)
+
+    daemon_parser = commands.add_parser(
+        "daemon",
+        help="keep scripts parsed for run_pyliza.py --client, started by the client",
+    )
+    daemon_parser.add_argument(
+        "path", nargs="?", default=None, help="unix socket path to listen on"
+    )
+    daemon_parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=600.0,
+        help="exit after this many seconds without a client",
+    )
+    daemon_parser.set_defaults(func=_daemon)
+
+    sweep_parser = commands.add_parser(
+        "sweep", help="answer a corpus of conversations with several scripts"
+    )
+    sweep_parser.add_argument(
+        "scripts", nargs="+", help="scripts to compare, the first is the baseline"
+    )
+    sweep_parser.add_argument(
+        "--corpus",
+        nargs="+",
+        default=None,
+        help="conversation transcripts, the original conversation by default",
+    )
+    sweep_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="worker processes, one per cpu by default",
+    )
+    sweep_parser.add_argument(
+        "--matrix",
+        default=None,
+        metavar="OUT",
+        help="write every script's replies to OUT, a json line per conversation",
+    )
+    sweep_parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="print a diff for every conversation a script answers differently",
+    )
+    sweep_parser.add_argument(
+        "--fail-on-diff",
+        action="store_true",
+        help="exit with an error status if any script differs from the first",
+    )
+    sweep_parser.set_defaults(func=_sweep)
+
+    bench_parser = commands.add_parser(
+        "bench",
+        help="measure memory use, replay slow inputs, compare backends and transports",
+    )
+    bench_parser.add_argument(
+        "--suite",
+        choices=["memory", "corpus", "backends", "transports"],
+        action="append",
+        default=None,
+        help="what to measure, memory and corpus unless given",
+    )
+    bench_parser.add_argument(
+        "--synthetic",
+        type=int,
+        nargs="*",
+        default=[100, 500],
+        help="keyword counts of the synthetic scripts to measure",
+    )
+    bench_parser.add_argument(
+        "--sessions", type=int, default=20, help="live sessions to average over"
+    )
+    bench_parser.add_argument(
+        "--budget",
+        default=None,
+        help="json file of metric limits, exit with an error status if any is exceeded",
+    )
+    bench_parser.add_argument(
+        "--corpus",
+        default=DEFAULT_SLOW_INPUTS,
+        help="slow inputs to replay, any that got slower fail the run",
+    )
+    bench_parser.add_argument(
+        "--json", default=None, help="also write the metrics to this file"
+    )
+    bench_parser.set_defaults(func=_bench)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "workers", 0) and (
+        args.transcript or args.capture or args.profile or args.shadow
+    ):
+        parser.error(
+            "--workers can't be used with a transcript, capture, shadow or profile"
+        )
+    logging.basicConfig(
+        level={0: logging.WARN, 1: logging.INFO}.get(args.verbose, logging.DEBUG)
+    )
+    if args.profile is None:
+        args.profiler = None
+        return args.func(args)
+
+    from .profiling import Profiler
+
+    args.profiler = Profiler(args.profile_mode, args.profile_responses_only)
+    try:
+        with args.profiler.profiling():
+            return args.func(args)
+    finally:
+        args.profiler.write(args.profile)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
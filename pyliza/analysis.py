@@ -0,0 +1,45 @@
+import dataclasses
+import typing
+
+from .ruleset import Memory, RuleSet, Transformation
+from .transformation import PatternComplexity
+
+
+@dataclasses.dataclass
+class PatternReport:
+    keyword: str
+    index: int
+    pattern: str
+    complexity: PatternComplexity
+    cost: int
+    risky: bool
+
+
+def analyse_patterns(
+    rule_set: RuleSet,
+    phrase_length: typing.Optional[int] = None,
+    max_cost: typing.Optional[int] = None,
+) -> typing.List[PatternReport]:
+    """Estimate the worst case matching cost of every decomposition, costliest first."""
+    reports = []
+    for keyword, rule in rule_set.rules.items():
+        if isinstance(rule, Transformation):
+            trules = rule.transformation_rules
+        elif isinstance(rule, Memory):
+            trules = rule.memory_rules
+        else:
+            continue
+        for idx, trule in enumerate(trules):
+            complexity = trule.decompose.complexity()
+            reports.append(
+                PatternReport(
+                    keyword.word,
+                    idx,
+                    str(trule.decompose),
+                    complexity,
+                    complexity.estimate(phrase_length),
+                    complexity.is_risky(phrase_length, max_cost),
+                )
+            )
+    reports.sort(key=lambda r: r.cost, reverse=True)
+    return reports
@@ -0,0 +1,165 @@
+import typing
+
+from .processing import PhraseSpan, ProcessingPhrase, ProcessingWord
+from .transformation import (
+    DecomposedPhrase_t,
+    DecompositionRule,
+    MatchBudget,
+    TransformRule,
+)
+
+# what a state does with the next word
+_ANY = 0  # take any word, one word of an int
+_WORD = 1  # take a word that passes the state's test
+_ZERO = 2  # a 0 with more pattern after it, take words until the rest matches
+_TAIL = 3  # a 0 that ends the pattern, takes the rest of the phrase
+_ACCEPT = 4  # the whole pattern matched, only counts at the end of the phrase
+
+# the states a thread is in once it enters a state, in priority order, with
+# how many decomposed parts start at that position on the way to each
+_Closure_t = typing.Tuple[typing.Tuple[int, int], ...]
+
+
+class DecompositionAutomaton:
+    """All of a keyword's decomposition patterns, matched in one scan.
+
+    The patterns are compiled into one program that is run Pike VM style,
+    a thread per way the phrase could still match, stepped a word at a time.
+    Threads are kept in priority order, earlier rules first and within a rule
+    the order the backtracking matcher tries things, so the first thread to
+    match is the same rule and the same parts that trying the rules one after
+    another would have found. Two threads in the same state at the same word
+    have the same future, so only the one with priority is kept, which bounds
+    the work by the phrase length times the number of states.
+    """
+
+    def __init__(self, rules: typing.Sequence[DecompositionRule]) -> None:
+        self._kinds: typing.List[int] = []
+        self._words: typing.List[typing.FrozenSet[typing.Optional[str]]] = []
+        self._masks: typing.List[int] = []
+        self._rules: typing.List[int] = []
+        self._starts_part: typing.List[bool] = []
+        starts = []
+        for idx, rule in enumerate(rules):
+            starts.append(len(self._kinds))
+            self._compile(idx, rule)
+        states = range(len(self._kinds))
+        # a 0 can be left without taking a word, but only before the end
+        self._enter = [self._closure(s, True) for s in states]
+        self._enter_at_end = [self._closure(s, False) for s in states]
+        self._stay = [
+            self._enter[s + 1] + ((s, 0),) if self._kinds[s] == _ZERO else ((s, 0),)
+            for s in states
+        ]
+        self._stay_at_end = [((s, 0),) for s in states]
+        self._initial = [(self._enter[s], self._enter_at_end[s]) for s in starts]
+
+    @classmethod
+    def for_rules(
+        cls, rules: typing.Iterable[TransformRule]
+    ) -> "DecompositionAutomaton":
+        return cls([rule.decompose for rule in rules])
+
+    def _compile(self, rule_idx: int, rule: DecompositionRule) -> None:
+        parts = rule.compiled
+        for part_idx, part in enumerate(parts):
+            if part == 0:
+                kind = _ZERO if part_idx < len(parts) - 1 else _TAIL
+                self._add_state(kind, frozenset(), 0, rule_idx, True)
+            elif isinstance(part, int):
+                for word_idx in range(part):
+                    self._add_state(_ANY, frozenset(), 0, rule_idx, not word_idx)
+            else:
+                self._add_state(_WORD, part.words, part.mask, rule_idx, True)
+        self._add_state(_ACCEPT, frozenset(), 0, rule_idx, False)
+
+    def _add_state(self, kind, words, mask, rule_idx, starts_part) -> None:
+        self._kinds.append(kind)
+        self._words.append(words)
+        self._masks.append(mask)
+        self._rules.append(rule_idx)
+        self._starts_part.append(starts_part)
+
+    def _closure(self, state: int, before_end: bool) -> _Closure_t:
+        starts = int(self._starts_part[state])
+        if self._kinds[state] != _ZERO or not before_end:
+            return ((state, starts),)
+        # ending the 0 straight away comes first, it is non greedy
+        return tuple(
+            (s, parts + starts) for s, parts in self._closure(state + 1, True)
+        ) + ((state, starts),)
+
+    def match(
+        self, phrase: ProcessingPhrase, budget: typing.Optional[MatchBudget] = None
+    ) -> typing.Optional[typing.Tuple[int, DecomposedPhrase_t]]:
+        """Index of the first rule that decomposes the phrase and its parts.
+
+        Raises MatchBudgetExceeded if a budget is given and it runs out, every
+        thread started costs a step.
+        """
+        return self.match_words(phrase.words, budget)
+
+    def match_words(
+        self,
+        words: typing.List[ProcessingWord],
+        budget: typing.Optional[MatchBudget] = None,
+    ) -> typing.Optional[typing.Tuple[int, DecomposedPhrase_t]]:
+        """match for a phrase's word list, the parts are spans over it."""
+        length = len(words)
+        kinds = self._kinds
+        # the last position each state was given a thread at
+        marks = [-1] * len(kinds)
+        threads: typing.List[typing.Tuple[int, tuple]] = []
+        for enter, enter_at_end in self._initial:
+            self._add(threads, marks, enter if length else enter_at_end, (), 0)
+        if budget is not None:
+            budget.charge(len(threads))
+
+        for pos, word in enumerate(words):
+            if not threads:
+                return None
+            if kinds[threads[0][0]] == _TAIL:
+                break  # the rest of the phrase can only go to the first thread
+            nxt = pos + 1
+            if nxt < length:
+                enter, stay = self._enter, self._stay
+            else:
+                enter, stay = self._enter_at_end, self._stay_at_end
+            text, tag_mask = word.word, word.tag_mask
+            next_threads: typing.List[typing.Tuple[int, tuple]] = []
+            for state, parts in threads:
+                kind = kinds[state]
+                if kind == _ANY or (
+                    kind == _WORD
+                    and (text in self._words[state] or tag_mask & self._masks[state])
+                ):
+                    self._add(next_threads, marks, enter[state + 1], parts, nxt)
+                elif kind == _ZERO:
+                    self._add(next_threads, marks, stay[state], parts, nxt)
+                elif kind == _TAIL:
+                    self._add(next_threads, marks, stay[state], parts, nxt)
+                    break  # it can't fail, so nothing after it will be used
+            threads = next_threads
+            if budget is not None:
+                budget.charge(len(threads))
+
+        for state, parts in threads:
+            if kinds[state] == _TAIL or kinds[state] == _ACCEPT:
+                return self._result(self._rules[state], parts, words)
+        return None
+
+    @staticmethod
+    def _add(threads, marks, closure: _Closure_t, parts: tuple, pos: int) -> None:
+        for state, new_parts in closure:
+            if marks[state] != pos:
+                marks[state] = pos
+                threads.append(
+                    (state, parts + (pos,) * new_parts if new_parts else parts)
+                )
+
+    @staticmethod
+    def _result(rule_idx, starts, words) -> typing.Tuple[int, DecomposedPhrase_t]:
+        ends = starts[1:] + (len(words),)
+        return rule_idx, [
+            PhraseSpan(words, start, end) for start, end in zip(starts, ends)
+        ]
@@ -0,0 +1,58 @@
+"""The ways a parsed rule set can be run.
+
+The interpreter in ruleset and transformation is the reference, every other
+backend has to give the same replies and leave the same session state. A
+backend is installed onto a parsed rule set by a function given the rule
+set, the script's text and where it may cache what it builds.
+"""
+
+import typing
+
+if typing.TYPE_CHECKING:
+    from .ruleset import RuleSet
+
+REFERENCE = "interpreter"
+
+Installer_t = typing.Callable[["RuleSet", str, typing.Optional[str]], None]
+
+_BACKENDS: typing.Dict[str, typing.Optional[Installer_t]] = {REFERENCE: None}
+
+
+def register_backend(name: str, install: Installer_t) -> None:
+    if name in _BACKENDS:
+        raise ValueError(f"backend {name} is already registered")
+    _BACKENDS[name] = install
+
+
+def backend_names() -> typing.Tuple[str, ...]:
+    """Every registered backend, the reference first."""
+    return tuple(_BACKENDS)
+
+
+def use_backend(
+    rule_set: "RuleSet",
+    backend: str,
+    script_text: str,
+    cache_path: typing.Optional[str] = None,
+) -> None:
+    """Switch the rule set to the named backend, see backend_names."""
+    if backend not in _BACKENDS:
+        raise ValueError(
+            f"unknown backend {backend}, expected one of {backend_names()}"
+        )
+    install = _BACKENDS[backend]
+    if install is not None:
+        install(rule_set, script_text, cache_path)
+
+
+def _install_codegen(
+    rule_set: "RuleSet", script_text: str, cache_path: typing.Optional[str]
+) -> None:
+    from . import codegen
+
+    codegen.install(
+        rule_set, codegen.compile_rule_set(rule_set, script_text, cache_path)
+    )
+
+
+register_backend("codegen", _install_codegen)
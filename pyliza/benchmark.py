@@ -0,0 +1,514 @@
+import dataclasses
+import functools
+import gc
+import json
+import logging
+import os
+import pathlib
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import typing
+
+from .automaton import DecompositionAutomaton
+from .eliza import Eliza
+from .loadtest import LatencyHistogram, SocketTarget
+from .processing import ProcessingPhrase, ProcessingWord
+from .rule_parsing import ScriptParser
+from .state import SessionState
+from .transformation import (
+    DecompositionRule,
+    MatchBudget,
+    MatchBudgetExceeded,
+    ReassemblyRule,
+)
+from .transformation_parser import DecompositionParser
+
+_CATEGORIES = {
+    ProcessingWord: "words",
+    DecompositionRule: "patterns",
+    ReassemblyRule: "reassemblies",
+}
+_NOT_OWNED = (type, types.ModuleType, types.FunctionType, logging.Logger)
+
+
+def synthetic_script(
+    keywords: int, rules_per_keyword: int = 4, reassemblies: int = 4, seed: int = 0
+) -> typing.List[str]:
+    """A script shaped like the CACM one but with many more keywords."""
+    rand = random.Random(seed)
+    lines = ["(HELLO.  WHAT IS ON YOUR MIND)", "START"]
+    for idx in range(keywords):
+        keyword = f"KW{idx}"
+        lines.append(f"({keyword} {rand.randrange(10)}")
+        for rule in range(rules_per_keyword - 1):
+            other = f"W{rand.randrange(keywords)}"
+            lines.append(f"    ((0 {keyword} 0 {other} 0)")
+            for reply in range(reassemblies):
+                lines.append(f"        (REPLY {reply} TO {other} ABOUT 3 AND 5)")
+            lines[-1] += ")"
+        lines.append("    ((0)")
+        for reply in range(reassemblies - 1):
+            lines.append(f"        (TELL ME MORE ABOUT {keyword} {reply})")
+        lines.append(f"        (=KW{rand.randrange(keywords)})))")
+    lines += [
+        "(NONE",
+        "    ((0)",
+        "        (PLEASE GO ON)",
+        "        (I SEE)))",
+        "(MEMORY KW0",
+        "    (0 KW0 0 = EARLIER YOU SAID 3)",
+        "    (0 KW0 0 = BUT 3)",
+        "    (0 KW0 0 = WHY 3)",
+        "    (0 KW0 0 = TELL ME MORE ABOUT 3))",
+        "()",
+    ]
+    return [line + "\n" for line in lines]
+
+
+def synthetic_conversation(
+    keywords: int, turns: int = 30, seed: int = 0
+) -> typing.List[str]:
+    """User inputs that exercise a synthetic script's keywords."""
+    rand = random.Random(seed)
+    return [
+        f"I THINK KW{rand.randrange(keywords)} IS LIKE W{rand.randrange(keywords)} TODAY"
+        for _ in range(turns)
+    ]
+
+
+def rule_set_sizes(rule_set) -> typing.Dict[str, int]:
+    """Bytes held by a parsed script, split by what owns them.
+
+    Walks everything reachable from the rule set and charges each object to
+    the nearest ProcessingWord, DecompositionRule or ReassemblyRule it was
+    reached through, anything else is "other". Shared objects are counted once.
+    """
+    sizes = dict.fromkeys(["words", "patterns", "reassemblies", "other"], 0)
+    seen = set()
+    stack = [(rule_set, "other")]
+    while stack:
+        obj, category = stack.pop()
+        if id(obj) in seen or isinstance(obj, _NOT_OWNED):
+            continue
+        seen.add(id(obj))
+        category = _CATEGORIES.get(type(obj), category)
+        sizes[category] += sys.getsizeof(obj)
+        stack.extend((child, category) for child in gc.get_referents(obj))
+    return sizes
+
+
+@dataclasses.dataclass
+class MemoryReport:
+    name: str
+    script_bytes: int  # retained by parsing, measured with tracemalloc
+    script_breakdown: typing.Dict[str, int]
+    session_bytes: float
+    idle_session_bytes: float  # a session that hasn't had a turn yet
+    turn_peak_bytes: float  # allocated on top of what was already live
+    turn_retained_bytes: float  # still held once the garbage is collected
+
+    def metrics(self) -> typing.Dict[str, float]:
+        values = {
+            "script_bytes": self.script_bytes,
+            "session_bytes": self.session_bytes,
+            "idle_session_bytes": self.idle_session_bytes,
+            "turn_peak_bytes": self.turn_peak_bytes,
+            "turn_retained_bytes": self.turn_retained_bytes,
+        }
+        values.update(
+            (f"script_{part}_bytes", size)
+            for part, size in self.script_breakdown.items()
+        )
+        return {f"{self.name}.{key}": value for key, value in values.items()}
+
+    def format(self) -> str:
+        breakdown = ", ".join(
+            f"{part} {size}" for part, size in self.script_breakdown.items()
+        )
+        return "\n".join(
+            [
+                f"{self.name}:",
+                f"  script: {self.script_bytes} bytes ({breakdown})",
+                f"  session: {self.session_bytes:.0f} bytes, "
+                f"{self.idle_session_bytes:.0f} bytes before its first turn",
+                f"  turn: {self.turn_peak_bytes:.0f} bytes peak, "
+                f"{self.turn_retained_bytes:.0f} bytes retained",
+            ]
+        )
+
+
+def _traced() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure_memory(
+    name: str,
+    script: typing.List[str],
+    conversation: typing.List[str],
+    sessions: int = 20,
+) -> MemoryReport:
+    """Memory a script costs once parsed, per live session and per turn."""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        before = _traced()
+        rule_set = ScriptParser.parse(script)
+        script_bytes = _traced() - before
+        breakdown = rule_set_sizes(rule_set)
+
+        eliza = Eliza(script)
+        # warm up the rule set's caches, they are shared rather than per session
+        for line in conversation:
+            eliza.respond_to(line)
+        before = _traced()
+        live = []
+        for idx in range(sessions):
+            session = eliza.session(f"bench-{idx}")
+            for line in conversation:
+                session.respond_to(line)
+            live.append(session)
+        session_bytes = (_traced() - before) / sessions
+
+        before = _traced()
+        idle = [eliza.session(f"idle-{idx}") for idx in range(sessions)]
+        idle_session_bytes = (_traced() - before) / sessions
+        del idle
+
+        session = eliza.session()
+        peak_total = 0
+        before = _traced()
+        for line in conversation:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            session.respond_to(line)
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+        retained = _traced() - before
+    finally:
+        if started:
+            tracemalloc.stop()
+    return MemoryReport(
+        name,
+        script_bytes,
+        breakdown,
+        session_bytes,
+        idle_session_bytes,
+        peak_total / len(conversation),
+        retained / len(conversation),
+    )
+
+
+def memory_suite(
+    cacm_script: typing.List[str],
+    cacm_conversation: typing.List[str],
+    synthetic_sizes: typing.Iterable[int] = (100, 500),
+    sessions: int = 20,
+) -> typing.List[MemoryReport]:
+    reports = [measure_memory("cacm", cacm_script, cacm_conversation, sessions)]
+    for size in synthetic_sizes:
+        reports.append(
+            measure_memory(
+                f"synthetic-{size}",
+                synthetic_script(size),
+                synthetic_conversation(size),
+                sessions,
+            )
+        )
+    return reports
+
+
+def measure_slow_input(
+    entry: typing.Dict[str, typing.Any], max_steps: typing.Optional[int] = None
+) -> typing.Tuple[int, float]:
+    """Matching steps and seconds a slow input corpus entry takes.
+
+    A "decompose" entry matches a phrase against one pattern, with the
+    automaton rule sets match with, a "response" entry gets the reply to an
+    input from a whole script. Matching stops once it has taken more than
+    max_steps.
+    """
+    budget = MatchBudget(max_steps)
+    if entry["kind"] == "decompose":
+        automaton = DecompositionAutomaton(
+            [DecompositionParser.parse(entry["pattern"])]
+        )
+        phrase = ProcessingPhrase(entry["phrase"])
+        run = functools.partial(automaton.match, phrase, budget)
+    elif entry["kind"] == "response":
+        rule_set = ScriptParser.parse(entry["script"])
+        run = functools.partial(
+            rule_set.get_response_for, entry["input"], budget, SessionState()
+        )
+    else:
+        raise ValueError(f"unknown slow input kind '{entry['kind']}'")
+    start = time.perf_counter()
+    try:
+        run()
+    except MatchBudgetExceeded:
+        pass
+    return budget.steps, time.perf_counter() - start
+
+
+def load_corpus(path: str) -> typing.List[typing.Dict[str, typing.Any]]:
+    with open(path) as fobj:
+        return json.load(fobj)
+
+
+@dataclasses.dataclass
+class CorpusReport:
+    entries: int
+    total_steps: int
+    max_steps: int
+    total_ms: float
+    max_ms: float
+    regressions: typing.List[str]
+
+    def metrics(self) -> typing.Dict[str, float]:
+        return {
+            "corpus.total_steps": self.total_steps,
+            "corpus.max_steps": self.max_steps,
+            "corpus.total_ms": self.total_ms,
+            "corpus.max_ms": self.max_ms,
+        }
+
+    def format(self) -> str:
+        lines = [
+            f"slow inputs: {self.entries}",
+            f"  steps: {self.total_steps} total, {self.max_steps} max",
+            f"  time: {self.total_ms:.1f}ms total, {self.max_ms:.1f}ms max",
+        ]
+        lines += [f"  regression {line}" for line in self.regressions]
+        return "\n".join(lines)
+
+
+def replay_corpus(path: str) -> CorpusReport:
+    """Match every saved slow input again.
+
+    Each entry is matched with the step limit it was saved with, so inputs
+    that never finish can't hang the run. An entry that now takes more steps
+    than when it was saved is a regression.
+    """
+    entries = load_corpus(path)
+    total_steps = max_steps = 0
+    total_seconds = max_seconds = 0.0
+    regressions = []
+    for idx, entry in enumerate(entries):
+        steps, seconds = measure_slow_input(entry, entry["max_steps"])
+        total_steps += steps
+        max_steps = max(max_steps, steps)
+        total_seconds += seconds
+        max_seconds = max(max_seconds, seconds)
+        if steps > entry["steps"]:
+            regressions.append(
+                f"#{idx} {entry['kind']}: {steps} steps, saved with {entry['steps']}"
+            )
+    return CorpusReport(
+        len(entries),
+        total_steps,
+        max_steps,
+        total_seconds * 1000,
+        max_seconds * 1000,
+        regressions,
+    )
+
+
+@dataclasses.dataclass
+class TransportReport:
+    name: str
+    latency: LatencyHistogram
+
+    def metrics(self) -> typing.Dict[str, float]:
+        return {
+            f"transport.{self.name}.p50_us": self.latency.percentile(50),
+            f"transport.{self.name}.p99_us": self.latency.percentile(99),
+        }
+
+    def format(self) -> str:
+        return (
+            f"{self.name}: {self.latency.count} turns, "
+            f"p50 {self.latency.percentile(50)}us, "
+            f"p99 {self.latency.percentile(99)}us, max {self.latency.max_us}us"
+        )
+
+
+def _start_server(command: typing.List[str], path: str) -> subprocess.Popen:
+    """Run a server in its own process and wait until its socket is there."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "pyliza"] + command,
+        cwd=pathlib.Path(__file__).parent.parent,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.perf_counter() + 30
+    while not os.path.exists(path):
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(command)} exited with {process.returncode}")
+        if time.perf_counter() > deadline:
+            process.kill()
+            raise RuntimeError(f"{' '.join(command)} did not start listening")
+        time.sleep(0.05)
+    time.sleep(0.05)  # the socket is bound just before it starts listening
+    return process
+
+
+def compare_transports(
+    script_path: str,
+    conversation: typing.List[str],
+    cli_path: str,
+    turns: int = 500,
+    cli_turns: int = 5,
+) -> typing.List[TransportReport]:
+    """Round trip time of a turn over each way of talking to the engine.
+
+    The servers run in their own processes, the command line is started
+    afresh for every turn as a caller without a server would have to.
+    Pipelined rpc is the time for a window of requests shared between them.
+    """
+    from .rpc_client import Connection
+
+    inputs = [conversation[idx % len(conversation)] for idx in range(turns)]
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp:
+        rpc_path = os.path.join(tmp, "rpc.sock")
+        line_path = os.path.join(tmp, "line.sock")
+        servers = [
+            _start_server(["-s", script_path, "rpc", rpc_path], rpc_path),
+            _start_server(["-s", script_path, "serve", line_path], line_path),
+        ]
+        try:
+            conn = Connection(rpc_path)
+            latency = LatencyHistogram()
+            for text in inputs:
+                start = time.perf_counter()
+                conn.respond("bench", text)
+                latency.record(time.perf_counter() - start)
+            reports.append(TransportReport("rpc", latency))
+
+            latency = LatencyHistogram()
+            window = 64
+            for start_idx in range(0, turns, window):
+                batch = [("pipelined", text) for text in inputs[start_idx:][:window]]
+                start = time.perf_counter()
+                conn.respond_many(batch, window)
+                elapsed = time.perf_counter() - start
+                for _ in batch:
+                    latency.record(elapsed / len(batch))
+            reports.append(TransportReport("rpc-pipelined", latency))
+            conn.close()
+
+            session = SocketTarget(line_path).open_session()
+            session.greet()
+            latency = LatencyHistogram()
+            for text in inputs:
+                start = time.perf_counter()
+                session.respond(text)
+                latency.record(time.perf_counter() - start)
+            session.close()
+            reports.append(TransportReport("line-socket", latency))
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+    latency = LatencyHistogram()
+    for text in inputs[:cli_turns]:
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, cli_path, "-s", script_path],
+            input=text + "\n",
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        latency.record(time.perf_counter() - start)
+    reports.append(TransportReport("cli-spawn", latency))
+    return reports
+
+
+@dataclasses.dataclass
+class BackendReport:
+    name: str
+    backend: str
+    turns: int
+    us_per_turn: float
+    speedup: float
+
+    def metrics(self) -> typing.Dict[str, float]:
+        prefix = f"backend.{self.name}.{self.backend}"
+        return {
+            f"{prefix}.us_per_turn": self.us_per_turn,
+            f"{prefix}.speedup": self.speedup,
+        }
+
+    def format(self) -> str:
+        return (
+            f"{self.name} {self.backend}: {self.us_per_turn:.1f}us a turn "
+            f"over {self.turns} turns, {self.speedup:.2f}x the interpreter"
+        )
+
+
+def compare_backends(
+    name: str,
+    script: typing.List[str],
+    conversation: typing.List[str],
+    turns: int = 2000,
+    repeats: int = 3,
+) -> typing.List[BackendReport]:
+    """Time a turn on each backend, the best of a few runs of the conversation."""
+    from .backends import REFERENCE, backend_names
+
+    inputs = [conversation[idx % len(conversation)] for idx in range(turns)]
+    timings = {}
+    for backend in backend_names():
+        eliza = Eliza(script, backend=backend)
+        best = None
+        for _ in range(repeats):
+            session = eliza.session()
+            start = time.perf_counter()
+            for text in inputs:
+                session.respond_to(text)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[backend] = best / turns * 1e6
+    return [
+        BackendReport(name, backend, turns, us, timings[REFERENCE] / us)
+        for backend, us in timings.items()
+    ]
+
+
+def backend_suite(
+    cacm_script: typing.List[str],
+    cacm_conversation: typing.List[str],
+    synthetic_sizes: typing.Iterable[int] = (100, 500),
+) -> typing.List[BackendReport]:
+    reports = compare_backends("cacm", cacm_script, cacm_conversation)
+    for size in synthetic_sizes:
+        reports += compare_backends(
+            f"synthetic-{size}", synthetic_script(size), synthetic_conversation(size)
+        )
+    return reports
+
+
+def load_budget(path: str) -> typing.Dict[str, float]:
+    """Read a json object of metric name to the largest acceptable value."""
+    with open(path) as fobj:
+        budget = json.load(fobj)
+    if not isinstance(budget, dict):
+        raise ValueError(f"{path} should hold a json object of metric limits")
+    return budget
+
+
+def check_budget(
+    metrics: typing.Dict[str, float], budget: typing.Dict[str, float]
+) -> typing.List[str]:
+    """Describe every metric over budget, metrics that were not measured are skipped."""
+    return [
+        f"{name}: {metrics[name]:.0f} > {limit}"
+        for name, limit in budget.items()
+        if name in metrics and metrics[name] > limit
+    ]
@@ -0,0 +1,341 @@
+"""Compile a script's rules into Python functions.
+
+Every keyword with decomposition rules becomes one function that tries its
+patterns in order, then builds the reply or the linked phrase for the
+reassembly the session is on. A pattern whose only 0 is at its end becomes
+straight line code. A pattern with a 0 that has more pattern after it is
+matched by the automaton, one linear scan, as generated loops would have to
+backtrack. With a step limit the rules are matched as the interpreter does,
+steps are counted by its automaton, so both run out at the same point.
+
+The compiled code is cached next to the script and reused while the script,
+this module's version and the Python version are unchanged.
+"""
+
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os
+import types
+import typing
+
+from .automaton import DecompositionAutomaton
+from .processing import PhraseSpan, ProcessingPhrase, ProcessingWord, tag_mask
+from .ruleset import Memory, RuleSet, Transformation
+from .transformation import ReassemblyRule, TransformRule
+
+# change when the generated code changes, it invalidates every cache
+_VERSION = 4
+_CACHE_MAGIC = b"PLZC"
+
+
+def cache_path_for(script_path: typing.Union[str, os.PathLike]) -> str:
+    return os.fspath(script_path) + ".codegen"
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self.lines: typing.List[str] = []
+        self.constants: typing.List[str] = []
+        self.depth = 0
+
+    def line(self, text: str) -> None:
+        self.lines.append("    " * self.depth + text)
+
+    def constant(self, name: str, expr: str) -> str:
+        self.constants.append(f"{name} = {expr}")
+        return name
+
+
+def _slices(starts: typing.List[str]) -> str:
+    ends = starts[1:] + ["n"]
+    return ", ".join(
+        f"PhraseSpan(w, {start}, {end})" for start, end in zip(starts, ends)
+    )
+
+
+def _word_tags(part) -> typing.List[str]:
+    words = [part] if isinstance(part, ProcessingWord) else part
+    return sorted({tag for word in words for tag in word.tags})
+
+
+def _needs_automaton(trule: TransformRule) -> bool:
+    """Whether the pattern has a 0 before its end.
+
+    Generated loops would match it by backtracking, the automaton doesn't.
+    """
+    return any(part == 0 for part in trule.decompose.pattern[:-1])
+
+
+def _generate_decompose(out: _Writer, name: str, trule: TransformRule) -> None:
+    """A function returning the decomposed parts of w, or None if it doesn't match.
+
+    Only for patterns without a 0 before their end, see _needs_automaton.
+    """
+    pattern = trule.decompose.pattern
+    compiled = trule.decompose.compiled
+    out.line(f"def {name}(w, n, budget):")
+    out.depth += 1
+    out.line("if budget is not None:")
+    out.line("    budget.charge()")
+    fixed = 0 not in compiled
+    if fixed:
+        length = sum(part if isinstance(part, int) else 1 for part in compiled)
+        out.line(f"if n != {length}:")
+        out.line("    return None")
+    offset = 0
+    starts = []
+    for part_idx, (part, test) in enumerate(zip(pattern, compiled)):
+        pos = str(offset)
+        starts.append(pos)
+        if test == 0:
+            # a trailing 0 takes the rest of the phrase
+            out.line(f"return [{_slices(starts)}]")
+            out.depth = 0
+            out.line("")
+            return
+        elif isinstance(test, int):
+            offset += test
+            if not fixed:
+                out.line(f"if {offset} > n:")
+                out.line("    return None")
+        else:
+            if not fixed:
+                out.line(f"if {pos} >= n:")
+                out.line("    return None")
+            out.line(f"x = w[{pos}]")
+            if len(test.words) == 1:
+                (word,) = test.words
+                cond = f"x.word == {word!r}"
+            else:
+                words = out.constant(
+                    f"_T{name[2:]}_{part_idx}", repr(frozenset(test.words))
+                )
+                cond = f"x.word in {words}"
+            tags = _word_tags(part)
+            if tags:
+                mask = out.constant(f"_M{name[2:]}_{part_idx}", f"tag_mask({tags!r})")
+                cond = f"{cond} or x.tag_mask & {mask}"
+            out.line(f"if not ({cond}):")
+            out.line("    return None")
+            offset += 1
+    out.line(f"return [{_slices(starts)}]")
+    out.depth = 0
+    out.line("")
+
+
+def _phrase_expr(out: _Writer, name: str, reassembly: ReassemblyRule) -> str:
+    if reassembly.parts is None:
+        return "ProcessingPhrase.trusted(parts[0].source)"
+    pieces = []
+    for part_idx, part in enumerate(reassembly.parts):
+        if isinstance(part, int):
+            pieces.append(f"*parts[{part - 1}]")
+        elif part:
+            words = ", ".join(f"ProcessingWord({w.word!r})" for w in part)
+            pieces.append("*" + out.constant(f"_C{name}_{part_idx}", f"({words},)"))
+    return f"ProcessingPhrase.trusted([{', '.join(pieces)}])"
+
+
+def _text_expr(reassembly: ReassemblyRule) -> str:
+    pieces = [
+        repr(piece) if isinstance(piece, str) else f"_text(parts[{piece}])"
+        for piece in reassembly.template
+    ]
+    if all(isinstance(piece, str) for piece in reassembly.template):
+        return repr(" ".join(reassembly.template))
+    return f'" ".join(filter(None, [{", ".join(pieces)}]))'
+
+
+def _generate_reassemble(out: _Writer, name: str, trule: TransformRule) -> None:
+    """A function giving (link, phrase) or (None, reply text) for decomposed parts."""
+    reassemblies = list(trule.reassemble)
+    out.line(f"def {name}(parts, render, state):")
+    out.depth += 1
+    if len(reassemblies) > 1:
+        out.line(
+            f"k = state.next_reassembly({trule.rule_id}, {len(reassemblies)})"
+            " if state is not None else 0"
+        )
+    for idx, reassembly in enumerate(reassemblies):
+        if len(reassemblies) > 1:
+            if idx == 0:
+                out.line("if k == 0:")
+            elif idx < len(reassemblies) - 1:
+                out.line(f"elif k == {idx}:")
+            else:
+                out.line("else:")
+            out.depth += 1
+        phrase = _phrase_expr(out, f"{name[2:]}_{idx}", reassembly)
+        if reassembly.link is not None:
+            link = out.constant(
+                f"_L{name[2:]}_{idx}", f"ProcessingWord({reassembly.link.word!r})"
+            )
+            out.line(f"return {link}, {phrase}")
+        else:
+            out.line("if render:")
+            out.line(f"    return None, {_text_expr(reassembly)}")
+            out.line(f"return None, {phrase}")
+        if len(reassemblies) > 1:
+            out.depth -= 1
+    out.depth = 0
+    out.line("")
+
+
+def _compiled_rules(
+    rule_set: RuleSet,
+) -> typing.Iterator[typing.Tuple[int, typing.Iterable[TransformRule]]]:
+    """The ordinal and decomposition rules of every rule that has them."""
+    seen = set()
+    for rule in list(rule_set.rules.values()) + list(rule_set.memory_rules.values()):
+        if rule.ordinal in seen:
+            continue
+        seen.add(rule.ordinal)
+        if isinstance(rule, Transformation):
+            yield rule.ordinal, rule.transformation_rules
+        elif isinstance(rule, Memory):
+            yield rule.ordinal, rule.memory_rules
+
+
+def generate_source(rule_set: RuleSet) -> str:
+    """Python source with a function for each keyword, keyed by the rule's ordinal.
+
+    keyword(phrase, render, budget, state, memo) returns what apply_transform
+    would or None when no decomposition matches. The memo is keyed by the
+    generated code's own pattern ids, which is fine as a rule set runs either
+    the generated code or the interpreter, never both.
+    """
+    out = _Writer()
+    keywords = []
+    # identical patterns share one function and one id in the turn's memo
+    patterns: typing.Dict[tuple, int] = {}
+    for ordinal, trules in _compiled_rules(rule_set):
+        calls = []
+        for idx, trule in enumerate(trules):
+            key = tuple(trule.decompose.compiled)
+            pattern_id = patterns.get(key)
+            if pattern_id is None:
+                pattern_id = patterns[key] = len(patterns)
+                if _needs_automaton(trule):
+                    out.constant(f"_d{pattern_id}", f"_fallback({ordinal}, {idx})")
+                else:
+                    _generate_decompose(out, f"_d{pattern_id}", trule)
+            _generate_reassemble(out, f"_a{ordinal}_{idx}", trule)
+            calls.append((pattern_id, f"_a{ordinal}_{idx}"))
+        out.line(f"def keyword_{ordinal}(phrase, render, budget, state, memo):")
+        out.depth += 1
+        out.line("w = phrase.words")
+        out.line("n = len(w)")
+        for pattern_id, reassemble in calls:
+            out.line(
+                f"parts = _d{pattern_id}(w, n, budget) if memo is None"
+                f" else memo.match({pattern_id}, w, _d{pattern_id}, budget)"
+            )
+            out.line("if parts is not None:")
+            out.line(f"    return {reassemble}(parts, render, state)")
+        out.line("return None")
+        out.depth = 0
+        out.line("")
+        keywords.append(f"{ordinal}: keyword_{ordinal}")
+    header = "# generated by pyliza.codegen, do not edit\n"
+    return (
+        header
+        + "\n".join(out.constants)
+        + "\n\n"
+        + "\n".join(out.lines)
+        + f"\n\nKEYWORDS = {{{', '.join(keywords)}}}\n"
+    )
+
+
+def _cache_key(script_text: str) -> bytes:
+    digest = hashlib.sha256()
+    digest.update(f"{_VERSION}\0".encode())
+    digest.update(importlib.util.MAGIC_NUMBER)
+    digest.update(script_text.encode())
+    return digest.digest()
+
+
+def _read_cache(path: str, key: bytes) -> typing.Optional[types.CodeType]:
+    try:
+        with open(path, "rb") as fobj:
+            data = fobj.read()
+    except OSError:
+        return None
+    header = _CACHE_MAGIC + key
+    if not data.startswith(header):
+        return None
+    try:
+        return marshal.loads(data[len(header) :])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+def _write_cache(path: str, key: bytes, code: types.CodeType) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as fobj:
+            fobj.write(_CACHE_MAGIC + key + marshal.dumps(code))
+        os.replace(tmp_path, path)
+    except OSError as err:
+        logging.getLogger("codegen").warning(f"could not cache compiled rules: {err}")
+
+
+def compile_rule_set(
+    rule_set: RuleSet, script_text: str, cache_path: typing.Optional[str] = None
+) -> types.CodeType:
+    """The compiled module for the script, from the cache if it is up to date.
+
+    Generating the code parses every rule, so a lazy rule set loses its lazy
+    start up the first time a script is compiled but not after that.
+    """
+    key = _cache_key(script_text)
+    if cache_path is not None:
+        code = _read_cache(cache_path, key)
+        if code is not None:
+            return code
+    code = compile(generate_source(rule_set), "<pyliza codegen>", "exec")
+    if cache_path is not None:
+        _write_cache(cache_path, key, code)
+    return code
+
+
+def install(rule_set: RuleSet, code: types.CodeType) -> None:
+    """Make the rule set's transformations and memories use the compiled code."""
+    rules = {}
+    for rule in list(rule_set.rules.values()) + list(rule_set.memory_rules.values()):
+        rules[rule.ordinal] = rule
+
+    def fallback(ordinal: int, idx: int):
+        automaton = None
+
+        def build() -> None:
+            nonlocal automaton
+            if automaton is None:
+                rule = rules[ordinal]
+                trules = (
+                    rule.memory_rules
+                    if isinstance(rule, Memory)
+                    else rule.transformation_rules
+                )
+                automaton = DecompositionAutomaton([trules[idx].decompose])
+
+        def decompose(words, _, budget):
+            build()
+            match = automaton.match_words(words, budget)
+            return match[1] if match is not None else None
+
+        rule_set.add_builder(build)
+        return decompose
+
+    namespace = {
+        "PhraseSpan": PhraseSpan,
+        "ProcessingPhrase": ProcessingPhrase,
+        "ProcessingWord": ProcessingWord,
+        "tag_mask": tag_mask,
+        "_fallback": fallback,
+        "_text": lambda segment: " ".join([w.word for w in segment]),
+    }
+    exec(code, namespace)
+    for ordinal, keyword in namespace["KEYWORDS"].items():
+        rules[ordinal].compiled = keyword
@@ -0,0 +1,180 @@
+"""A background process that keeps scripts parsed for command line clients.
+
+A client connects to the daemon's unix socket and sends the absolute path of
+its script on a line. The daemon answers OK, or ERROR and a reason, then the
+conversation goes as it does with serve, a greeting and then a line out for
+every line in. Scripts are parsed the first time a client asks for them and
+again whenever the file's modification time or size changes. The daemon exits
+once it has had no clients for the idle timeout. See daemon_client for the
+client, which starts the daemon when there isn't one.
+"""
+
+import fcntl
+import logging
+import os
+import socketserver
+import threading
+import time
+import typing
+
+from .eliza import Eliza
+from .server import _UnixServer
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        try:
+            path = self.rfile.readline().decode(errors="replace").strip()
+            try:
+                eliza = server.eliza_for(path)
+            except Exception as err:
+                server.log.warning(f"could not load {path}: {err}")
+                reason = " ".join(str(err).split())
+                self.wfile.write(f"ERROR {reason}\n".encode())
+                return
+            session = eliza.session()
+            self.wfile.write(b"OK\n" + session.greet().encode())
+            for raw_line in self.rfile:
+                line = raw_line.decode(errors="replace").strip()
+                try:
+                    response = session.respond_to(line)
+                except Exception:
+                    server.log.exception(f"failed to respond to '{line}'")
+                    return
+                self.wfile.write(response.encode())
+        finally:
+            server.connection_closed()
+
+
+class DaemonServer(_UnixServer):
+    """Serves conversations on any script the clients name.
+
+    Parsed scripts are kept for as long as the daemon runs, a session keeps
+    the rules it started with when its script is reloaded.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        idle_timeout: typing.Optional[float] = 600.0,
+        backend: str = "interpreter",
+    ) -> None:
+        self.log = logging.getLogger("daemon")
+        self._idle_timeout = idle_timeout
+        self._backend = backend
+        self._scripts: typing.Dict[str, typing.Tuple[typing.Tuple[int, int], Eliza]] = (
+            {}
+        )
+        self._scripts_lock = threading.Lock()
+        self._active = 0
+        self._last_used = time.monotonic()
+        self._activity = threading.Condition()
+        self._stopped = threading.Event()
+        super().__init__(path, _DaemonHandler)
+
+    def eliza_for(self, path: str) -> Eliza:
+        """The parsed script at path, parsed again if the file has changed."""
+        if not os.path.isabs(path):
+            raise ValueError(f"script path must be absolute, not '{path}'")
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._scripts_lock:
+            loaded = self._scripts.get(path)
+            if loaded is not None and loaded[0] == version:
+                return loaded[1]
+            codegen_cache = None
+            if self._backend == "codegen":
+                from .codegen import cache_path_for
+
+                codegen_cache = cache_path_for(path)
+            with open(path) as fobj:
+                eliza = Eliza(fobj, backend=self._backend, codegen_cache=codegen_cache)
+            self.log.info(f"{'reloaded' if loaded else 'loaded'} {path}")
+            self._scripts[path] = (version, eliza)
+            return eliza
+
+    def process_request(self, request, client_address):
+        # counted here rather than in the handler's thread, so a connection
+        # that has just been accepted can't be taken for idleness
+        with self._activity:
+            self._active += 1
+        super().process_request(request, client_address)
+
+    def connection_closed(self) -> None:
+        with self._activity:
+            self._active -= 1
+            self._last_used = time.monotonic()
+            self._activity.notify_all()
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        """Serve until shutdown is called or no client has come for a while."""
+        if self._idle_timeout is not None:
+            threading.Thread(target=self._watch_idle, daemon=True).start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._stopped.set()
+        self._accept_waiting()
+        # let clients accepted just before the shutdown finish
+        with self._activity:
+            self._activity.wait_for(lambda: self._active == 0)
+
+    def _watch_idle(self) -> None:
+        interval = min(1.0, self._idle_timeout / 4)
+        while not self._stopped.wait(interval):
+            with self._activity:
+                idle = self._active == 0 and (
+                    time.monotonic() - self._last_used >= self._idle_timeout
+                )
+            if idle:
+                self.log.info("idle, shutting down")
+                # clients that come now start another daemon rather than
+                # connecting to this one
+                try:
+                    os.unlink(self.server_address)
+                except OSError:
+                    pass
+                self.shutdown()
+                return
+
+    def _accept_waiting(self) -> None:
+        """Serve the clients that connected but weren't accepted before shutdown."""
+        self.socket.setblocking(False)
+        while True:
+            try:
+                request, client_address = self.get_request()
+            except OSError:
+                return
+            request.setblocking(True)
+            self.process_request(request, client_address)
+
+
+def run_daemon(
+    path: str,
+    idle_timeout: typing.Optional[float] = 600.0,
+    backend: str = "interpreter",
+) -> int:
+    """Serve on path unless another daemon already is, returns an exit status."""
+    log = logging.getLogger("daemon")
+    # held for as long as this daemon runs, so two clients starting a daemon
+    # at once can't replace each other's socket
+    lock = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        log.info(f"a daemon is already serving on {path}")
+        lock.close()
+        return 0
+    try:
+        if os.path.exists(path):
+            os.unlink(path)  # left behind by a daemon that was killed
+        with DaemonServer(path, idle_timeout, backend) as server:
+            log.info(f"daemon serving on {path}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        lock.close()
+    return 0
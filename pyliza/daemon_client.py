@@ -0,0 +1,156 @@
+"""Client for the script daemon, only needs the standard library.
+
+Importing this does not import the engine, so a command line call that hands
+its conversation to a running daemon starts as quickly as Python can. When
+no daemon is listening one is started in the background, it exits by itself
+once it has been idle for a while.
+"""
+
+import os
+import socket
+import sys
+import time
+import typing
+
+from .terminal import TerminalColours, print_colour
+
+
+class DaemonError(Exception):
+    """The daemon could not start the conversation."""
+
+
+def default_socket_path() -> str:
+    directory = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR", "/tmp")
+    return os.path.join(directory, f"pyliza-{os.getuid()}.sock")
+
+
+def start_daemon(path: str, idle_timeout: float = 600.0) -> None:
+    """Start a daemon on path in the background, it runs on after we exit."""
+    import subprocess
+
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [package_root, env.get("PYTHONPATH")])
+    )
+    subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "pyliza",
+            "daemon",
+            path,
+            "--idle-timeout",
+            str(idle_timeout),
+        ],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+class DaemonSession:
+    """One conversation with the daemon, on the script at script_path.
+
+    The daemon is started if it isn't running, and connecting tried again for
+    up to start_timeout seconds while it starts up. Once connected, a daemon
+    that refuses the script or goes away before answering raises DaemonError.
+    """
+
+    def __init__(
+        self,
+        script_path: str,
+        socket_path: typing.Optional[str] = None,
+        idle_timeout: float = 600.0,
+        start_timeout: float = 10.0,
+    ) -> None:
+        socket_path = socket_path or default_socket_path()
+        deadline = next_start = None
+        while True:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self._sock.connect(socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # nothing listening, a daemon started while another one still
+                # finishes its last conversations exits straight away
+                self._sock.close()
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + start_timeout
+                elif now > deadline:
+                    raise
+                if next_start is None or now >= next_start:
+                    start_daemon(socket_path, idle_timeout)
+                    next_start = now + 1.0
+                time.sleep(0.005)
+        self._start(os.path.abspath(script_path))
+
+    def _start(self, script_path: str) -> None:
+        self._file = self._sock.makefile("rwb")
+        try:
+            self._file.write(script_path.encode() + b"\n")
+            self._file.flush()
+            status = self._file.readline()
+        except OSError as err:
+            self.close()
+            raise DaemonError(f"daemon closed the connection: {err}") from err
+        if status != b"OK\n":
+            self.close()
+            if not status:
+                raise DaemonError("daemon closed the connection before answering")
+            raise DaemonError(status.decode(errors="replace").strip())
+        self._greeting = self._file.readline().decode()
+
+    def greet(self) -> str:
+        return self._greeting
+
+    def respond(self, text: str) -> str:
+        self._file.write(text.replace("\n", " ").encode() + b"\n")
+        self._file.flush()
+        reply = self._file.readline()
+        if not reply:
+            raise ConnectionResetError("daemon closed the connection")
+        return reply.decode()
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self) -> "DaemonSession":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def simulate(
+    script_path: str,
+    conversation: typing.Iterable[str],
+    socket_path: typing.Optional[str] = None,
+    idle_timeout: float = 600.0,
+):
+    """Run through a prerecorded conversation on the daemon, see interface.simulate."""
+    with DaemonSession(script_path, socket_path, idle_timeout) as session:
+        print_colour(session.greet(), TerminalColours.ELIZA, end="")
+        for line in map(str.strip, conversation):
+            if not line or line.startswith("#"):
+                continue
+            print_colour(line, TerminalColours.USER)
+            print_colour(session.respond(line), TerminalColours.ELIZA, end="")
+
+
+def run_commandline(
+    script_path: str,
+    socket_path: typing.Optional[str] = None,
+    idle_timeout: float = 600.0,
+):
+    with DaemonSession(script_path, socket_path, idle_timeout) as session:
+        try:
+            user_response = input(session.greet())
+            while True:
+                user_response = input(session.respond(user_response))
+        except (KeyboardInterrupt, EOFError):
+            print("GOODBYE")
@@ -1,42 +1,107 @@
-import logging
 import typing
-import random
-import re
 
+from .backends import use_backend
 from .rule_parsing import ScriptParser
-from . import utils
+from .ruleset import RuleSet
+from .session import Session
+from .state import SessionState
+
+if typing.TYPE_CHECKING:
+    from .capture import CaptureWriter
+    from .profiling import Profiler
+    from .shadow import ShadowRunner
+    from .store import SessionStore
+    from .transcript import TranscriptWriter
 
 
 class Eliza:
-    none_re = re.compile("(^|\s)NONE(\s|$)")
-    memory_re = re.compile("(^|\s)MEMORY(\s|$)")
-    rev_none_re = re.compile("(^|\s)zNONE(\s|$)")
-    rev_memory_re = re.compile("(^|\s)zMEMORY(\s|$)")
+    def __init__(
+        self,
+        script: typing.Iterable[str],
+        lazy: bool = False,
+        transcript: typing.Optional["TranscriptWriter"] = None,
+        session_id: typing.Optional[str] = None,
+        max_match_steps: typing.Optional[int] = None,
+        max_match_seconds: typing.Optional[float] = None,
+        store: typing.Optional["SessionStore"] = None,
+        backend: str = "interpreter",
+        codegen_cache: typing.Optional[str] = None,
+        profiler: typing.Optional["Profiler"] = None,
+        capture: typing.Optional["CaptureWriter"] = None,
+        shadow: typing.Optional["ShadowRunner"] = None,
+        optimize: bool = False,
+    ):
+        script = list(script)
+        script_text = "".join(script)
+        self._rule_set = ScriptParser.parse(script, lazy)
+        if optimize:
+            from . import optimizer
+
+            optimizer.optimize(self._rule_set)
+            # generated code for the optimized rules is cached apart
+            script_text += "\n; optimized\n"
+        use_backend(self._rule_set, backend, script_text, codegen_cache)
+        if store is not None and store.fingerprint is None:
+            # saved state only makes sense with the script it was saved with
+            from .store import script_fingerprint
+
+            store.fingerprint = script_fingerprint(script)
+        self._transcript = transcript
+        self._store = store
+        self._profiler = profiler
+        self._capture = capture
+        self._shadow = shadow
+        self._max_match_steps = max_match_steps
+        self._max_match_seconds = max_match_seconds
+        self._session = self.session(session_id)
+
+    @property
+    def rule_set(self) -> RuleSet:
+        return self._rule_set
 
-    def __init__(self, script: typing.Iterable[str]):
-        self._rule_set = ScriptParser.parse(script)
+    @property
+    def session_id(self) -> str:
+        return self._session.session_id
+
+    def session(
+        self,
+        session_id: typing.Optional[str] = None,
+        state: typing.Optional[SessionState] = None,
+    ) -> Session:
+        """Start another conversation that shares this script.
+
+        With a store, a session that was saved before carries on from its saved
+        state unless another state is given.
+        """
+        if state is None and session_id is not None and self._store is not None:
+            state = self._store.load(session_id)
+        return Session(
+            self._rule_set,
+            session_id,
+            state,
+            self._transcript,
+            self._max_match_steps,
+            self._max_match_seconds,
+            self._store,
+            self._profiler,
+            self._capture,
+            self._shadow,
+        )
 
     def greet(self) -> str:
         """Pick a random greeting from the available options."""
-        return random.choice(self._rule_set.greetings)
+        return self._session.greet()
 
     def respond_to(self, user_input: str) -> str:
         """Get the appropriate response to the user."""
-        u_input = self.none_re.sub("zNONE", user_input.upper())
-        u_input = self.memory_re.sub("zMEMORY", u_input)
-
-        response = None
-        for phrase in utils.split_phrases(u_input):
-            response = self._rule_set.get_response_for(phrase)
-            if response is not None:
-                break
+        return self._session.respond_to(user_input)
 
-        if response is None:
-            response = self._rule_set.get_no_keyword_reponse()
+    def fork(self, session_id: typing.Optional[str] = None) -> Session:
+        """Branch the conversation, see Session.fork."""
+        return self._session.fork(session_id)
 
-        return self._finalise_response(response)
+    def snapshot(self) -> SessionState:
+        return self._session.snapshot()
 
-    def _finalise_response(self, response: str) -> str:
-        response = self.rev_none_re.sub("NONE", response)
-        response = self.rev_memory_re.sub("MEMORY", response)
-        return response.strip() + "\n"
+    def restore(self, snapshot: SessionState) -> None:
+        self._session.restore(snapshot)
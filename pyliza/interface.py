@@ -3,23 +3,25 @@ import typing
 import enum
 
 from .eliza import Eliza
+from .terminal import TerminalColours, print_colour
+from .transcript import TranscriptWriter
 
+if typing.TYPE_CHECKING:
+    from .profiling import Profiler
 
-class TerminalColours:
-    ELIZA = 96
-    USER = 95
 
-
-def print_colour(text: str, colour_code: int, *args, **kwargs):
-    print(f"\033[{colour_code}m" + text + f"\033[0m", *args, **kwargs)
-
-
-def simulate(script: typing.Iterable[str], conversation: typing.Iterable[str]):
+def simulate(
+    script: typing.Iterable[str],
+    conversation: typing.Iterable[str],
+    lazy: bool = False,
+    transcript: typing.Optional[TranscriptWriter] = None,
+    profiler: typing.Optional["Profiler"] = None,
+):
     """Run through a prerecorded conversation."""
     log = logging.getLogger("pyliza")
     log.info("starting up Pyliza conversation simulator")
 
-    eliza = Eliza(script)
+    eliza = Eliza(script, lazy, transcript, profiler=profiler)
     print_colour(eliza.greet(), TerminalColours.ELIZA, end="")
     for line in map(str.strip, conversation):
         if not line or line.startswith("#"):
@@ -29,11 +31,16 @@ def simulate(script: typing.Iterable[str], conversation: typing.Iterable[str]):
         print_colour(eliza.respond_to(line), TerminalColours.ELIZA, end="")
 
 
-def run_commandline(script: typing.Iterable[str]):
+def run_commandline(
+    script: typing.Iterable[str],
+    lazy: bool = False,
+    transcript: typing.Optional[TranscriptWriter] = None,
+    profiler: typing.Optional["Profiler"] = None,
+):
     log = logging.getLogger("pyliza")
     log.info("starting up Pyliza command line")
 
-    eliza = Eliza(script)
+    eliza = Eliza(script, lazy, transcript, profiler=profiler)
 
     try:
         user_response = input(eliza.greet())
@@ -0,0 +1,311 @@
+import collections
+import dataclasses
+import logging
+import socket
+import threading
+import time
+import tracemalloc
+import typing
+
+from .eliza import Eliza
+from .session import Session
+from .server import parse_address
+
+if typing.TYPE_CHECKING:
+    from .profiling import Profiler
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram in the style of HdrHistogram.
+
+    Values are kept in microseconds, every bucket is at most 2**-precision_bits
+    wide relative to its value, so recording is O(1) and memory stays small
+    however many samples are taken.
+    """
+
+    def __init__(self, precision_bits: int = 7) -> None:
+        self._precision_bits = precision_bits
+        self._counts: typing.Counter[int] = collections.Counter()
+        self.count = 0
+        self.max_us = 0
+
+    def record(self, seconds: float) -> None:
+        value = max(0, int(seconds * 1_000_000))
+        shift = max(0, value.bit_length() - self._precision_bits)
+        self._counts[(value >> shift) << shift] += 1
+        self.count += 1
+        self.max_us = max(self.max_us, value)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        self._counts.update(other._counts)
+        self.count += other.count
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentile(self, pct: float) -> int:
+        """Value in microseconds that pct percent of the samples are at or below."""
+        if not self.count:
+            return 0
+        target = max(1, self.count * pct / 100)
+        seen = 0
+        for value, count in sorted(self._counts.items()):
+            seen += count
+            if seen >= target:
+                return min(value, self.max_us)
+        return self.max_us
+
+    def distribution(
+        self, percentiles=(50, 75, 90, 95, 99, 99.9, 99.99)
+    ) -> typing.List[typing.Tuple[float, int]]:
+        return [(pct, self.percentile(pct)) for pct in percentiles]
+
+
+class EngineTarget:
+    """Runs sessions against the engine in this process."""
+
+    name = "engine"
+
+    def __init__(
+        self,
+        script: typing.Iterable[str],
+        lazy: bool = True,
+        backend: str = "interpreter",
+        codegen_cache: typing.Optional[str] = None,
+        profiler: typing.Optional["Profiler"] = None,
+    ) -> None:
+        self._eliza = Eliza(
+            script,
+            lazy,
+            backend=backend,
+            codegen_cache=codegen_cache,
+            profiler=profiler,
+        )
+
+    def open_session(self) -> "_EngineSession":
+        return _EngineSession(self._eliza.session())
+
+
+class _EngineSession:
+    def __init__(self, session: Session) -> None:
+        self._session = session
+
+    def greet(self) -> str:
+        return self._session.greet()
+
+    def respond(self, text: str) -> str:
+        return self._session.respond_to(text)
+
+    def close(self) -> None:
+        pass
+
+
+class SocketTarget:
+    """Runs sessions against a line based server, one connection per session."""
+
+    name = "socket"
+
+    def __init__(self, address: str, timeout: float = 10.0) -> None:
+        self._address = address
+        self._timeout = timeout
+
+    def open_session(self) -> "_SocketSession":
+        family, addr = parse_address(self._address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        sock.connect(addr)
+        return _SocketSession(sock)
+
+
+class _SocketSession:
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+
+    def greet(self) -> str:
+        return self._read_line()
+
+    def respond(self, text: str) -> str:
+        self._sock.sendall(text.encode() + b"\n")
+        return self._read_line()
+
+    def _read_line(self) -> str:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("server closed the conversation")
+        return line.decode()
+
+    def close(self) -> None:
+        self._reader.close()
+        self._sock.close()
+
+
+@dataclasses.dataclass
+class LoadTestReport:
+    target: str
+    sessions: int
+    turns: int
+    duration_s: float
+    latency: LatencyHistogram
+    errors: typing.Counter[str]
+    offered_rate: typing.Optional[float] = None
+    memory_per_session: typing.Optional[float] = None
+    memory_peak: typing.Optional[int] = None
+
+    @property
+    def throughput(self) -> float:
+        return self.turns / self.duration_s if self.duration_s else 0.0
+
+    def format(self) -> str:
+        mode = (
+            f"open loop at {self.offered_rate:g} turns/s"
+            if self.offered_rate
+            else "closed loop"
+        )
+        lines = [
+            f"target: {self.target} ({mode})",
+            f"sessions: {self.sessions}, turns: {self.turns}, "
+            f"errors: {sum(self.errors.values())}",
+            f"duration: {self.duration_s:.3f}s, throughput: {self.throughput:.1f} turns/s",
+            "latency (us):",
+        ]
+        for pct, value in self.latency.distribution():
+            lines.append(f"  p{pct:<6g} {value:>10d}")
+        lines.append(f"  max     {self.latency.max_us:>10d}")
+        for error, count in self.errors.most_common():
+            lines.append(f"error {error}: {count}")
+        if self.memory_per_session is not None:
+            lines.append(
+                f"memory: {self.memory_per_session:.0f} bytes per session, "
+                f"peak {self.memory_peak} bytes"
+            )
+        return "\n".join(lines)
+
+
+def read_corpus(paths: typing.Iterable[str]) -> typing.List[typing.List[str]]:
+    """Load transcripts as lists of user inputs, lines starting with # are replies."""
+    corpus = []
+    for path in paths:
+        with open(path) as fobj:
+            corpus.append(
+                [
+                    line
+                    for line in map(str.strip, fobj)
+                    if line and not line.startswith("#")
+                ]
+            )
+    return corpus
+
+
+class LoadTest:
+    """Drive many concurrent synthetic conversations at a target.
+
+    Without a rate every session sends its next turn as soon as it gets the
+    reply (closed loop). With a rate the turns are sent on a fixed schedule
+    shared between the sessions, and latency is measured from when a turn was
+    due rather than when it was sent, so a stalled target is not hidden.
+    """
+
+    def __init__(
+        self,
+        target,
+        corpus: typing.List[typing.List[str]],
+        sessions: int = 10,
+        iterations: int = 1,
+        rate: typing.Optional[float] = None,
+        trace_memory: bool = False,
+    ) -> None:
+        if not corpus or not any(corpus):
+            raise ValueError("the corpus needs at least one conversation")
+        self._target = target
+        self._corpus = [c for c in corpus if c]
+        self._sessions = sessions
+        self._iterations = iterations
+        self._rate = rate
+        self._trace_memory = trace_memory
+        self._log = logging.getLogger("loadtest")
+
+    def run(self) -> LoadTestReport:
+        latency = LatencyHistogram()
+        errors: typing.Counter[str] = collections.Counter()
+        lock = threading.Lock()
+        live_sessions = []
+        start_barrier = threading.Barrier(self._sessions + 1)
+
+        if self._trace_memory:
+            tracemalloc.start()
+        memory_base = tracemalloc.get_traced_memory()[0] if self._trace_memory else 0
+
+        def worker(idx: int):
+            hist = LatencyHistogram()
+            errs: typing.Counter[str] = collections.Counter()
+            start_barrier.wait()
+            self._run_session(idx, hist, errs, live_sessions)
+            with lock:
+                latency.merge(hist)
+                errors.update(errs)
+
+        threads = [
+            threading.Thread(target=worker, args=(idx,), daemon=True)
+            for idx in range(self._sessions)
+        ]
+        for thread in threads:
+            thread.start()
+        self._start = time.perf_counter()
+        start_barrier.wait()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - self._start
+
+        report = LoadTestReport(
+            self._target.name,
+            self._sessions,
+            latency.count,
+            duration,
+            latency,
+            errors,
+            offered_rate=self._rate,
+        )
+        if self._trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report.memory_per_session = (current - memory_base) / max(
+                1, len(live_sessions)
+            )
+            report.memory_peak = peak
+        for session in live_sessions:
+            session.close()
+        return report
+
+    def _run_session(self, idx, hist, errs, live_sessions):
+        conversation = self._corpus[idx % len(self._corpus)]
+        turn = 0
+        for _ in range(self._iterations):
+            try:
+                session = self._target.open_session()
+                session.greet()
+            except Exception as err:
+                errs[type(err).__name__] += 1
+                continue
+            live_sessions.append(session)
+            for line in conversation:
+                due = self._due_time(idx, turn)
+                turn += 1
+                if due is not None:
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                sent = time.perf_counter() if due is None else due
+                try:
+                    session.respond(line)
+                except ConnectionError as err:
+                    errs[type(err).__name__] += 1
+                    break
+                except Exception as err:
+                    self._log.debug(f"session {idx} failed on '{line}': {err}")
+                    errs[type(err).__name__] += 1
+                    continue
+                hist.record(time.perf_counter() - sent)
+
+    def _due_time(self, idx, turn) -> typing.Optional[float]:
+        if not self._rate:
+            return None
+        return self._start + (turn * self._sessions + idx) / self._rate
@@ -0,0 +1,29 @@
+import collections
+import threading
+import typing
+
+
+class Metrics:
+    """Thread safe named counters."""
+
+    def __init__(self) -> None:
+        self._counters: typing.Counter[str] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, name: str) -> int:
+        return self._counters[name]
+
+    def snapshot(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+METRICS = Metrics()
@@ -0,0 +1,266 @@
+"""Remove rules from a parsed script that only cost matching time.
+
+A decomposition after one that matches any phrase, or after one with the same
+pattern, is never the first to match. A keyword whose every reassembly only
+passes the phrase on to keywords that aren't defined does nothing but log an
+error. The earlier definition of a keyword defined twice is never used.
+Matching still pays for the first two, every pattern of a keyword is part of
+its automaton, which steps through the pattern's states at every word.
+Identical reassemblies and reassembly lists are shared too.
+
+Removing a dead keyword is the one change to replies, a turn whose only
+keyword was one of them gets the reply for no keywords instead of its own
+words back.
+"""
+
+import dataclasses
+import logging
+import typing
+
+from .processing import ProcessingWord
+from .ruleset import (
+    ElizaRule,
+    Equivalence,
+    Memory,
+    RuleSet,
+    Transformation,
+    UnconditionalSubstitution,
+)
+from .transformation import DecompositionRule, ReassemblyRule, TransformRule
+
+SHADOWED = "shadowed"
+DEAD_KEYWORD = "dead keyword"
+DEAD_LINK = "dead link"
+OVERWRITTEN = "overwritten"
+
+
+@dataclasses.dataclass
+class Finding:
+    keyword: str
+    kind: str
+    detail: str
+    # estimated automaton steps no longer taken when the keyword is matched,
+    # see PatternComplexity
+    saved_cost: int = 0
+
+
+@dataclasses.dataclass
+class OptimizationReport:
+    findings: typing.List[Finding] = dataclasses.field(default_factory=list)
+    merged_reassemblies: int = 0
+    merged_lists: int = 0
+
+    @property
+    def saved_cost(self) -> int:
+        return sum(f.saved_cost for f in self.findings)
+
+    def saved_by_keyword(self) -> typing.Dict[str, int]:
+        saved: typing.Dict[str, int] = {}
+        for finding in self.findings:
+            saved[finding.keyword] = saved.get(finding.keyword, 0) + finding.saved_cost
+        return saved
+
+    def format(self) -> str:
+        saved = self.saved_by_keyword()
+        lines = []
+        for keyword in sorted(saved, key=lambda k: (-saved[k], k)):
+            lines.append(f"{saved[keyword]:>12d} {keyword}")
+            for finding in self.findings:
+                if finding.keyword == keyword:
+                    lines.append(f"{'':>12s}   {finding.kind}: {finding.detail}")
+        removed = sum(f.kind == SHADOWED for f in self.findings)
+        dead = sum(f.kind == DEAD_KEYWORD for f in self.findings)
+        lines.append(
+            f"removed {removed} decompositions and {dead} keywords, shared "
+            f"{self.merged_reassemblies} reassemblies and {self.merged_lists} "
+            f"reassembly lists, estimated {self.saved_cost} matching steps saved"
+        )
+        return "\n".join(lines)
+
+
+def _is_catch_all(decompose: DecompositionRule) -> bool:
+    return all(isinstance(part, int) and part == 0 for part in decompose.pattern)
+
+
+def _reachable(
+    keyword: str,
+    trules: typing.List[TransformRule],
+    phrase_length: typing.Optional[int],
+    report: OptimizationReport,
+) -> typing.List[TransformRule]:
+    """The rules that can be the first to match, the others are reported."""
+    kept = []
+    seen: typing.Dict[tuple, int] = {}
+    catch_all = None
+    for idx, trule in enumerate(trules):
+        key = tuple(trule.decompose.compiled)
+        if catch_all is not None:
+            reason = f"comes after #{catch_all}, which matches anything"
+        elif key in seen:
+            reason = f"has the same pattern as #{seen[key]}"
+        else:
+            seen[key] = idx
+            if _is_catch_all(trule.decompose):
+                catch_all = idx
+            kept.append(trule)
+            continue
+        report.findings.append(
+            Finding(
+                keyword,
+                SHADOWED,
+                f"#{idx} ({trule.decompose}) {reason}",
+                trule.decompose.complexity().estimate(phrase_length),
+            )
+        )
+    return kept
+
+
+def _links_away(
+    rule: ElizaRule, undefined: typing.Callable[[ProcessingWord], bool]
+) -> bool:
+    """Whether the rule only ever passes the phrase on unchanged to undefined keys."""
+    if isinstance(rule, Equivalence):
+        return undefined(rule.equivalent_keyword)
+    if not isinstance(rule, Transformation):
+        return False
+    reassemblies = [r for t in rule.transformation_rules for r in t.reassemble]
+    return bool(reassemblies) and all(
+        r.parts is None and r.link is not None and undefined(r.link)
+        for r in reassemblies
+    )
+
+
+def _remove_dead_keywords(
+    rule_set: RuleSet,
+    phrase_length: typing.Optional[int],
+    report: OptimizationReport,
+) -> None:
+    dead: typing.Set[ProcessingWord] = set()
+
+    def undefined(key: ProcessingWord) -> bool:
+        return key not in rule_set.rules or key in dead
+
+    found = True
+    while found:  # removing a keyword can leave the ones linking to it dead
+        found = False
+        for keyword, rule in rule_set.rules.items():
+            if keyword in dead or keyword == "NONE":
+                continue
+            if _links_away(rule, undefined):
+                dead.add(keyword)
+                found = True
+    for keyword in dead:
+        rule = rule_set.rules[keyword]
+        if isinstance(rule, Equivalence):
+            detail = f"is equivalent to undefined '{rule.equivalent_keyword}'"
+            saved = 0
+        else:
+            links = sorted(
+                {r.link.word for t in rule.transformation_rules for r in t.reassemble}
+            )
+            detail = "only links to undefined " + ", ".join(f"'{l}'" for l in links)
+            saved = sum(
+                t.decompose.complexity().estimate(phrase_length)
+                for t in rule.transformation_rules
+            )
+        report.findings.append(Finding(keyword.word, DEAD_KEYWORD, detail, saved))
+        # the keyword's substitution still has to be made
+        replacement = None
+        if rule._substitution is not None:
+            replacement = UnconditionalSubstitution(rule._substitution, rule.precedence)
+        rule_set.replace_rule(keyword, replacement)
+
+
+def _reassembly_key(reassembly: ReassemblyRule) -> tuple:
+    parts = reassembly.parts
+    if parts is not None:
+        parts = tuple(p if isinstance(p, int) else tuple(p) for p in parts)
+    return parts, reassembly.link
+
+
+def _merge_reassemblies(
+    trules: typing.Iterable[TransformRule], report: OptimizationReport
+) -> None:
+    reassemblies: typing.Dict[tuple, ReassemblyRule] = {}
+    lists: typing.Dict[tuple, typing.List[ReassemblyRule]] = {}
+    for trule in trules:
+        merged = [
+            reassemblies.setdefault(_reassembly_key(r), r) for r in trule.reassemble
+        ]
+        report.merged_reassemblies += sum(
+            m is not r for m, r in zip(merged, trule.reassemble)
+        )
+        shared = lists.setdefault(tuple(map(id, merged)), merged)
+        if shared is not merged:
+            report.merged_lists += 1
+        trule.reassemble = shared
+
+
+def _matched_rules(
+    rule_set: RuleSet,
+) -> typing.Iterator[typing.Tuple[str, typing.Union[Transformation, Memory], list]]:
+    """Every transformation and memory once, named, with its parsed decompositions."""
+    seen = set()
+    for keyword, rule in list(rule_set.rules.items()) + list(
+        rule_set.memory_rules.items()
+    ):
+        if id(rule) in seen:
+            continue
+        seen.add(id(rule))
+        if isinstance(rule, Transformation):
+            yield keyword.word, rule, list(rule.transformation_rules)
+        elif isinstance(rule, Memory):
+            yield f"MEMORY {keyword.word}", rule, list(rule.memory_rules)
+
+
+def optimize(
+    rule_set: RuleSet, phrase_length: typing.Optional[int] = None
+) -> OptimizationReport:
+    """Remove what can't change a reply from rule_set and report what was removed.
+
+    Every rule is parsed, and the rule set has to be optimized before it is
+    compiled by a backend. Rules keep the ids they were numbered with, so a
+    saved session carries on with either the rule set or its optimized copy.
+    Costs are estimated for phrases of phrase_length, see PatternComplexity.
+    """
+    log = logging.getLogger("optimizer")
+    report = OptimizationReport()
+    for keyword, _ in rule_set.overwritten:
+        report.findings.append(
+            Finding(keyword, OVERWRITTEN, "defined again later, only the last is used")
+        )
+    rule_set.overwritten.clear()
+
+    for name, rule, trules in _matched_rules(rule_set):
+        kept = _reachable(name, trules, phrase_length, report)
+        if len(kept) < len(trules):
+            rule.replace_rules(kept)
+
+    _remove_dead_keywords(rule_set, phrase_length, report)
+
+    for keyword, rule in rule_set.rules.items():
+        if not isinstance(rule, Transformation):
+            continue
+        for idx, trule in enumerate(rule.transformation_rules):
+            for reassembly in trule.reassemble:
+                if (
+                    reassembly.link is not None
+                    and reassembly.link not in rule_set.rules
+                ):
+                    report.findings.append(
+                        Finding(
+                            keyword.word,
+                            DEAD_LINK,
+                            f"#{idx} links to undefined '{reassembly.link}'",
+                        )
+                    )
+
+    _merge_reassemblies(
+        (trule for _, _, trules in _matched_rules(rule_set) for trule in trules),
+        report,
+    )
+    log.info(
+        f"optimized rule set, {len(report.findings)} findings and an estimated "
+        f"{report.saved_cost} matching steps saved"
+    )
+    return report
@@ -0,0 +1,255 @@
+"""Serve conversations from forked worker processes that share the parsed script.
+
+The parent parses the whole script, moves everything it has allocated out of
+the garbage collector's reach with gc.freeze, and then forks the workers. A
+collection in a worker never writes to the frozen objects, so the pages
+holding the rule set stay shared with the parent instead of being copied.
+Workers retire after a number of turns or once their private memory passes a
+limit, finishing the conversations they have open, and the parent forks a
+fresh one in their place.
+"""
+
+import dataclasses
+import gc
+import logging
+import os
+import random
+import signal
+import socketserver
+import threading
+import time
+import typing
+
+from .server import make_server
+
+
+@dataclasses.dataclass
+class MemoryUsage:
+    """A process's memory in bytes, from /proc/PID/smaps_rollup."""
+
+    rss: int
+    pss: int
+    shared: int
+    private: int
+
+    def format(self) -> str:
+        mb = 1024 * 1024
+        return (
+            f"rss {self.rss / mb:.1f}MB, shared {self.shared / mb:.1f}MB, "
+            f"private {self.private / mb:.1f}MB, pss {self.pss / mb:.1f}MB"
+        )
+
+
+def read_memory(pid: int) -> typing.Optional[MemoryUsage]:
+    """How much of the process's memory is shared, None where it can't be read."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fobj:
+            for line in fobj:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return None
+    return MemoryUsage(
+        fields.get("Rss", 0),
+        fields.get("Pss", 0),
+        fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    )
+
+
+class PreforkServer:
+    """Runs a conversation server's accept loop in several forked workers.
+
+    The server has to be bound already, every worker accepts from the same
+    listening socket. A worker is replaced when it exits, whether it retired
+    or died.
+    """
+
+    def __init__(
+        self,
+        server: socketserver.BaseServer,
+        workers: int = 4,
+        max_requests: typing.Optional[int] = None,
+        max_memory: typing.Optional[int] = None,
+        memory_check_interval: int = 100,
+        drain_timeout: float = 30.0,
+        report_interval: typing.Optional[float] = 60.0,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("need at least one worker")
+        self._log = logging.getLogger("prefork")
+        self._server = server
+        self._workers = workers
+        self._max_requests = max_requests
+        self._max_memory = max_memory
+        self._memory_check_interval = memory_check_interval
+        self._drain_timeout = drain_timeout
+        self._report_interval = report_interval
+        self._pids: typing.Set[int] = set()
+        self._stopping = threading.Event()
+        self.restarts = 0
+
+    @property
+    def pids(self) -> typing.Set[int]:
+        return set(self._pids)
+
+    def memory(self) -> typing.Dict[int, typing.Optional[MemoryUsage]]:
+        """Every worker's memory, showing how much is still shared with the parent."""
+        return {pid: read_memory(pid) for pid in sorted(self._pids)}
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        """Fork the workers and keep them running until shutdown is called."""
+        gc.collect()
+        gc.freeze()
+        for _ in range(self._workers):
+            self._spawn()
+        next_report = self._next_report()
+        try:
+            while not self._stopping.wait(poll_interval):
+                self._reap()
+                if next_report is not None and time.monotonic() >= next_report:
+                    self._report()
+                    next_report = self._next_report()
+        finally:
+            self._stop_workers()
+
+    def shutdown(self) -> None:
+        """Make serve_forever stop its workers and return, safe in a signal handler."""
+        self._stopping.set()
+
+    def _next_report(self) -> typing.Optional[float]:
+        if self._report_interval is None:
+            return None
+        return time.monotonic() + self._report_interval
+
+    def _report(self) -> None:
+        for pid, usage in self.memory().items():
+            if usage is not None:
+                self._log.info(f"worker {pid}: {usage.format()}")
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._run_worker()
+                status = 0
+            except BaseException:
+                self._log.exception("worker failed")
+            finally:
+                os._exit(status)
+        self._pids.add(pid)
+        self._log.debug(f"started worker {pid}")
+
+    def _reap(self) -> None:
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid not in self._pids:
+                continue
+            self._pids.discard(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if code:
+                self._log.warning(f"worker {pid} exited with status {code}")
+            if not self._stopping.is_set():
+                self.restarts += 1
+                self._spawn()
+
+    def _stop_workers(self) -> None:
+        for pid in self._pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self._pids):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+            self._pids.discard(pid)
+
+    def _run_worker(self) -> None:
+        random.seed()  # or every worker would greet in the same order
+        server = self._server
+        turns = 0
+        retiring = threading.Event()
+        lock = threading.Lock()
+
+        def retire(reason: str) -> None:
+            if retiring.is_set():
+                return
+            retiring.set()
+            usage = read_memory(os.getpid())
+            memory = f", {usage.format()}" if usage is not None else ""
+            self._log.info(f"worker {os.getpid()} retiring, {reason}{memory}")
+            threading.Thread(target=server.shutdown).start()
+
+        def on_turn() -> None:
+            nonlocal turns
+            with lock:
+                turns += 1
+                count = turns
+            if self._max_requests is not None and count >= self._max_requests:
+                retire(f"served {count} turns")
+            elif (
+                self._max_memory is not None
+                and count % self._memory_check_interval == 0
+            ):
+                usage = read_memory(os.getpid())
+                if usage is not None and usage.private > self._max_memory:
+                    retire("over the memory limit")
+
+        server.on_turn = on_turn
+        signal.signal(signal.SIGTERM, lambda *_: retire("asked to stop"))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        server.serve_forever()
+        server.socket.close()
+        # let the open conversations finish
+        deadline = time.monotonic() + self._drain_timeout
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread():
+                thread.join(max(0.0, deadline - time.monotonic()))
+
+
+def serve_prefork(
+    script: typing.Iterable[str],
+    address: str,
+    workers: int = 4,
+    max_requests: typing.Optional[int] = None,
+    max_memory: typing.Optional[int] = None,
+    max_match_steps: typing.Optional[int] = None,
+    max_match_seconds: typing.Optional[float] = None,
+    backend: str = "interpreter",
+    codegen_cache: typing.Optional[str] = None,
+    report_interval: typing.Optional[float] = 60.0,
+) -> None:
+    log = logging.getLogger("pyliza")
+    # parse and build everything now, what a worker builds is its own copy
+    server = make_server(
+        script,
+        address,
+        False,
+        max_match_steps=max_match_steps,
+        max_match_seconds=max_match_seconds,
+        backend=backend,
+        codegen_cache=codegen_cache,
+    )
+    server.eliza.rule_set.precompile()
+    prefork = PreforkServer(
+        server,
+        workers,
+        max_requests,
+        max_memory,
+        report_interval=report_interval,
+    )
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: prefork.shutdown())
+    log.info(f"serving conversations on {address} with {workers} workers")
+    with server:
+        prefork.serve_forever()
@@ -1,18 +1,59 @@
+import itertools
+import threading
 import typing
 import re
 
 WordMatch_t = typing.Union["ProcessingWord", typing.Set["ProcessingWord"]]
 
+_tag_bits: typing.Dict[str, int] = {}
+_tag_bits_lock = threading.Lock()
+
+
+def tag_mask(tags: typing.Iterable[str]) -> int:
+    """Bitmask for a set of tags, each tag is given its own bit the first time it is seen."""
+    mask = 0
+    for tag in tags:
+        bit = _tag_bits.get(tag)
+        if bit is None:
+            with _tag_bits_lock:
+                bit = _tag_bits.setdefault(tag, 1 << len(_tag_bits))
+        mask |= bit
+    return mask
+
+
+class WordTest(typing.NamedTuple):
+    """Compiled form of a pattern word or option set.
+
+    A phrase word passes if its text is one of the words or it shares a tag
+    bit with the mask.
+    """
+
+    words: typing.FrozenSet[typing.Optional[str]]
+    mask: int
+
+    @classmethod
+    def compile(cls, match: WordMatch_t) -> "WordTest":
+        if isinstance(match, ProcessingWord):
+            return cls(frozenset([match.word]), match.tag_mask)
+        mask = 0
+        for word in match:
+            mask |= word.tag_mask
+        return cls(frozenset(w.word for w in match), mask)
+
+    def passes(self, word: "ProcessingWord") -> bool:
+        return word.word in self.words or bool(word.tag_mask & self.mask)
+
 
 class ProcessingWord:
     tag_re = re.compile(r"\(/(?P<tag>\S+)\)")
 
     def __init__(self, word, tags=None) -> None:
         self.word: str = word
-        self.tags: typing.Set[set] = set()
+        self._tags: typing.Set[str] = set()
+        self.tag_mask: int = 0
         if isinstance(word, ProcessingWord):
             self.word = word.word
-            self.tags = word.tags.copy()
+            self.set_tags(word.tags.copy(), word.tag_mask)
         elif word is not None and not isinstance(word, str):
             raise ValueError(f"word must be None or str, not {type(word)}")
 
@@ -21,7 +62,22 @@ class ProcessingWord:
                 map(lambda s: not isinstance(s, str), tags)
             ):
                 raise ValueError(f"tags must be None or a set of ProcessingWord")
-            self.tags = tags.copy()
+            self.tags = tags
+
+    @property
+    def tags(self) -> typing.Set[str]:
+        """The word's tags, assign a new set rather than changing it in place."""
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags: typing.Iterable[str]) -> None:
+        self._tags = set(tags)
+        self.tag_mask = tag_mask(self._tags)
+
+    def set_tags(self, tags: typing.Set[str], mask: int) -> None:
+        """Assign tags whose mask is already known."""
+        self._tags = tags
+        self.tag_mask = mask
 
     def __neg__(self) -> bool:
         return not self.word and not self.tags
@@ -57,12 +113,63 @@ class ProcessingWord:
         return any(map(self._match, test))
 
     def _match(self, test: "ProcessingWord"):
-        return self.word == test.word or (self.tags & test.tags)
+        return self.word == test.word or bool(self.tag_mask & test.tag_mask)
 
     def _match_tag(self, tag_str: str):
         return tag_str in self.tags
 
 
+class PhraseSpan:
+    """Words start to end of a phrase's word list, viewed without copying them.
+
+    Compares equal to any sequence of the same words.
+    """
+
+    __slots__ = ("_words", "start", "end")
+
+    def __init__(self, words: typing.List[ProcessingWord], start: int, end: int):
+        self._words = words
+        self.start = start
+        self.end = end
+
+    @property
+    def source(self) -> typing.List[ProcessingWord]:
+        """The whole word list the span is over."""
+        return self._words
+
+    def to_list(self) -> typing.List[ProcessingWord]:
+        return self._words[self.start : self.end]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __bool__(self) -> bool:
+        return self.end > self.start
+
+    def __iter__(self) -> typing.Iterator[ProcessingWord]:
+        return itertools.islice(self._words, self.start, self.end)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            start, end, step = pos.indices(len(self))
+            if step != 1:
+                return self.to_list()[pos]
+            return PhraseSpan(self._words, self.start + start, self.start + end)
+        if pos < 0:
+            pos += len(self)
+        if not 0 <= pos < len(self):
+            raise IndexError("phrase span index out of range")
+        return self._words[self.start + pos]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (PhraseSpan, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(self.to_list())
+
+
 class ProcessingPhrase:
     def __init__(self, phrase: typing.Union[str, typing.List[ProcessingWord]]) -> None:
         self._words: typing.List[ProcessingWord] = None
@@ -78,6 +185,24 @@ class ProcessingPhrase:
                     "A processing phrase should only have ProcessingWord in the resulting list"
                 )
 
+    @classmethod
+    def trusted(cls, words: typing.List[ProcessingWord]) -> "ProcessingPhrase":
+        """A phrase that takes over a list already known to hold only words."""
+        phrase = cls.__new__(cls)
+        phrase._words = words
+        return phrase
+
+    @property
+    def words(self) -> typing.List[ProcessingWord]:
+        """The phrase's own word list, read it but don't change it."""
+        return self._words
+
+    def span(self, start: int, end: typing.Optional[int] = None) -> PhraseSpan:
+        """The words from start to end without copying them."""
+        length = len(self._words)
+        end = length if end is None else min(end, length)
+        return PhraseSpan(self._words, min(start, end), end)
+
     def to_list(self):
         return self._words[:]
 
@@ -0,0 +1,251 @@
+"""Profile conversations and write pstats and flamegraph collapsed stacks.
+
+cprofile mode uses the deterministic profiler. Its collapsed stacks are
+rebuilt from the call graph, so a function's time is split between the
+places it was called from in proportion to the time each call site used.
+sample mode records the stack of every profiled thread each interval. Its
+collapsed stacks are exact, and its pstats are built from the same samples.
+"""
+
+import cProfile
+import collections
+import contextlib
+import logging
+import os
+import pstats
+import sys
+import threading
+import typing
+
+MODES = ("cprofile", "sample")
+
+_Func_t = typing.Tuple[str, int, str]
+
+
+def folded_path(path: str) -> str:
+    """Where the collapsed stacks for a pstats file at path are written."""
+    return os.path.splitext(path)[0] + ".folded"
+
+
+def _label(func: _Func_t) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # a builtin
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class _SampledProfile:
+    """Stands in for a cProfile.Profile so pstats can load sampled stats."""
+
+    def __init__(self, stats) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class Profiler:
+    """Profiles the code run inside profiling().
+
+    With responses_only set only the sections marked as the response path are
+    profiled, so parsing the script and waiting for input are left out.
+    Sections can be nested and can run on several threads at once.
+    """
+
+    def __init__(
+        self,
+        mode: str = "cprofile",
+        responses_only: bool = False,
+        interval: float = 0.001,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"unknown profiler mode {mode}, expected one of {MODES}")
+        self._log = logging.getLogger("profiling")
+        self.mode = mode
+        self.responses_only = responses_only
+        self._interval = interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles: typing.List[cProfile.Profile] = []
+        # sample mode, the threads being profiled and the stacks seen
+        self._active: typing.Dict[int, int] = {}
+        self._samples: typing.Counter[typing.Tuple[_Func_t, ...]] = (
+            collections.Counter()
+        )
+        self._sampler: typing.Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @contextlib.contextmanager
+    def profiling(self, response: bool = False) -> typing.Iterator[None]:
+        """Profile the block, unless only responses are wanted and it isn't one."""
+        if self.responses_only and not response:
+            yield
+            return
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        started = depth == 0 and self._start()
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if started:
+                self._end()
+
+    def _start(self) -> bool:
+        if self.mode == "sample":
+            with self._lock:
+                self._active[threading.get_ident()] = 1
+                if self._sampler is None:
+                    # a thread only gives up the GIL this often, so without
+                    # this the sampler would rarely see a turn in progress
+                    self._switch_interval = sys.getswitchinterval()
+                    sys.setswitchinterval(min(self._interval, self._switch_interval))
+                    self._sampler = threading.Thread(
+                        target=self._sample, name="profiler", daemon=True
+                    )
+                    self._sampler.start()
+            return True
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            profile = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._profiles.append(profile)
+        try:
+            profile.enable()
+        except ValueError as err:
+            # only one thread can use cProfile at a time on some pythons
+            self._log.warning(f"not profiling this section: {err}")
+            return False
+        return True
+
+    def _end(self) -> None:
+        if self.mode == "sample":
+            with self._lock:
+                self._active.pop(threading.get_ident(), None)
+        else:
+            self._local.profile.disable()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self._interval):
+            with self._lock:
+                active = list(self._active)
+            frames = sys._current_frames()
+            for ident in active:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if stack:
+                    self._samples[tuple(reversed(stack))] += 1
+
+    def stats(self) -> typing.Optional[pstats.Stats]:
+        """Everything profiled so far, None if nothing was."""
+        if self.mode == "sample":
+            return self._sample_stats()
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = None
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def _sample_stats(self) -> typing.Optional[pstats.Stats]:
+        """pstats made from the samples, counts are samples and times seconds."""
+        raw: typing.Dict[_Func_t, list] = {}
+        for stack, count in self._samples.items():
+            seconds = count * self._interval
+            for depth, func in enumerate(stack):
+                entry = raw.setdefault(func, [0, 0, 0.0, 0.0, {}])
+                if func not in stack[:depth]:  # count recursion once
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if depth:
+                    caller = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                    caller[0] += count
+                    caller[1] += count
+                    caller[3] += seconds
+            raw[stack[-1]][2] += seconds
+        if not raw:
+            return None
+        for entry in raw.values():
+            entry[4] = {caller: tuple(values) for caller, values in entry[4].items()}
+        return pstats.Stats(
+            _SampledProfile({func: tuple(entry) for func, entry in raw.items()})
+        )
+
+    def collapsed(self) -> typing.List[str]:
+        """'frame;frame;frame count' lines, counts are microseconds or samples."""
+        if self.mode == "sample":
+            return [
+                ";".join(map(_label, stack)) + f" {count}"
+                for stack, count in sorted(self._samples.items())
+            ]
+        stats = self.stats()
+        if stats is None:
+            return []
+        return _collapse_call_graph(stats.stats)
+
+    def write(self, path: str) -> None:
+        """Write pstats to path and the collapsed stacks next to it, see folded_path."""
+        self.close()
+        stats = self.stats()
+        if stats is None:
+            self._log.warning("nothing was profiled")
+            return
+        stats.dump_stats(path)
+        with open(folded_path(path), "w") as fobj:
+            for line in self.collapsed():
+                fobj.write(line + "\n")
+
+    def close(self) -> None:
+        """Stop sampling, there is nothing to do in cprofile mode."""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            sys.setswitchinterval(self._switch_interval)
+
+
+def _collapse_call_graph(stats, max_depth: int = 64) -> typing.List[str]:
+    callees: typing.Dict[_Func_t, typing.Dict[_Func_t, float]] = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, {})[func] = caller_stats[3]
+    roots = [
+        func
+        for func, (_, _, _, _, callers) in stats.items()
+        if not any(caller in stats for caller in callers)
+    ]
+    totals: typing.Counter[str] = collections.Counter()
+
+    def walk(func, path, labels, share):
+        total_time = stats[func][3]
+        scale = share / total_time if total_time else 0.0
+        self_us = round(stats[func][2] * scale * 1e6)
+        if self_us:
+            totals[";".join(labels)] += self_us
+        if len(path) >= max_depth:
+            return
+        for callee, callee_time in callees.get(func, {}).items():
+            if callee in path or callee not in stats:
+                continue  # recursion, its time is already under the first call
+            callee_share = callee_time * scale
+            if callee_share * 1e6 >= 1:
+                walk(
+                    callee,
+                    path | {callee},
+                    labels + [_label(callee)],
+                    callee_share,
+                )
+
+    for root in roots:
+        walk(root, {root}, [_label(root)], stats[root][3])
+    return [f"{stack} {count}" for stack, count in sorted(totals.items())]
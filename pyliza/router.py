@@ -0,0 +1,280 @@
+"""Spread sessions over several RPC servers, only needs the standard library."""
+
+import bisect
+import collections
+import hashlib
+import logging
+import os
+import signal
+import socketserver
+import threading
+import typing
+
+from . import metrics
+from .rpc_client import (
+    OP_RESPOND,
+    STATUS_ERROR,
+    STATUS_OK,
+    RpcClient,
+    RpcError,
+    decode_request,
+    encode_reply,
+    split_frames,
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing, each node owns the keys hashed just before its points.
+
+    Every node is put on the ring at several points so the keys are spread
+    evenly, and adding or removing a node only moves the keys next to its
+    points.
+    """
+
+    def __init__(self, nodes: typing.Iterable[str] = (), replicas: int = 64) -> None:
+        self._replicas = replicas
+        self._points: typing.List[int] = []
+        self._owners: typing.List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> typing.Set[str]:
+        return set(self._owners)
+
+    def add(self, node: str) -> None:
+        if node in self._owners:
+            raise ValueError(f"{node} is already on the ring")
+        for replica in range(self._replicas):
+            point = _hash(f"{node}#{replica}")
+            idx = bisect.bisect(self._points, point)
+            self._points.insert(idx, point)
+            self._owners.insert(idx, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self._owners:
+            raise ValueError(f"{node} is not on the ring")
+        kept = [(p, n) for p, n in zip(self._points, self._owners) if n != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [n for _, n in kept]
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise ValueError("there are no nodes on the ring")
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[idx]
+
+
+class Router:
+    """Sends each session's turns to the RPC server that owns it on the ring.
+
+    The router remembers where every session it has seen lives. When a node
+    joins or leaves, the sessions that now belong somewhere else are exported
+    from their old node and imported into the new one, while their turns wait
+    for the move to finish. A session's turns are sent one at a time, in the
+    order they arrive, so none can overtake a move. Threads can share a router.
+
+    Only the max_sessions most recently used sessions are remembered. One
+    that has been forgotten isn't moved when the ring changes, it starts
+    again on its new node unless the nodes share a store.
+    """
+
+    # sessions share this many locks, so there's no lock to keep per session
+    _lock_stripes = 256
+
+    def __init__(
+        self,
+        nodes: typing.Iterable[str],
+        replicas: int = 64,
+        pool_size: int = 4,
+        timeout: typing.Optional[float] = 10.0,
+        max_sessions: typing.Optional[int] = 100000,
+    ) -> None:
+        self._log = logging.getLogger("router")
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._max_sessions = max_sessions
+        self._ring = HashRing(replicas=replicas)
+        self._clients: typing.Dict[str, RpcClient] = {}
+        # least recently used first
+        self._owners: typing.OrderedDict[str, str] = collections.OrderedDict()
+        self._session_locks = [threading.Lock() for _ in range(self._lock_stripes)]
+        self._lock = threading.Lock()
+        for node in nodes:
+            self._ring.add(node)
+            self._clients[node] = RpcClient(node, pool_size, timeout)
+
+    @property
+    def nodes(self) -> typing.Set[str]:
+        return self._ring.nodes
+
+    def owner(self, session_id: str) -> typing.Optional[str]:
+        """The node the session lives on, None if it hasn't been seen yet."""
+        return self._owners.get(session_id)
+
+    def respond(self, session_id: str, text: str) -> str:
+        with self._session_lock(session_id):
+            with self._lock:
+                node = self._owners.get(session_id)
+                if node is None:
+                    node = self._owners[session_id] = self._ring.node_for(session_id)
+                    if self._max_sessions is not None:
+                        while len(self._owners) > self._max_sessions:
+                            self._owners.popitem(last=False)
+                else:
+                    self._owners.move_to_end(session_id)
+                client = self._clients[node]
+            return client.respond(session_id, text)
+
+    def add_node(self, node: str) -> int:
+        """Put a node on the ring and move its sessions to it, returns how many."""
+        with self._lock:
+            self._ring.add(node)
+            self._clients[node] = RpcClient(node, self._pool_size, self._timeout)
+        return self._rebalance()
+
+    def remove_node(self, node: str) -> int:
+        """Move a node's sessions elsewhere and take it off the ring.
+
+        The node has to still be running to hand its sessions over, any that
+        can't be exported start again on their new node.
+        """
+        with self._lock:
+            self._ring.remove(node)
+        moved = self._rebalance()
+        with self._lock:
+            self._clients.pop(node).close()
+        return moved
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+
+    def __enter__(self) -> "Router":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        return self._session_locks[_hash(session_id) % self._lock_stripes]
+
+    def _rebalance(self) -> int:
+        with self._lock:
+            moves = [
+                (session_id, owner, self._ring.node_for(session_id))
+                for session_id, owner in self._owners.items()
+            ]
+        moved = 0
+        for session_id, source, target in moves:
+            if source != target:
+                moved += self._move(session_id, source, target)
+        return moved
+
+    def _move(self, session_id: str, source: str, target: str) -> bool:
+        with self._session_lock(session_id):
+            with self._lock:
+                if self._owners.get(session_id) != source:
+                    return False
+                source_client = self._clients[source]
+                target_client = self._clients[target]
+            try:
+                state = source_client.export_session(session_id)
+                target_client.import_session(session_id, state)
+            except (OSError, RpcError) as err:
+                self._log.warning(f"session {session_id} starts again: {err}")
+                metrics.METRICS.increment("sessions_lost")
+            with self._lock:
+                if session_id in self._owners:
+                    self._owners[session_id] = target
+            metrics.METRICS.increment("sessions_moved")
+            return True
+
+
+class _RouteHandler(socketserver.StreamRequestHandler):
+    """Speaks the RPC protocol, answering respond requests through the router."""
+
+    def handle(self):
+        router = self.server.router
+        buffer = bytearray()
+        while True:
+            data = self.connection.recv(65536)
+            if not data:
+                return
+            buffer += data
+            replies = []
+            try:
+                frames = list(split_frames(buffer))
+            except RpcError as err:
+                logging.getLogger("router").warning(f"dropping connection: {err}")
+                return
+            for body in frames:
+                try:
+                    request_id, op, session_id, payload = decode_request(body)
+                except Exception as err:
+                    # no request id to answer with, as with a bad frame
+                    logging.getLogger("router").warning(
+                        f"dropping connection: malformed request: {err}"
+                    )
+                    self.wfile.write(b"".join(replies))
+                    return
+                try:
+                    if op != OP_RESPOND:
+                        raise ValueError("only respond requests can be routed")
+                    reply = router.respond(session_id, payload.decode())
+                    replies.append(encode_reply(request_id, STATUS_OK, reply.encode()))
+                except Exception as err:
+                    replies.append(
+                        encode_reply(request_id, STATUS_ERROR, str(err).encode())
+                    )
+            self.wfile.write(b"".join(replies))
+
+
+class _RouteServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_route_server(router: Router, path: str) -> socketserver.BaseServer:
+    """An RPC server on path that passes every turn on through the router."""
+    server = _RouteServer(path, _RouteHandler)
+    server.router = router
+    return server
+
+
+def _read_nodes(path: str) -> typing.List[str]:
+    with open(path) as fobj:
+        return [line.strip() for line in fobj if line.strip()]
+
+
+def serve_route(path: str, nodes_file: str, replicas: int = 64) -> None:
+    """Route turns to the nodes listed in nodes_file, one socket path a line.
+
+    On SIGHUP the file is read again, and nodes that were added or removed
+    join or leave the ring with their sessions moved over.
+    """
+    log = logging.getLogger("router")
+    router = Router(_read_nodes(nodes_file), replicas)
+
+    def reconcile():
+        nodes = set(_read_nodes(nodes_file))
+        for node in sorted(nodes - router.nodes):
+            log.info(f"{node} joined, moved {router.add_node(node)} sessions")
+        for node in sorted(router.nodes - nodes):
+            log.info(f"{node} left, moved {router.remove_node(node)} sessions")
+
+    signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=reconcile).start())
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a router that was killed
+    with router, make_route_server(router, path) as server:
+        log.info(f"routing {path} to {len(router.nodes)} nodes")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
@@ -0,0 +1,252 @@
+import collections
+import logging
+import os
+import selectors
+import socket
+import typing
+
+from . import metrics
+from .eliza import Eliza
+from .rpc_client import (
+    OP_EXPORT,
+    OP_IMPORT,
+    OP_RESPOND,
+    STATUS_ERROR,
+    STATUS_OK,
+    RpcError,
+    decode_request,
+    encode_reply,
+    split_frames,
+)
+from .session import Session
+from .state import SessionState
+from .store import SessionStore
+
+if typing.TYPE_CHECKING:
+    from .capture import CaptureWriter
+    from .profiling import Profiler
+    from .shadow import ShadowRunner
+
+
+class _Connection:
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+
+
+class RpcServer:
+    """Answers respond(session_id, text) requests on a unix socket.
+
+    A single thread runs a non blocking event loop, reading whatever frames
+    have arrived on every connection, answering them in order and writing the
+    replies back as the sockets allow. Sessions are made the first time their
+    id is seen and any connection can carry on any session.
+
+    Only the max_sessions most recently used sessions are kept. With a store
+    an evicted session carries on from its saved state when it comes back,
+    without one it starts again.
+    """
+
+    _read_size = 65536
+    _max_outbox = 1 << 20  # stop reading a connection that isn't reading replies
+
+    def __init__(
+        self, eliza: Eliza, path: str, max_sessions: typing.Optional[int] = 10000
+    ) -> None:
+        self._log = logging.getLogger("rpc")
+        self.eliza = eliza
+        self.path = path
+        self.max_sessions = max_sessions
+        # least recently used first
+        self.sessions: typing.OrderedDict[str, Session] = collections.OrderedDict()
+        if os.path.exists(path):
+            os.unlink(path)  # left behind by a server that was killed
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ, None)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+        self._running = False
+
+    def session(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self._keep(session_id, self.eliza.session(session_id))
+        else:
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def _keep(self, session_id: str, session: Session) -> Session:
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        if self.max_sessions is not None:
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                metrics.METRICS.increment("rpc_sessions_evicted")
+        return session
+
+    def export_session(self, session_id: str) -> bytes:
+        """Stop serving the session here, returning its serialised state."""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            session = self.eliza.session(session_id)
+        return session.state.to_bytes()
+
+    def import_session(self, session_id: str, state: bytes) -> None:
+        self._keep(
+            session_id, self.eliza.session(session_id, SessionState.from_bytes(state))
+        )
+
+    def serve_forever(self) -> None:
+        self._running = True
+        while self._running:
+            for key, events in self._selector.select():
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._wakeup_recv:
+                    self._wakeup_recv.recv(64)
+                else:
+                    conn = key.data
+                    if events & selectors.EVENT_READ:
+                        self._read(conn)
+                    if events & selectors.EVENT_WRITE and conn.sock.fileno() != -1:
+                        self._write(conn)
+
+    def shutdown(self) -> None:
+        """Stop serve_forever, safe to call from another thread."""
+        self._running = False
+        self._wakeup_send.send(b"\0")
+
+    def server_close(self) -> None:
+        for key in list(self._selector.get_map().values()):
+            if isinstance(key.data, _Connection):
+                self._close(key.data)
+        self._selector.close()
+        self._listener.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "RpcServer":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.server_close()
+
+    def _accept(self) -> None:
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+
+    def _read(self, conn: _Connection) -> None:
+        try:
+            data = conn.sock.recv(self._read_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(conn)
+            return
+        conn.inbox += data
+        try:
+            for body in split_frames(conn.inbox):
+                conn.outbox += self._answer(body)
+        except RpcError as err:
+            self._log.warning(f"dropping connection: {err}")
+            self._close(conn)
+            return
+        self._write(conn)
+
+    def _answer(self, body: bytes) -> bytes:
+        metrics.METRICS.increment("rpc_requests")
+        request_id = None
+        try:
+            request_id, op, session_id, payload = decode_request(body)
+            if op == OP_RESPOND:
+                reply = self.session(session_id).respond_to(payload.decode()).encode()
+            elif op == OP_EXPORT:
+                reply = self.export_session(session_id)
+            elif op == OP_IMPORT:
+                self.import_session(session_id, payload)
+                reply = b""
+            else:
+                raise ValueError(f"unknown operation {op}")
+        except Exception as err:
+            self._log.exception("failed to answer request")
+            metrics.METRICS.increment("rpc_errors")
+            if request_id is None:
+                raise RpcError(f"malformed request: {err}")
+            return encode_reply(request_id, STATUS_ERROR, str(err).encode())
+        return encode_reply(request_id, STATUS_OK, reply)
+
+    def _write(self, conn: _Connection) -> None:
+        if conn.outbox:
+            try:
+                sent = conn.sock.send(conn.outbox)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self._close(conn)
+                return
+            del conn.outbox[:sent]
+        events = selectors.EVENT_WRITE if conn.outbox else 0
+        if len(conn.outbox) < self._max_outbox:
+            events |= selectors.EVENT_READ
+        self._selector.modify(conn.sock, events, conn)
+
+    def _close(self, conn: _Connection) -> None:
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+
+def serve_rpc(
+    script: typing.Iterable[str],
+    path: str,
+    lazy: bool = True,
+    max_match_steps: typing.Optional[int] = None,
+    max_match_seconds: typing.Optional[float] = None,
+    store_path: typing.Optional[str] = None,
+    flush_interval: float = 1.0,
+    backend: str = "interpreter",
+    codegen_cache: typing.Optional[str] = None,
+    profiler: typing.Optional["Profiler"] = None,
+    capture: typing.Optional["CaptureWriter"] = None,
+    shadow: typing.Optional["ShadowRunner"] = None,
+    max_sessions: typing.Optional[int] = 10000,
+):
+    log = logging.getLogger("pyliza")
+    store = SessionStore(store_path, flush_interval) if store_path is not None else None
+    eliza = Eliza(
+        script,
+        lazy,
+        max_match_steps=max_match_steps,
+        max_match_seconds=max_match_seconds,
+        store=store,
+        backend=backend,
+        codegen_cache=codegen_cache,
+        profiler=profiler,
+        capture=capture,
+        shadow=shadow,
+    )
+    try:
+        with RpcServer(eliza, path, max_sessions) as server:
+            log.info(f"serving rpc on {path}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        if store is not None:
+            store.close()
@@ -0,0 +1,211 @@
+"""Client for the unix socket RPC server, only needs the standard library.
+
+Every message is a frame, a 4 byte big endian length and then the body. A
+request body is the request id (4 bytes), the operation (1 byte), the length
+of the session id (2 bytes), the session id and then the payload. A reply
+body is the request id, a status byte and the payload, or the error if the
+status is not OK. Requests on a connection are answered in the order they
+were sent.
+
+The operations are respond, where the payload is the user's text and the
+reply's is Eliza's, export, which takes the session off the server and
+replies with its serialised state, and import, whose payload is a serialised
+state for the server to carry the session on from.
+"""
+
+import contextlib
+import queue
+import socket
+import struct
+import threading
+import typing
+
+_FRAME = struct.Struct(">I")
+_REQUEST = struct.Struct(">IBH")
+_REPLY = struct.Struct(">IB")
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+OP_RESPOND = 0
+OP_EXPORT = 1
+OP_IMPORT = 2
+
+MAX_FRAME = 1 << 20
+
+
+class RpcError(Exception):
+    """The server could not answer a request."""
+
+
+def encode_request(
+    request_id: int, session_id: str, payload: bytes, op: int = OP_RESPOND
+) -> bytes:
+    session = session_id.encode()
+    body = _REQUEST.pack(request_id, op, len(session)) + session + payload
+    return _FRAME.pack(len(body)) + body
+
+
+def decode_request(body: bytes) -> typing.Tuple[int, int, str, bytes]:
+    """The request id, operation, session id and payload."""
+    request_id, op, session_len = _REQUEST.unpack_from(body)
+    start = _REQUEST.size
+    session_id = body[start : start + session_len].decode()
+    return request_id, op, session_id, body[start + session_len :]
+
+
+def encode_reply(request_id: int, status: int, payload: bytes) -> bytes:
+    body = _REPLY.pack(request_id, status) + payload
+    return _FRAME.pack(len(body)) + body
+
+
+def decode_reply(body: bytes) -> typing.Tuple[int, int, bytes]:
+    request_id, status = _REPLY.unpack_from(body)
+    return request_id, status, body[_REPLY.size :]
+
+
+def split_frames(buffer: bytearray) -> typing.Iterator[bytes]:
+    """Take every complete frame off the front of the buffer."""
+    while len(buffer) >= _FRAME.size:
+        (length,) = _FRAME.unpack_from(buffer)
+        if length > MAX_FRAME:
+            raise RpcError(f"frame of {length} bytes is too big")
+        end = _FRAME.size + length
+        if len(buffer) < end:
+            return
+        body = bytes(buffer[_FRAME.size : end])
+        del buffer[:end]
+        yield body
+
+
+class Connection:
+    """One connection to the server, requests sent together are pipelined."""
+
+    def __init__(self, path: str, timeout: typing.Optional[float] = 10.0) -> None:
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._buffer = bytearray()
+        self._frames: typing.Iterator[bytes] = iter(())
+        self._next_id = 0
+
+    def respond(self, session_id: str, text: str) -> str:
+        return self.respond_many([(session_id, text)])[0]
+
+    def respond_many(
+        self, requests: typing.Iterable[typing.Tuple[str, str]], window: int = 64
+    ) -> typing.List[str]:
+        """Send the requests without waiting for each reply, at most window at a time."""
+        calls = [
+            (OP_RESPOND, session_id, text.encode()) for session_id, text in requests
+        ]
+        return [reply.decode() for reply in self.call_many(calls, window)]
+
+    def export_session(self, session_id: str) -> bytes:
+        """Take the session off the server, returning its serialised state."""
+        return self.call_many([(OP_EXPORT, session_id, b"")])[0]
+
+    def import_session(self, session_id: str, state: bytes) -> None:
+        """Have the server carry the session on from a serialised state."""
+        self.call_many([(OP_IMPORT, session_id, state)])
+
+    def call_many(
+        self, calls: typing.Sequence[typing.Tuple[int, str, bytes]], window: int = 64
+    ) -> typing.List[bytes]:
+        """Send (operation, session id, payload) requests and return the replies."""
+        replies = []
+        for start in range(0, len(calls), window):
+            batch = calls[start : start + window]
+            first_id = self._next_id
+            self._next_id = (first_id + len(batch)) & 0xFFFFFFFF
+            self._sock.sendall(
+                b"".join(
+                    encode_request(
+                        (first_id + idx) & 0xFFFFFFFF, session_id, payload, op
+                    )
+                    for idx, (op, session_id, payload) in enumerate(batch)
+                )
+            )
+            for idx in range(len(batch)):
+                request_id, status, payload = decode_reply(self._read_frame())
+                if request_id != (first_id + idx) & 0xFFFFFFFF:
+                    raise RpcError("reply out of order")
+                if status != STATUS_OK:
+                    raise RpcError(payload.decode(errors="replace"))
+                replies.append(payload)
+        return replies
+
+    def _read_frame(self) -> bytes:
+        while True:
+            frame = next(self._frames, None)
+            if frame is not None:
+                return frame
+            data = self._sock.recv(65536)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            self._buffer += data
+            self._frames = split_frames(self._buffer)
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+class RpcClient:
+    """A pool of connections that threads can share.
+
+    Each call borrows a connection for as long as it takes, a connection that
+    failed is thrown away rather than going back in the pool.
+    """
+
+    def __init__(
+        self, path: str, pool_size: int = 4, timeout: typing.Optional[float] = 10.0
+    ) -> None:
+        self._path = path
+        self._timeout = timeout
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self) -> typing.Iterator[Connection]:
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = Connection(self._path, self._timeout)
+            try:
+                yield conn
+            except (OSError, RpcError):
+                conn.close()
+                raise
+            self._idle.put(conn)
+
+    def respond(self, session_id: str, text: str) -> str:
+        with self.connection() as conn:
+            return conn.respond(session_id, text)
+
+    def respond_many(
+        self, requests: typing.Iterable[typing.Tuple[str, str]]
+    ) -> typing.List[str]:
+        with self.connection() as conn:
+            return conn.respond_many(requests)
+
+    def export_session(self, session_id: str) -> bytes:
+        with self.connection() as conn:
+            return conn.export_session(session_id)
+
+    def import_session(self, session_id: str, state: bytes) -> None:
+        with self.connection() as conn:
+            conn.import_session(session_id, state)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self) -> "RpcClient":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
@@ -13,7 +13,13 @@ from .transformation_parser import DecompositionParser, ReassemblyParser
 
 class ScriptParser:
     @classmethod
-    def parse(cls, script):
+    def parse(cls, script, lazy: bool = False):
+        """Parse a script into a rule set.
+
+        When lazy is set only the keywords, substitutions and precedences are
+        read up front, the decomposition and reassembly rules of a keyword are
+        parsed the first time that keyword fires.
+        """
         log = logging.getLogger("script")
         log.info("parsing script file")
         raw_script = cls._strip_script(script)
@@ -24,11 +30,11 @@ class ScriptParser:
                 "missing 'START' keyword to indicate the start of the rule set and end of greetings."
             )
         greetings = cls._parse_greetings(greetings_text)
-        rules, memory_rules = cls._parse_rules(rules_text)
+        rules, memory_rules, overwritten = cls._parse_rules(rules_text, lazy)
         log.info(
             f"loaded {len(greetings)} greetings, {len(rules)} rules, and {len(memory_rules)} memory rules."
         )
-        return RuleSet(greetings, rules, memory_rules)
+        return RuleSet(greetings, rules, memory_rules, overwritten)
 
     @classmethod
     def _strip_script(cls, script: typing.Iterable[str]) -> str:
@@ -52,16 +58,35 @@ class ScriptParser:
         return greetings
 
     @classmethod
-    def _parse_rules(cls, rules_text: str) -> typing.Mapping[str, ElizaRule]:
-        """Parse the text of the rules."""
+    def _parse_rules(cls, rules_text: str, lazy: bool = False) -> typing.Tuple[
+        typing.Dict[str, ElizaRule],
+        typing.List[typing.Tuple[str, ruleset.Memory]],
+        typing.List[typing.Tuple[str, ElizaRule]],
+    ]:
+        """Parse the text of the rules.
+
+        A keyword defined twice keeps its last definition, the earlier ones are
+        returned as overwritten. A memory shares its keyword with the keyword's
+        own rule, whichever comes first.
+        """
+        log = logging.getLogger("script")
         rules = {}
-        memory_rules = []
+        memory_rules = {}
+        overwritten = []
         for rule_text in utils.bracket_iter(rules_text):
-            keyword, rule = RuleParser.parse(rule_text)
+            keyword, rule = RuleParser.parse(rule_text, lazy)
             if isinstance(rule, ruleset.Memory):
-                memory_rules.append((keyword, rule))
+                if keyword in memory_rules:
+                    log.warning(f"memory for '{keyword}' is defined more than once")
+                    overwritten.append((keyword, memory_rules[keyword]))
+                memory_rules[keyword] = rule
+                if keyword in rules and not isinstance(rules[keyword], ruleset.Memory):
+                    continue
+            elif keyword in rules and not isinstance(rules[keyword], ruleset.Memory):
+                log.warning(f"keyword '{keyword}' is defined more than once")
+                overwritten.append((keyword, rules[keyword]))
             rules[keyword] = rule
-        return rules, memory_rules
+        return rules, list(memory_rules.items()), overwritten
 
 
 class RuleParser:
@@ -75,13 +100,13 @@ class RuleParser:
     equivalence_re = re.compile(r"\(\s*=\s*(?P<eqv>\S+?)\s*\)$")
 
     @classmethod
-    def parse(cls, rule_text) -> Tuple[str, ElizaRule]:
+    def parse(cls, rule_text, lazy: bool = False) -> Tuple[str, ElizaRule]:
         """Convert rule text into keyword and logic rule."""
         keyword, rule_type, rule_text = cls._parse_keyword(rule_text)
         substitution, rule_text = cls._parse_substitution(rule_text)
         precedence, rule_text = cls._parse_precedence(rule_text)
         rule, rule_type = cls._parse_instructions(
-            rule_type, substitution, precedence, rule_text
+            rule_type, substitution, precedence, rule_text, lazy
         )
         cls.log.info(f"parsed rule for keyword '{keyword}' of type {rule_type.name}")
         return keyword, rule
@@ -89,15 +114,24 @@ class RuleParser:
     @classmethod
     def _parse_keyword(cls, rule_text) -> Tuple[str, RuleType, str]:
         """Gets the keyword and rule type if it was set by the keyword."""
-        keyword, rule_text = rule_text.split(maxsplit=1)
+        keyword, rule_text = cls._split_keyword(rule_text)
         rule_type = cls.keyword_fixed_rule_types.get(keyword, RuleType.UNKNOWN)
         if keyword in cls.consuming_keyword:
-            keyword, rule_text = rule_text.split(maxsplit=1)
+            keyword, rule_text = cls._split_keyword(rule_text)
         cls.log.debug(
             f"found keyword '{keyword}' with keyword set rule type {rule_type.name}"
         )
         return keyword, rule_type, rule_text.strip()
 
+    @classmethod
+    def _split_keyword(cls, rule_text: str) -> Tuple[str, str]:
+        """A keyword is one word, or several in brackets like (I AM)."""
+        if rule_text.startswith("("):
+            keyword, endpos = utils.get_bracketed_text(rule_text)
+            return " ".join(keyword.split()), rule_text[endpos:]
+        keyword, rule_text = rule_text.split(maxsplit=1)
+        return keyword, rule_text
+
     @classmethod
     def _parse_substitution(cls, rule_text: str) -> Tuple[Optional[str], str]:
         """Pulls out the direct substitution."""
@@ -123,7 +157,9 @@ class RuleParser:
         return precedence, rule_text.strip()
 
     @classmethod
-    def _parse_instructions(cls, rule_type, substitution, precedence, rule_text):
+    def _parse_instructions(
+        cls, rule_type, substitution, precedence, rule_text, lazy=False
+    ):
         rule_type = cls._determine_rule_type(rule_type, substitution, rule_text)
         cls.log.info(f"rule type set to {rule_type.name}")
         instruction_parsers = {
@@ -134,7 +170,9 @@ class RuleParser:
             RuleType.EQUIVALENCE: EquivalenceParser,
             RuleType.MEMORY: MemoryParser,
         }
-        rule = instruction_parsers[rule_type].parse(substitution, precedence, rule_text)
+        rule = instruction_parsers[rule_type].parse(
+            substitution, precedence, rule_text, lazy
+        )
         return rule, rule_type
 
     @classmethod
@@ -157,29 +195,50 @@ class _RuleInstructionParser:
     log = logging.getLogger("instructions")
 
     @classmethod
-    def parse(cls, substitution, precedence, instructions) -> ElizaRule:
+    def parse(cls, substitution, precedence, instructions, lazy=False) -> ElizaRule:
         raise NotImplementedError("need to implement 'parse'")
 
+    @classmethod
+    def _check_complexity(cls, decomposition: DecompositionRule):
+        # only a debug note, python -m pyliza analyse is where risky patterns
+        # are reported
+        complexity = decomposition.complexity()
+        if complexity.is_risky():
+            cls.log.debug(
+                f"decomposition '{decomposition}' could take about "
+                f"{complexity.estimate()} steps to match a "
+                f"{complexity.typical_phrase_length} word phrase"
+            )
+
 
 class TransformationParser(_RuleInstructionParser):
     @classmethod
-    def parse(cls, substitution, precedence, instructions) -> ElizaRule:
+    def parse(cls, substitution, precedence, instructions, lazy=False) -> ElizaRule:
+        if lazy:
+            transformation_rules = ruleset.DeferredRules(
+                lambda: cls._parse_transformation_rules(instructions)
+            )
+        else:
+            transformation_rules = cls._parse_transformation_rules(instructions)
+        return ruleset.Transformation(substitution, precedence, transformation_rules)
+
+    @classmethod
+    def _parse_transformation_rules(cls, instructions) -> typing.List[TransformRule]:
         transformation_rules = []
         for transformation in utils.bracket_iter(instructions):
             decomp, *reassem = utils.split_brackets(transformation)
+            decomposition = DecompositionParser.parse(decomp)
+            cls._check_complexity(decomposition)
             transformation_rules.append(
-                TransformRule(
-                    DecompositionParser.parse(decomp),
-                    list(map(ReassemblyParser.parse, reassem)),
-                )
+                TransformRule(decomposition, list(map(ReassemblyParser.parse, reassem)))
             )
         cls.log.debug(f"found {len(transformation_rules)} transformation rules")
-        return ruleset.Transformation(substitution, precedence, transformation_rules)
+        return transformation_rules
 
 
 class UnconditionalSubstitutionParser(_RuleInstructionParser):
     @classmethod
-    def parse(cls, substitution, precedence, _) -> ElizaRule:
+    def parse(cls, substitution, precedence, _, lazy=False) -> ElizaRule:
         return ruleset.UnconditionalSubstitution(substitution, precedence)
 
 
@@ -187,7 +246,7 @@ class WordTaggingParser(_RuleInstructionParser):
     dlist_re = re.compile(r"\s*DLIST\(/")
 
     @classmethod
-    def parse(cls, substitution, precedence, instructions) -> ElizaRule:
+    def parse(cls, substitution, precedence, instructions, lazy=False) -> ElizaRule:
         instructions = cls.dlist_re.sub("", instructions)[:-1].strip()
         dlist = instructions.split()
         return ruleset.TagWord(substitution, precedence, dlist)
@@ -197,7 +256,7 @@ class EquivalenceParser(_RuleInstructionParser):
     equivalence_re = re.compile(r"\(\s*=\s*(?P<eqv>\S+?)\s*\)$")
 
     @classmethod
-    def parse(cls, substitution, precedence, instructions) -> ElizaRule:
+    def parse(cls, substitution, precedence, instructions, lazy=False) -> ElizaRule:
         mobj = cls.equivalence_re.match(instructions)
         equivalent_keyword = mobj.group("eqv")
         return ruleset.Equivalence(substitution, precedence, equivalent_keyword)
@@ -205,11 +264,22 @@ class EquivalenceParser(_RuleInstructionParser):
 
 class MemoryParser(_RuleInstructionParser):
     @classmethod
-    def parse(cls, substitution, precedence, instructions) -> ElizaRule:
+    def parse(cls, substitution, precedence, instructions, lazy=False) -> ElizaRule:
+        if lazy:
+            memories = ruleset.DeferredRules(
+                lambda: cls._parse_memory_rules(instructions)
+            )
+        else:
+            memories = cls._parse_memory_rules(instructions)
+        return ruleset.Memory(substitution, precedence, memories)
+
+    @classmethod
+    def _parse_memory_rules(cls, instructions) -> typing.List[TransformRule]:
         memories = []
         for memory_pattern in utils.bracket_iter(instructions):
             decomposition_text, reassembly_text = memory_pattern.split("=")
             decomposition = DecompositionParser.parse(decomposition_text)
+            cls._check_complexity(decomposition)
             reassembly = ReassemblyParser.parse(reassembly_text)
             memories.append(TransformRule(decomposition, [reassembly]))
-        return ruleset.Memory(substitution, precedence, memories)
+        return memories
@@ -2,10 +2,22 @@ import collections
 import dataclasses
 import enum
 import logging
+import threading
 import typing
 
-from .transformation import DecompositionRule, ReassemblyRule, TransformRule
-from .processing import ProcessingPhrase, ProcessingWord
+from .transformation import (
+    DecomposedPhrase_t,
+    DecompositionRule,
+    MatchBudget,
+    MatchBudgetExceeded,
+    MatchMemo,
+    PatternTable,
+    ReassemblyRule,
+    TransformRule,
+)
+from .automaton import DecompositionAutomaton
+from .processing import ProcessingPhrase, ProcessingWord, tag_mask
+from .state import SessionState
 
 
 class RuleType(enum.Enum):
@@ -20,6 +32,119 @@ class RuleType(enum.Enum):
     # with a special reassambly rule
 
 
+class DeferredRules:
+    """Sequence of rules that is only parsed the first time it is used.
+
+    The loader is called at most once, even when several threads hit the rule
+    at the same time.
+    """
+
+    def __init__(self, loader: typing.Callable[[], typing.List[TransformRule]]):
+        self._loader = loader
+        self._rules: typing.Optional[typing.List[TransformRule]] = None
+        self._lock = threading.Lock()
+        self._load_hooks = []
+
+    def after_load(
+        self, hook: typing.Callable[[typing.List[TransformRule]], None]
+    ) -> None:
+        """Call hook with the rules once they are loaded, or now if they are."""
+        with self._lock:
+            if self._rules is None:
+                self._load_hooks.append(hook)
+                return
+        hook(self._rules)
+
+    @property
+    def loaded(self) -> bool:
+        return self._rules is not None
+
+    def load(self) -> typing.List[TransformRule]:
+        rules = self._rules
+        if rules is None:
+            with self._lock:
+                if self._rules is None:
+                    rules = self._loader()
+                    for hook in self._load_hooks:
+                        hook(rules)
+                    self._rules = rules
+                    self._loader = self._load_hooks = None
+                rules = self._rules
+        return rules
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __getitem__(self, pos):
+        return self.load()[pos]
+
+
+def _intern_patterns(rules, patterns: PatternTable) -> None:
+    """Give the rules' decompositions their pattern ids, when they are loaded."""
+
+    def intern(loaded) -> None:
+        for trule in loaded:
+            trule.decompose.pattern_id = patterns.intern(trule.decompose)
+
+    if isinstance(rules, DeferredRules):
+        rules.after_load(intern)
+    else:
+        intern(rules)
+
+
+def _first_match(
+    rules: typing.Sequence[TransformRule],
+    automaton_from: typing.Callable[[int], DecompositionAutomaton],
+    phrase: ProcessingPhrase,
+    budget: typing.Optional[MatchBudget],
+    memo: typing.Optional[MatchMemo],
+) -> typing.Optional[typing.Tuple[int, DecomposedPhrase_t]]:
+    """Index and parts of the first rule that decomposes the phrase.
+
+    Rules whose pattern the memo already has an answer for are not matched
+    again, the automaton only runs over the rules from the first unknown one.
+    """
+    if memo is None:
+        return automaton_from(0).match(phrase, budget)
+    words = phrase.words
+    start = 0
+    for trule in rules:
+        pattern_id = trule.decompose.pattern_id
+        if pattern_id is None:
+            break
+        parts = memo.lookup(pattern_id, words, budget)
+        if parts is MatchMemo.UNKNOWN:
+            break
+        if parts is not None:
+            return start, parts
+        start += 1
+    if start == len(rules):
+        return None
+    match = automaton_from(start).match(phrase, budget)
+    end = len(rules) if match is None else start + match[0]
+    for trule in rules[start:end]:
+        if trule.decompose.pattern_id is not None:
+            memo.record(trule.decompose.pattern_id, words, None)
+    if match is None:
+        return None
+    idx = start + match[0]
+    if rules[idx].decompose.pattern_id is not None:
+        memo.record(rules[idx].decompose.pattern_id, words, match[1])
+    return idx, match[1]
+
+
+def _counts_steps(budget: typing.Optional[MatchBudget]) -> bool:
+    """Whether the budget limits the number of steps.
+
+    Steps are what the automaton counts, so with a step limit compiled rules
+    are matched as interpreted ones and a turn runs out at the same point.
+    """
+    return budget is not None and budget.max_steps is not None
+
+
 class ElizaRule:
     _log = logging.getLogger("ElizaRule")
 
@@ -30,11 +155,21 @@ class ElizaRule:
             )
         self._substitution: typing.Optional[str] = substitution
         self._precedence: int = int(precedence)
+        self.ordinal: typing.Optional[int] = None
 
     @property
     def precedence(self) -> int:
         return self._precedence
 
+    def number(
+        self, ordinal: int, patterns: typing.Optional[PatternTable] = None
+    ) -> None:
+        """Give the rule its position in the script, used to key session state.
+
+        Its decomposition patterns get their ids from patterns if it is given.
+        """
+        self.ordinal = ordinal
+
     def apply_substitution(self, word: ProcessingWord) -> bool:
         if not self._substitution:
             return False
@@ -43,8 +178,15 @@ class ElizaRule:
         return True
 
     def apply_transform(
-        self, word: ProcessingWord, phrase: ProcessingPhrase
-    ) -> typing.Tuple[typing.Optional[str], ProcessingPhrase]:
+        self,
+        word: ProcessingWord,
+        phrase: ProcessingPhrase,
+        render: bool = False,
+        budget: typing.Optional[MatchBudget] = None,
+        state: typing.Optional[SessionState] = None,
+        memo: typing.Optional[MatchMemo] = None,
+    ) -> typing.Tuple[typing.Optional[str], typing.Union[ProcessingPhrase, str]]:
+        """Transform the phrase, or the reply text if render is set and no link."""
         return None, phrase
 
 
@@ -57,16 +199,74 @@ class Transformation(ElizaRule):
     ) -> None:
         super().__init__(substitution, precedence)
         self._transformation_rules = transformation_rules
+        # by the index of the first rule they match, see _first_match
+        self._automata: typing.Dict[int, DecompositionAutomaton] = {}
+        # set by the codegen backend, see codegen.install
+        self.compiled: typing.Optional[typing.Callable] = None
+
+    @property
+    def transformation_rules(self) -> typing.Iterable[TransformRule]:
+        return self._transformation_rules
+
+    @property
+    def automaton(self) -> DecompositionAutomaton:
+        """The decompositions compiled to find the first that matches in one scan."""
+        return self.automaton_from(0)
+
+    def automaton_from(self, start: int) -> DecompositionAutomaton:
+        """An automaton for the decompositions from start on."""
+        automaton = self._automata.get(start)
+        if automaton is None:
+            automaton = self._automata[start] = DecompositionAutomaton.for_rules(
+                self._transformation_rules[start:]
+            )
+        return automaton
+
+    def replace_rules(self, transformation_rules: typing.List[TransformRule]) -> None:
+        """Use these rules instead, they keep the ids they were numbered with."""
+        if self.compiled is not None:
+            raise ValueError("rules can't be replaced once they are compiled")
+        self._transformation_rules = transformation_rules
+        self._automata.clear()
+
+    # transformation rule ids are the keyword's ordinal and the rule's index
+    rule_index_bits = 16
+
+    def number(self, ordinal, patterns=None) -> None:
+        super().number(ordinal, patterns)
+        if isinstance(self._transformation_rules, DeferredRules):
+            self._transformation_rules.after_load(self._number_rules)
+        else:
+            self._number_rules(self._transformation_rules)
+        if patterns is not None:
+            _intern_patterns(self._transformation_rules, patterns)
+
+    def _number_rules(self, transformation_rules) -> None:
+        if len(transformation_rules) >= 1 << self.rule_index_bits:
+            raise ValueError("too many transformation rules for one keyword")
+        for idx, trule in enumerate(transformation_rules):
+            trule.rule_id = (self.ordinal << self.rule_index_bits) | idx
 
-    def apply_transform(self, word, phrase):
+    def apply_transform(
+        self, word, phrase, render=False, budget=None, state=None, memo=None
+    ):
+        if self.compiled is not None and not _counts_steps(budget):
+            result = self.compiled(phrase, render, budget, state, memo)
+            return result if result is not None else (None, phrase)
         self._log.info(f"applying transform triggered by keyword: {word}")
         self._log.debug(f"finding decomposition for {phrase}")
-        for trule in self._transformation_rules:
-            lrule, new_phrase = trule.apply(phrase)
-            if new_phrase is not None:
-                return lrule, new_phrase
-        self._log.debug("no decomposition rules matched, word may have been removed")
-        return None, phrase
+        match = _first_match(
+            self._transformation_rules, self.automaton_from, phrase, budget, memo
+        )
+        if match is None:
+            self._log.debug(
+                "no decomposition rules matched, word may have been removed"
+            )
+            return None, phrase
+        idx, decomposed = match
+        trule = self._transformation_rules[idx]
+        self._log.debug(f"matched decomposition rule: {trule.decompose}")
+        return trule.apply_decomposed(decomposed, render, state)
 
 
 class UnconditionalSubstitution(ElizaRule):
@@ -87,9 +287,11 @@ class TagWord(ElizaRule):
     ) -> None:
         super().__init__(substitution, precedence)
         self._dlist = dlist
+        self._tags = frozenset(dlist)
+        self._tag_mask = tag_mask(self._tags)
 
     def tag_word(self, word: ProcessingWord):
-        word.tags = self._dlist[:]
+        word.set_tags(self._tags, self._tag_mask)
         self._log.info(f"tagged word is now {word}")
 
 
@@ -104,8 +306,9 @@ class Equivalence(ElizaRule):
             )
         self.equivalent_keyword = ProcessingWord(equivalent_keyword)
 
-    def apply_transform(self, word, phrase):
-
+    def apply_transform(
+        self, word, phrase, render=False, budget=None, state=None, memo=None
+    ):
         return self.equivalent_keyword, phrase
 
 
@@ -118,25 +321,68 @@ class Memory(ElizaRule):
     ) -> None:
         super().__init__(substitution, precedence)
         self._rules = memory_rules
-        self._memories = []
+        self._automata: typing.Dict[int, DecompositionAutomaton] = {}
+        self.compiled: typing.Optional[typing.Callable] = None
+        if isinstance(memory_rules, DeferredRules):
+            return
         for mem_rule in self._rules:
             if not isinstance(mem_rule, TransformRule):
                 raise ValueError("memories must be a list of TransformRules")
 
-    def memorise(self, phrase: ProcessingPhrase) -> bool:
-        for mem_rule in self._rules:
-            _, new_phrase = mem_rule.apply(phrase)
-            if new_phrase is not None:
-                self._log.debug("memorised phrased.")
-                self._memories.append(new_phrase)
-                return True
-        return False
+    @property
+    def memory_rules(self) -> typing.Iterable[TransformRule]:
+        return self._rules
 
-    def recall(self) -> str:
-        try:
-            return self._memories.pop(0)
-        except IndexError:
-            return ""
+    @property
+    def automaton(self) -> DecompositionAutomaton:
+        return self.automaton_from(0)
+
+    def automaton_from(self, start: int) -> DecompositionAutomaton:
+        automaton = self._automata.get(start)
+        if automaton is None:
+            automaton = self._automata[start] = DecompositionAutomaton.for_rules(
+                self._rules[start:]
+            )
+        return automaton
+
+    def replace_rules(self, memory_rules: typing.List[TransformRule]) -> None:
+        """Use these rules instead, see Transformation.replace_rules."""
+        if self.compiled is not None:
+            raise ValueError("rules can't be replaced once they are compiled")
+        self._rules = memory_rules
+        self._automata.clear()
+
+    def number(self, ordinal, patterns=None) -> None:
+        super().number(ordinal, patterns)
+        if patterns is not None:
+            _intern_patterns(self._rules, patterns)
+
+    def memorise(
+        self,
+        phrase: ProcessingPhrase,
+        state: SessionState,
+        budget: typing.Optional[MatchBudget] = None,
+        memo: typing.Optional[MatchMemo] = None,
+    ) -> bool:
+        if self.compiled is not None and not _counts_steps(budget):
+            result = self.compiled(phrase, True, budget, None, memo)
+            if result is None:
+                return False
+            _, memory = result
+        else:
+            match = _first_match(self._rules, self.automaton_from, phrase, budget, memo)
+            if match is None:
+                return False
+            idx, decomposed = match
+            _, memory = self._rules[idx].apply_decomposed(decomposed, render=True)
+        if isinstance(memory, ProcessingPhrase):
+            memory = memory.to_string()
+        self._log.debug("memorised phrased.")
+        state.remember(self.ordinal, memory)
+        return True
+
+    def recall(self, state: SessionState) -> str:
+        return state.recall(self.ordinal)
 
 
 @dataclasses.dataclass
@@ -154,27 +400,120 @@ KeyStack_t = typing.List[KeyStackedWord]
 
 class RuleSet:
     _log = logging.getLogger("RuleSet")
+    _none_rule_keyword = ProcessingWord("NONE")
+    # links followed in one turn before giving up, keywords can link in a loop
+    max_links = 100
 
     def __init__(
         self,
         greetings: typing.List[str],
         rules: typing.Mapping[str, ElizaRule],
         memory_rules: typing.List[typing.Tuple[str, Memory]],
+        overwritten: typing.Sequence[typing.Tuple[str, ElizaRule]] = (),
     ):
         self.greetings = greetings
+        # earlier definitions of keywords defined again, they never run
+        self.overwritten = list(overwritten)
         self.rules = {ProcessingWord(w): r for w, r in rules.items()}
         self.memory_rules = collections.OrderedDict(
             [(ProcessingWord(w), r) for w, r in memory_rules]
         )
-        self._none_rule: Transformation = self.rules[ProcessingWord("NONE")]
-
-    def get_response_for(self, phrase) -> typing.Optional[str]:
-        """Build a response for a phrase or return None if not possible."""
+        self._none_rule: Transformation = self.rules[self._none_rule_keyword]
+        self._keyword_trie = self._build_keyword_trie()
+        self.patterns = PatternTable()
+        self._number_rules()
+        # what a backend only builds when it is first used, see precompile
+        self._builders: typing.List[typing.Callable[[], None]] = []
+        # used by callers that do not keep their own sessions
+        self.default_state = SessionState()
+
+    def _number_rules(self) -> None:
+        """Give every rule a stable ordinal so session state can refer to it.
+
+        Identical decomposition patterns are given one id, so a turn only
+        matches each of them once, see MatchMemo.
+        """
+        numbered = set()
+        for rule in list(self.rules.values()) + list(self.memory_rules.values()):
+            if id(rule) not in numbered:
+                rule.number(len(numbered), self.patterns)
+                numbered.add(id(rule))
+
+    def add_builder(self, build: typing.Callable[[], None]) -> None:
+        """Have precompile call build."""
+        self._builders.append(build)
+
+    def precompile(self) -> None:
+        """Parse every rule and build what matching would build on first use.
+
+        Done in a parent before it forks, its workers share one copy instead
+        of each building their own.
+        """
+        for rule in list(self.rules.values()) + list(self.memory_rules.values()):
+            if isinstance(rule, (Transformation, Memory)):
+                rule.automaton
+        for build in self._builders:
+            build()
+
+    def replace_rule(
+        self, keyword: ProcessingWord, rule: typing.Optional[ElizaRule]
+    ) -> None:
+        """Use rule for keyword from now on, or drop the keyword if rule is None."""
+        if keyword == self._none_rule_keyword:
+            raise ValueError("the NONE rule can't be replaced")
+        if rule is None:
+            del self.rules[keyword]
+        else:
+            self.rules[keyword] = rule
+        self._keyword_trie = self._build_keyword_trie()
+
+    def _build_keyword_trie(self) -> dict:
+        """Trie of the keywords made of several words, a word to the next node.
+
+        A node's None entry holds the keyword that ends there and its rule.
+        """
+        trie: dict = {}
+        for keyword, rule in self.rules.items():
+            words = keyword.word.split()
+            if len(words) < 2:
+                continue
+            if not isinstance(rule, (Transformation, Equivalence)):
+                raise ValueError(
+                    f"keyword '{keyword.word}' has several words, it can only "
+                    "be a transformation or an equivalence"
+                )
+            if rule._substitution is not None:
+                raise ValueError(
+                    f"keyword '{keyword.word}' has several words and can't be substituted"
+                )
+            node = trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node[None] = (keyword, rule)
+        for keyword in self.memory_rules:
+            if len(keyword.word.split()) > 1:
+                raise ValueError(f"memory keyword '{keyword.word}' must be one word")
+        return trie
+
+    def get_response_for(
+        self,
+        phrase,
+        budget: typing.Optional[MatchBudget] = None,
+        state: typing.Optional[SessionState] = None,
+    ) -> typing.Optional[str]:
+        """Build a response for a phrase or return None if not possible.
+
+        Raises MatchBudgetExceeded if a budget is given and matching uses it
+        up, or if more than max_links links are followed.
+        """
+        if state is None:
+            state = self.default_state
         processing_phrase = ProcessingPhrase(phrase)
         substitution_count, keystack, memory_keystack = self._build_keystacks(
             processing_phrase
         )
-        self._memorise(memory_keystack, processing_phrase)
+        memo = MatchMemo()
+        self._memorise(memory_keystack, processing_phrase, state, budget, memo)
         if not substitution_count and not keystack:
             self._log.debug(f'no keywords in "{phrase}"')
             return None
@@ -185,46 +524,84 @@ class RuleSet:
             f'after substitutions phrase is "{processing_phrase.to_string()}"'
         )
 
-        processing_phrase = self._apply_keystack(processing_phrase, keystack)
+        response = self._apply_keystack(
+            processing_phrase, keystack, budget, state, memo
+        )
 
         self._log.debug(f"finished building response")
-        return processing_phrase.to_string()
+        if isinstance(response, ProcessingPhrase):
+            return response.to_string()
+        return response
 
-    def _memorise(self, memory_keystack: KeyStack_t, phrase: ProcessingPhrase):
+    def _memorise(
+        self,
+        memory_keystack: KeyStack_t,
+        phrase: ProcessingPhrase,
+        state: SessionState,
+        budget: typing.Optional[MatchBudget] = None,
+        memo: typing.Optional[MatchMemo] = None,
+    ):
         """Add to memorised rules."""
         self._log.info(f"{len(memory_keystack)} memory rules have been activated.")
         for mem in memory_keystack:
             self._log.debug(f"attempting to add memory for {mem.org_word}")
-            if not mem.rule.memorise(phrase):
+            if not mem.rule.memorise(phrase, state, budget, memo):
                 self._log.debug("no available decompisition rules.")
 
-    def get_no_keyword_reponse(self) -> str:
+    def get_no_keyword_reponse(
+        self, state: typing.Optional[SessionState] = None
+    ) -> str:
         """Figure out a response if there were no keywords in the user input."""
-        response = self._get_memory_response()
+        if state is None:
+            state = self.default_state
+        response = self._get_memory_response(state)
         if not response:
-            response = self._get_none_response()
+            response = self.get_none_response(state)
         return response
 
-    def _get_memory_response(self) -> str:
+    def _get_memory_response(self, state: SessionState) -> str:
         for mem_rule in self.memory_rules.values():
-            response = mem_rule.recall()
+            response = mem_rule.recall(state)
             if response:
-                return response.to_string()
+                return response
         return ""
 
-    def _get_none_response(self) -> str:
-        _, phrase = self._none_rule.apply_transform(None, ProcessingPhrase(""))
-        return phrase.to_string()
+    def get_none_response(self, state: typing.Optional[SessionState] = None) -> str:
+        """The reply used when nothing else applies."""
+        if state is None:
+            state = self.default_state
+        _, response = self._none_rule.apply_transform(
+            None, ProcessingPhrase(""), render=True, state=state
+        )
+        if isinstance(response, ProcessingPhrase):
+            return response.to_string()
+        return response
 
     def _build_keystacks(
         self, phrase: ProcessingPhrase
     ) -> typing.Tuple[int, KeyStack_t, KeyStack_t]:
-        """Determine the keystack in the precedence order and tags the words."""
+        """Determine the keystack in the precedence order and tags the words.
+
+        A keyword of several words takes the place of the keywords among its
+        words, which are still substituted and tagged.
+        """
         keystack = []
         memory_keystack = []
         substitution_count = 0
         top_precedence = 0  # sorting is not straightforward
-        for word in phrase:
+        words = phrase.words
+        covered_until = 0
+        for idx, word in enumerate(words):
+            if self._keyword_trie and idx >= covered_until:
+                found = self._match_keyword_phrase(words, idx)
+                if found is not None:
+                    keyword, rule, covered_until = found
+                    entry = KeyStackedWord(ProcessingWord(keyword), rule)
+                    if rule.precedence > top_precedence:
+                        keystack.insert(0, entry)
+                        top_precedence = rule.precedence
+                    else:
+                        keystack.append(entry)
             if word in self.memory_rules:
                 memory_keystack.append(KeyStackedWord(word, self.memory_rules[word]))
             if word not in self.rules:
@@ -237,6 +614,8 @@ class RuleSet:
             if isinstance(rule, TagWord):
                 rule.tag_word(word)
                 continue
+            if idx < covered_until:
+                continue  # the longer keyword stands in for this one
             if rule.precedence > top_precedence:
                 keystack.insert(0, KeyStackedWord(word, rule))
                 top_precedence = rule.precedence
@@ -244,14 +623,50 @@ class RuleSet:
                 keystack.append(KeyStackedWord(word, rule))
         return substitution_count, keystack, memory_keystack
 
-    def _apply_keystack(self, phrase: ProcessingPhrase, keystack: KeyStack_t):
+    def _match_keyword_phrase(
+        self, words: typing.List[ProcessingWord], start: int
+    ) -> typing.Optional[typing.Tuple[ProcessingWord, ElizaRule, int]]:
+        """The longest keyword of several words starting at start, and where it ends.
+
+        The words from start on have not been substituted yet, so keywords
+        match what the user wrote.
+        """
+        node = self._keyword_trie
+        found = None
+        for pos in range(start, len(words)):
+            node = node.get(words[pos].word)
+            if node is None:
+                break
+            if None in node:
+                found = (*node[None], pos + 1)
+        return found
+
+    def _apply_keystack(
+        self,
+        phrase: ProcessingPhrase,
+        keystack: KeyStack_t,
+        budget: typing.Optional[MatchBudget] = None,
+        state: typing.Optional[SessionState] = None,
+        memo: typing.Optional[MatchMemo] = None,
+    ) -> typing.Union[ProcessingPhrase, str]:
+        """Run the keystack, the last rule to run can give the reply as text."""
+        links = 0
         while keystack:
             top = keystack.pop(0)
-            linked_rule_key, phrase = top.rule.apply_transform(top.word, phrase)
+            linked_rule_key, phrase = top.rule.apply_transform(
+                top.word, phrase, not keystack, budget, state, memo
+            )
+            if isinstance(phrase, str):
+                return phrase
 
             if linked_rule_key is not None:
                 linked_rule = self.rules.get(linked_rule_key)
                 if linked_rule is not None:
+                    links += 1
+                    if links > self.max_links:
+                        raise MatchBudgetExceeded(
+                            f"followed more than {self.max_links} links"
+                        )
                     self._log.info(
                         f"replacing rule for {top.word} with rule for {linked_rule_key}"
                     )
@@ -0,0 +1,136 @@
+import logging
+import os
+import socket
+import socketserver
+import typing
+
+from .eliza import Eliza
+from .transcript import TranscriptWriter
+
+if typing.TYPE_CHECKING:
+    from .capture import CaptureWriter
+    from .profiling import Profiler
+    from .shadow import ShadowRunner
+
+
+class _ConversationHandler(socketserver.StreamRequestHandler):
+    """One connection is one session, a line in gets a line out.
+
+    Every session shares the server's parsed script.
+    """
+
+    def handle(self):
+        log = logging.getLogger("server")
+        session = self.server.eliza.session()
+        self.wfile.write(session.greet().encode())
+        for raw_line in self.rfile:
+            line = raw_line.decode(errors="replace").strip()
+            try:
+                response = session.respond_to(line)
+            except Exception:
+                log.exception(f"failed to respond to '{line}'")
+                return
+            self.wfile.write(response.encode())
+            if self.server.on_turn is not None:
+                self.server.on_turn()
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        super().server_bind()
+        self._owner_pid = os.getpid()
+
+    def server_close(self):
+        super().server_close()
+        if os.getpid() != self._owner_pid:
+            return  # a forked worker, the socket file belongs to its parent
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def parse_address(address: str) -> typing.Tuple[int, typing.Union[str, tuple]]:
+    """Turn 'host:port' or a unix socket path into a socket family and address."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+def make_server(
+    script: typing.Iterable[str],
+    address: str,
+    lazy: bool = True,
+    transcript: typing.Optional[TranscriptWriter] = None,
+    max_match_steps: typing.Optional[int] = None,
+    max_match_seconds: typing.Optional[float] = None,
+    backend: str = "interpreter",
+    codegen_cache: typing.Optional[str] = None,
+    profiler: typing.Optional["Profiler"] = None,
+    capture: typing.Optional["CaptureWriter"] = None,
+    shadow: typing.Optional["ShadowRunner"] = None,
+) -> socketserver.BaseServer:
+    """Build a line based conversation server listening on address."""
+    family, addr = parse_address(address)
+    server_cls = _TCPServer if family == socket.AF_INET else _UnixServer
+    if family == socket.AF_UNIX and os.path.exists(addr):
+        os.unlink(addr)  # left behind by a server that was killed
+    server = server_cls(addr, _ConversationHandler)
+    server.eliza = Eliza(
+        script,
+        lazy,
+        transcript,
+        max_match_steps=max_match_steps,
+        max_match_seconds=max_match_seconds,
+        backend=backend,
+        codegen_cache=codegen_cache,
+        profiler=profiler,
+        capture=capture,
+        shadow=shadow,
+    )
+    # called after every turn, see prefork
+    server.on_turn = None
+    return server
+
+
+def serve(
+    script: typing.Iterable[str],
+    address: str,
+    lazy: bool = True,
+    transcript: typing.Optional[TranscriptWriter] = None,
+    max_match_steps: typing.Optional[int] = None,
+    max_match_seconds: typing.Optional[float] = None,
+    backend: str = "interpreter",
+    codegen_cache: typing.Optional[str] = None,
+    profiler: typing.Optional["Profiler"] = None,
+    capture: typing.Optional["CaptureWriter"] = None,
+    shadow: typing.Optional["ShadowRunner"] = None,
+):
+    log = logging.getLogger("pyliza")
+    server = make_server(
+        script,
+        address,
+        lazy,
+        transcript,
+        max_match_steps,
+        max_match_seconds,
+        backend,
+        codegen_cache,
+        profiler,
+        capture,
+        shadow,
+    )
+    log.info(f"serving conversations on {address}")
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,154 @@
+import logging
+import random
+import re
+import time
+import typing
+import uuid
+
+from .ruleset import RuleSet
+from .state import SessionState
+from .transformation import MatchBudget, MatchBudgetExceeded
+from . import metrics, utils
+
+if typing.TYPE_CHECKING:
+    from .capture import CaptureWriter
+    from .profiling import Profiler
+    from .shadow import ShadowRunner
+    from .store import SessionStore
+    from .transcript import TranscriptWriter
+
+
+class Session:
+    """One conversation with a shared, read only, rule set."""
+
+    none_re = re.compile(r"(^|\s)NONE(\s|$)")
+    memory_re = re.compile(r"(^|\s)MEMORY(\s|$)")
+    rev_none_re = re.compile(r"(^|\s)zNONE(\s|$)")
+    rev_memory_re = re.compile(r"(^|\s)zMEMORY(\s|$)")
+
+    def __init__(
+        self,
+        rule_set: RuleSet,
+        session_id: typing.Optional[str] = None,
+        state: typing.Optional[SessionState] = None,
+        transcript: typing.Optional["TranscriptWriter"] = None,
+        max_match_steps: typing.Optional[int] = None,
+        max_match_seconds: typing.Optional[float] = None,
+        store: typing.Optional["SessionStore"] = None,
+        profiler: typing.Optional["Profiler"] = None,
+        capture: typing.Optional["CaptureWriter"] = None,
+        shadow: typing.Optional["ShadowRunner"] = None,
+    ):
+        self._rule_set = rule_set
+        self.session_id = session_id if session_id is not None else uuid.uuid4().hex
+        self._state = state if state is not None else SessionState()
+        self._transcript = transcript
+        self._store = store
+        self._profiler = profiler
+        self._capture = capture
+        self._shadow = shadow
+        self._match_budget = None
+        if max_match_steps is not None or max_match_seconds is not None:
+            self._match_budget = MatchBudget(max_match_steps, max_match_seconds)
+
+    @property
+    def state(self) -> SessionState:
+        return self._state
+
+    def greet(self) -> str:
+        """Pick a random greeting from the available options."""
+        greeting = random.choice(self._rule_set.greetings)
+        if self._transcript is not None:
+            self._transcript.record(self.session_id, "greeting", greeting)
+        return greeting
+
+    def respond_to(self, user_input: str) -> str:
+        """Get the appropriate response to the user."""
+        arrived = time.time() if self._capture is not None else 0.0
+        before = None
+        if self._shadow is not None and self._shadow.sample():
+            before = self._state.fork()
+            started = time.perf_counter()
+        if self._profiler is not None:
+            with self._profiler.profiling(response=True):
+                response = self._respond_to(user_input)
+        else:
+            response = self._respond_to(user_input)
+        if self._capture is not None:
+            self._capture.record(self.session_id, arrived, user_input, response)
+        if before is not None:
+            self._shadow.submit(
+                self.session_id,
+                user_input,
+                before,
+                response,
+                self._state.fork(),
+                time.perf_counter() - started,
+            )
+        return response
+
+    def _respond_to(self, user_input: str) -> str:
+        if self._transcript is not None:
+            self._transcript.record(self.session_id, "user", user_input)
+        u_input = self.none_re.sub("zNONE", user_input.upper())
+        u_input = self.memory_re.sub("zMEMORY", u_input)
+
+        if self._match_budget is not None:
+            self._match_budget.reset()
+        try:
+            response = None
+            for phrase in utils.split_phrases(u_input):
+                response = self._rule_set.get_response_for(
+                    phrase, self._match_budget, self._state
+                )
+                if response is not None:
+                    break
+        except MatchBudgetExceeded as err:
+            logging.getLogger("pyliza").warning(f"giving up on '{user_input}': {err}")
+            metrics.METRICS.increment("match_budget_exhausted")
+            response = self._rule_set.get_none_response(self._state)
+
+        if response is None:
+            response = self._rule_set.get_no_keyword_reponse(self._state)
+
+        response = self._finalise_response(response)
+        if self._store is not None:
+            self._store.save(self.session_id, self._state)
+        if self._transcript is not None:
+            self._transcript.record(self.session_id, "eliza", response)
+        return response
+
+    def _finalise_response(self, response: str) -> str:
+        if "zNONE" in response:
+            response = self.rev_none_re.sub("NONE", response)
+        if "zMEMORY" in response:
+            response = self.rev_memory_re.sub("MEMORY", response)
+        return response.strip() + "\n"
+
+    def fork(
+        self,
+        session_id: typing.Optional[str] = None,
+        transcript: typing.Optional["TranscriptWriter"] = None,
+    ) -> "Session":
+        """A new conversation carrying on from this point, cheap to make."""
+        budget = self._match_budget
+        return Session(
+            self._rule_set,
+            session_id,
+            self._state.fork(),
+            transcript,
+            budget.max_steps if budget is not None else None,
+            budget.max_seconds if budget is not None else None,
+            self._store,
+            self._profiler,
+            self._capture,
+            self._shadow,
+        )
+
+    def snapshot(self) -> SessionState:
+        """Capture the conversation state, use to_bytes on it to store it."""
+        return self._state.fork()
+
+    def restore(self, snapshot: SessionState) -> None:
+        """Go back to a snapshot, the snapshot can be restored again later."""
+        self._state = snapshot.fork()
@@ -0,0 +1,216 @@
+"""Check a backend against the reference by running a sample of turns on both.
+
+A session answers every turn on its own backend. For a sampled turn it also
+hands the state from before the turn, the input, its reply and the state
+after to a shadow runner. The runner's thread answers the turn again on a
+reference copy of the script, starting from that earlier state, and records
+whether the reply and the state it ends in are the same. The reference run
+happens after the reply has been sent and only ever works on copies of the
+state, so it adds nothing to the session's latency and can't change it.
+"""
+
+import dataclasses
+import logging
+import queue
+import random
+import threading
+import time
+import typing
+
+from .loadtest import LatencyHistogram
+from .rule_parsing import ScriptParser
+from .session import Session
+from .state import SessionState
+from . import metrics
+
+
+class ShadowTurn(typing.NamedTuple):
+    session_id: str
+    text: str
+    before: SessionState
+    reply: str
+    after: SessionState
+    seconds: float
+
+
+@dataclasses.dataclass
+class ShadowMismatch:
+    session_id: str
+    text: str
+    reply: str
+    reference_reply: str
+    same_state: bool
+    delta_s: float
+
+
+@dataclasses.dataclass
+class ShadowReport:
+    turns: int
+    mismatches: int
+    state_mismatches: int
+    dropped: int
+    latency: LatencyHistogram
+    reference_latency: LatencyHistogram
+    examples: typing.List[ShadowMismatch]
+
+    def format(self) -> str:
+        lines = [
+            f"shadowed {self.turns} turns, {self.dropped} dropped",
+            f"different replies: {self.mismatches}, "
+            f"different state: {self.state_mismatches}",
+            "latency (us)     backend  reference",
+        ]
+        for pct, value in self.latency.distribution((50, 90, 99)):
+            reference = self.reference_latency.percentile(pct)
+            lines.append(f"  p{pct:<6g} {value:>16d} {reference:>10d}")
+        for mismatch in self.examples:
+            lines.append(
+                f"  {mismatch.session_id} '{mismatch.text}': "
+                f"{mismatch.reply.strip()!r}, reference "
+                f"{mismatch.reference_reply.strip()!r}, "
+                f"{mismatch.delta_s * 1e6:+.0f}us"
+            )
+        return "\n".join(lines)
+
+
+class ShadowRunner:
+    """Replays a fraction of turns on the reference backend in a thread.
+
+    Turns are queued for the thread, when the queue is full they are dropped
+    and counted rather than slowing the session down. The reference rule set
+    is parsed from the script again, it is only ever used by the thread.
+    """
+
+    def __init__(
+        self,
+        script: typing.Iterable[str],
+        rate: float,
+        lazy: bool = True,
+        max_match_steps: typing.Optional[int] = None,
+        max_match_seconds: typing.Optional[float] = None,
+        queue_size: int = 1000,
+        max_examples: int = 10,
+    ) -> None:
+        if not 0 <= rate <= 1:
+            raise ValueError(f"shadow rate must be between 0 and 1, not {rate}")
+        self._log = logging.getLogger("shadow")
+        self.rate = rate
+        self._rule_set = ScriptParser.parse(script, lazy)
+        self._max_match_steps = max_match_steps
+        self._max_match_seconds = max_match_seconds
+        self._max_examples = max_examples
+        # not the module's random, sessions greet with that
+        self._random = random.Random()
+        self._queue: "queue.Queue[typing.Optional[ShadowTurn]]" = queue.Queue(
+            queue_size
+        )
+        self._lock = threading.Lock()
+        self._turns = self._mismatches = self._state_mismatches = self._dropped = 0
+        self._latency = LatencyHistogram()
+        self._reference_latency = LatencyHistogram()
+        self._examples: typing.List[ShadowMismatch] = []
+        self._thread = threading.Thread(target=self._run, name="shadow", daemon=True)
+        self._thread.start()
+
+    def sample(self) -> bool:
+        """Whether to shadow the next turn."""
+        return self.rate >= 1 or self._random.random() < self.rate
+
+    def submit(
+        self,
+        session_id: str,
+        text: str,
+        before: SessionState,
+        reply: str,
+        after: SessionState,
+        seconds: float,
+    ) -> None:
+        """Queue a turn the session has answered, with its state either side."""
+        turn = ShadowTurn(session_id, text, before, reply, after, seconds)
+        try:
+            self._queue.put_nowait(turn)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            metrics.METRICS.increment("shadow_dropped")
+
+    def wait(self) -> None:
+        """Block until every turn submitted so far has been checked."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Check the turns still queued and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self) -> "ShadowRunner":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def report(self) -> ShadowReport:
+        with self._lock:
+            latency = LatencyHistogram()
+            latency.merge(self._latency)
+            reference_latency = LatencyHistogram()
+            reference_latency.merge(self._reference_latency)
+            return ShadowReport(
+                self._turns,
+                self._mismatches,
+                self._state_mismatches,
+                self._dropped,
+                latency,
+                reference_latency,
+                list(self._examples),
+            )
+
+    def _run(self) -> None:
+        while True:
+            turn = self._queue.get()
+            try:
+                if turn is None:
+                    return
+                self._check(turn)
+            except Exception:
+                self._log.exception("shadow run failed")
+            finally:
+                self._queue.task_done()
+
+    def _check(self, turn: ShadowTurn) -> None:
+        session = Session(
+            self._rule_set,
+            turn.session_id,
+            turn.before,
+            max_match_steps=self._max_match_steps,
+            max_match_seconds=self._max_match_seconds,
+        )
+        start = time.perf_counter()
+        reply = session.respond_to(turn.text)
+        elapsed = time.perf_counter() - start
+        same_reply = reply == turn.reply
+        same_state = session.state == turn.after
+        with self._lock:
+            self._turns += 1
+            self._latency.record(turn.seconds)
+            self._reference_latency.record(elapsed)
+            if same_reply and same_state:
+                return
+            self._mismatches += not same_reply
+            self._state_mismatches += not same_state
+            mismatch = ShadowMismatch(
+                turn.session_id,
+                turn.text,
+                turn.reply,
+                reply,
+                same_state,
+                turn.seconds - elapsed,
+            )
+            if len(self._examples) < self._max_examples:
+                self._examples.append(mismatch)
+        metrics.METRICS.increment("shadow_mismatches")
+        self._log.warning(
+            f"{turn.session_id} '{turn.text}': backend said "
+            f"{turn.reply.strip()!r}, reference said {reply.strip()!r}"
+            + ("" if same_state else ", and the session state differs")
+        )
@@ -0,0 +1,185 @@
+import array
+import typing
+
+# transformation rule ids are a keyword's ordinal and a 16 bit index
+_ID_TYPE = "I" if array.array("I").itemsize >= 4 else "L"
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> typing.Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class SessionState:
+    """Everything that changes as a conversation goes on.
+
+    That is which reassembly each transformation rule will use next, keyed by
+    the rule's id, and the queue of memories for each memory rule, keyed by the
+    rule's ordinal. A conversation only moves on the few rules it fires, so
+    the cursors are kept sparsely, as an array of the ids of the rules touched
+    and a parallel array of where each has got to, and neither container is
+    made until it is first written. Forks share both until one of them
+    writes, so a fork only costs as much as the state it goes on to change.
+    """
+
+    __slots__ = ("_rule_ids", "_cursors", "_memories", "_shared")
+
+    _format_version = 1
+    _shared_cursors = 1
+    _shared_memories = 2
+
+    def __init__(self) -> None:
+        self._rule_ids: typing.Optional[array.array] = None
+        self._cursors: typing.Optional[array.array] = None
+        self._memories: typing.Optional[typing.Dict[int, typing.Tuple[str, ...]]] = None
+        self._shared = 0
+
+    def next_reassembly(self, rule_id: int, num_reassemblies: int) -> int:
+        """Index of the reassembly to use now, moving the rule on to the next."""
+        pos = -1
+        if self._rule_ids is not None:
+            try:
+                pos = self._rule_ids.index(rule_id)
+            except ValueError:
+                pass
+        # a cursor saved with another version of the script can be past the end
+        idx = self._cursors[pos] % num_reassemblies if pos >= 0 else 0
+        self._own_cursors()
+        following = (idx + 1) % num_reassemblies
+        if pos >= 0:
+            self._cursors[pos] = following
+        else:
+            self._add_cursor(rule_id, following)
+        return idx
+
+    def _own_cursors(self) -> None:
+        if self._rule_ids is None:
+            self._rule_ids = array.array(_ID_TYPE)
+            self._cursors = array.array("H")
+        elif self._shared & self._shared_cursors:
+            self._rule_ids = self._rule_ids[:]
+            self._cursors = self._cursors[:]
+            self._shared &= ~self._shared_cursors
+
+    def _add_cursor(self, rule_id: int, idx: int) -> None:
+        if not 0 <= rule_id < 1 << 64:
+            raise ValueError(f"rule id {rule_id} is out of range")
+        try:
+            self._rule_ids.append(rule_id)
+        except OverflowError:
+            # only ids made up outside a rule set are this big
+            self._rule_ids = array.array("Q", self._rule_ids)
+            self._rule_ids.append(rule_id)
+        self._cursors.append(idx)
+
+    def _cursor_items(self) -> typing.Iterator[typing.Tuple[int, int]]:
+        if self._rule_ids is None:
+            return iter(())
+        return zip(self._rule_ids, self._cursors)
+
+    def remember(self, memory_id: int, text: str) -> None:
+        self._own_memories()
+        self._memories[memory_id] = self._memories.get(memory_id, ()) + (text,)
+
+    def recall(self, memory_id: int) -> str:
+        """Oldest memory for the rule, or an empty string if there is none."""
+        if self._memories is None:
+            return ""
+        memories = self._memories.get(memory_id)
+        if not memories:
+            return ""
+        self._own_memories()
+        self._memories[memory_id] = memories[1:]
+        return memories[0]
+
+    def _own_memories(self) -> None:
+        if self._memories is None:
+            self._memories = {}
+        elif self._shared & self._shared_memories:
+            self._memories = self._memories.copy()
+            self._shared &= ~self._shared_memories
+
+    def fork(self) -> "SessionState":
+        """An independent copy that shares storage until either side changes."""
+        other = SessionState()
+        other._rule_ids = self._rule_ids
+        other._cursors = self._cursors
+        other._memories = self._memories
+        other._shared = self._shared = self._shared_cursors | self._shared_memories
+        return other
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SessionState):
+            return NotImplemented
+        return {k: v for k, v in self._cursor_items() if v} == {
+            k: v for k, v in other._cursor_items() if v
+        } and {k: v for k, v in (self._memories or {}).items() if v} == {
+            k: v for k, v in (other._memories or {}).items() if v
+        }
+
+    def to_bytes(self) -> bytes:
+        """Compact serialisation, cursors at 0 and empty queues are left out."""
+        out = bytearray([self._format_version])
+        cursors = sorted((k, v) for k, v in self._cursor_items() if v)
+        _write_varint(out, len(cursors))
+        for rule_id, idx in cursors:
+            _write_varint(out, rule_id)
+            _write_varint(out, idx)
+        memories = sorted((k, v) for k, v in (self._memories or {}).items() if v)
+        _write_varint(out, len(memories))
+        for memory_id, texts in memories:
+            _write_varint(out, memory_id)
+            _write_varint(out, len(texts))
+            for text in texts:
+                encoded = text.encode()
+                _write_varint(out, len(encoded))
+                out += encoded
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SessionState":
+        if not data or data[0] != cls._format_version:
+            raise ValueError("not a serialised session state")
+        try:
+            return cls._read(data)
+        except IndexError:
+            raise ValueError("serialised session state is cut short") from None
+
+    @classmethod
+    def _read(cls, data: bytes) -> "SessionState":
+        state = cls()
+        count, pos = _read_varint(data, 1)
+        for _ in range(count):
+            rule_id, pos = _read_varint(data, pos)
+            idx, pos = _read_varint(data, pos)
+            if idx > 0xFFFF:
+                raise ValueError(f"cursor {idx} of rule {rule_id} is out of range")
+            state._own_cursors()
+            state._add_cursor(rule_id, idx)
+        count, pos = _read_varint(data, pos)
+        for _ in range(count):
+            memory_id, pos = _read_varint(data, pos)
+            num_texts, pos = _read_varint(data, pos)
+            texts = []
+            for _ in range(num_texts):
+                length, pos = _read_varint(data, pos)
+                texts.append(data[pos : pos + length].decode())
+                pos += length
+            state._own_memories()
+            state._memories[memory_id] = tuple(texts)
+        if pos != len(data):
+            raise ValueError("trailing data after serialised session state")
+        return state
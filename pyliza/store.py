@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from .state import SessionState
+
+
+class SessionStore:
+    """Keeps session state in sqlite so conversations survive restarts.
+
+    Saving only records the state as dirty, a background thread writes dirty
+    sessions in one transaction every flush_interval seconds, or sooner once
+    flush_count of them are waiting. Saving takes a fork of the state, so the
+    session can carry on changing while the write is pending. Loading checks
+    the sessions waiting to be written before going to the database.
+
+    Session state refers to rules by their place in the script, so each row
+    is written with the fingerprint of the script it was made with. Given a
+    fingerprint, rows saved with any other script are treated as never
+    saved, see script_fingerprint. Only the background thread writes, so
+    the last state saved for a session is always the one left on disk.
+    """
+
+    def __init__(
+        self,
+        path: typing.Union[str, os.PathLike],
+        flush_interval: float = 1.0,
+        flush_count: int = 256,
+        fingerprint: typing.Optional[str] = None,
+    ) -> None:
+        self._log = logging.getLogger("store")
+        self.path = os.fspath(path)
+        self.fingerprint = fingerprint
+        self._flush_interval = flush_interval
+        self._flush_count = flush_count
+        self._db = self._connect()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions"
+            " (session_id TEXT PRIMARY KEY, state BLOB NOT NULL, updated REAL NOT NULL,"
+            " script TEXT)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(sessions)")]
+        if "script" not in columns:  # made before rows had fingerprints
+            self._db.execute("ALTER TABLE sessions ADD COLUMN script TEXT")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._dirty: typing.Dict[str, SessionState] = {}
+        self._writing: typing.Dict[str, SessionState] = {}
+        self._lock = threading.Condition()
+        self._closing = False
+        # flushes asked for and flushes the writer has finished
+        self._flush_requests = 0
+        self._flushes_done = 0
+        self._thread = threading.Thread(
+            target=self._run, name="session-store", daemon=True
+        )
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def load(self, session_id: str) -> typing.Optional[SessionState]:
+        """The session's last saved state, or None if it has never been saved."""
+        with self._lock:
+            state = self._dirty.get(session_id) or self._writing.get(session_id)
+        if state is not None:
+            return state.fork()
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT state, script FROM sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        if self.fingerprint is not None and row[1] != self.fingerprint:
+            self._log.info(f"ignoring session {session_id} saved with another script")
+            return None
+        return SessionState.from_bytes(row[0])
+
+    def save(self, session_id: str, state: SessionState) -> None:
+        """Mark the session as needing writing, this does not wait for the disk."""
+        snapshot = state.fork()
+        with self._lock:
+            self._dirty[session_id] = snapshot
+            if len(self._dirty) >= self._flush_count:
+                self._lock.notify()
+
+    def flush(self) -> None:
+        """Write everything saved so far before returning."""
+        with self._lock:
+            if self._closing:
+                return  # closing writes everything anyway
+            self._flush_requests += 1
+            request = self._flush_requests
+            self._lock.notify()
+            self._lock.wait_for(lambda: self._flushes_done >= request)
+
+    def close(self) -> None:
+        if not self._thread.is_alive():
+            return
+        with self._lock:
+            self._closing = True
+            self._lock.notify()
+        self._thread.join()
+        self._db.close()
+
+    def __enter__(self) -> "SessionStore":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        db = self._connect()
+        try:
+            while True:
+                with self._lock:
+                    deadline = time.monotonic() + self._flush_interval
+                    while (
+                        not self._closing
+                        and self._flush_requests == self._flushes_done
+                        and len(self._dirty) < self._flush_count
+                        and time.monotonic() < deadline
+                    ):
+                        self._lock.wait(deadline - time.monotonic())
+                    batch, self._dirty = self._dirty, {}
+                    self._writing.update(batch)
+                    closing = self._closing
+                    requests = self._flush_requests
+                self._write(batch, db)
+                with self._lock:
+                    self._flushes_done = requests
+                    self._lock.notify_all()
+                if closing:
+                    return
+        finally:
+            db.close()
+
+    def _write(self, batch, db: sqlite3.Connection) -> None:
+        if not batch:
+            return
+        now = time.time()
+        rows = [
+            (session_id, state.to_bytes(), now, self.fingerprint)
+            for session_id, state in batch.items()
+        ]
+        try:
+            with db:
+                db.executemany(self._upsert, rows)
+        except sqlite3.Error:
+            self._log.exception(f"failed to write {len(rows)} sessions")
+        finally:
+            with self._lock:
+                for session_id, state in batch.items():
+                    if self._writing.get(session_id) is state:
+                        del self._writing[session_id]
+
+    _upsert = (
+        "INSERT OR REPLACE INTO sessions (session_id, state, updated, script)"
+        " VALUES (?, ?, ?, ?)"
+    )
+
+
+def script_fingerprint(script: typing.Iterable[str]) -> str:
+    """Identifies the script text, for SessionStore's fingerprint."""
+    return hashlib.sha256("".join(script).encode()).hexdigest()[:16]
@@ -0,0 +1,233 @@
+"""Run one corpus of conversations against many variants of a script.
+
+Every script and conversation pair is a job for a process pool. Each script
+is parsed once, in this process, and forked workers share the parsed rules.
+Where workers have to be spawned each of them parses the scripts once instead.
+Results come back in conversation order, so a conversation's row of replies is
+compared with the first script's and written out as soon as it is complete,
+and only a few rows are ever held at once.
+"""
+
+import dataclasses
+import difflib
+import gc
+import json
+import multiprocessing
+import os
+import time
+import typing
+
+from .eliza import Eliza
+
+# what each worker runs, set before the pool starts or by _init_worker
+_ELIZAS: typing.Optional[typing.List[Eliza]] = None
+_CORPUS: typing.Optional[typing.List[typing.List[str]]] = None
+
+
+@dataclasses.dataclass
+class ScriptResult:
+    name: str
+    parse_s: float
+    turns: int = 0
+    seconds: float = 0.0
+    different_turns: int = 0
+    different_conversations: int = 0
+
+    @property
+    def us_per_turn(self) -> float:
+        return self.seconds / self.turns * 1e6 if self.turns else 0.0
+
+
+@dataclasses.dataclass
+class SweepReport:
+    scripts: typing.List[ScriptResult]
+    conversations: int
+    processes: int
+    duration_s: float
+
+    def format(self) -> str:
+        lines = [
+            f"swept {self.conversations} conversations over {len(self.scripts)} "
+            f"scripts with {self.processes} processes in {self.duration_s:.3f}s",
+            f"{'script':<40s} {'parse ms':>9s} {'us/turn':>8s} {'turns':>6s} "
+            f"{'changed':>8s} {'convs':>6s}",
+        ]
+        for result in self.scripts:
+            lines.append(
+                f"{result.name:<40s} {result.parse_s * 1000:>9.1f} "
+                f"{result.us_per_turn:>8.1f} {result.turns:>6d} "
+                f"{result.different_turns:>8d} {result.different_conversations:>6d}"
+            )
+        return "\n".join(lines)
+
+    def metrics(self) -> typing.Dict[str, float]:
+        metrics = {"sweep_duration_s": self.duration_s}
+        for idx, result in enumerate(self.scripts):
+            metrics[f"sweep.{idx}.us_per_turn"] = result.us_per_turn
+            metrics[f"sweep.{idx}.different_turns"] = result.different_turns
+        return metrics
+
+
+def _init_worker(
+    scripts: typing.List[typing.List[str]],
+    corpus: typing.List[typing.List[str]],
+    backend: str,
+) -> None:
+    global _ELIZAS, _CORPUS
+    if _ELIZAS is None:  # spawned rather than forked
+        _ELIZAS = [Eliza(script, backend=backend) for script in scripts]
+        _CORPUS = corpus
+
+
+def _run_job(
+    job: typing.Tuple[int, int],
+) -> typing.Tuple[int, int, typing.List[str], float]:
+    script_idx, conversation_idx = job
+    session = _ELIZAS[script_idx].session()
+    start = time.perf_counter()
+    replies = [session.respond_to(text) for text in _CORPUS[conversation_idx]]
+    return script_idx, conversation_idx, replies, time.perf_counter() - start
+
+
+def _diff(
+    inputs: typing.List[str],
+    expected: typing.List[str],
+    actual: typing.List[str],
+    from_name: str,
+    to_name: str,
+) -> typing.Iterator[str]:
+    def lines(replies):
+        return [f"{text} => {reply.strip()}" for text, reply in zip(inputs, replies)]
+
+    return difflib.unified_diff(
+        lines(expected), lines(actual), from_name, to_name, lineterm=""
+    )
+
+
+def sweep(
+    scripts: typing.Dict[str, typing.List[str]],
+    corpus: typing.Dict[str, typing.List[str]],
+    processes: typing.Optional[int] = None,
+    backend: str = "interpreter",
+    matrix_out: typing.Optional[typing.TextIO] = None,
+    diff_out: typing.Optional[typing.TextIO] = None,
+) -> SweepReport:
+    """Answer every conversation in corpus with every script.
+
+    Both are keyed by name, conversations are lists of user inputs. The first
+    script is the one the others are compared with. A row per conversation
+    with every script's replies is written to matrix_out as a json line, and
+    a unified diff for every script that replied differently to diff_out.
+    With processes set to 1 the jobs run in this process.
+    """
+    global _ELIZAS, _CORPUS
+    if not scripts:
+        raise ValueError("nothing to sweep, no scripts given")
+    names = list(scripts)
+    conversation_names = list(corpus)
+    conversations = list(corpus.values())
+    results = []
+    elizas = []
+    for name, script in scripts.items():
+        start = time.perf_counter()
+        eliza = Eliza(script, backend=backend)
+        # what a forked worker builds itself is built again in every worker
+        eliza.rule_set.precompile()
+        elizas.append(eliza)
+        results.append(ScriptResult(name, time.perf_counter() - start))
+    processes = processes or os.cpu_count() or 1
+    # conversation major, so rows complete one after another
+    jobs = [
+        (script_idx, conversation_idx)
+        for conversation_idx in range(len(conversations))
+        for script_idx in range(len(names))
+    ]
+
+    start = time.perf_counter()
+    pool = None
+    _ELIZAS, _CORPUS = elizas, conversations
+    try:
+        if processes == 1:
+            outcomes = map(_run_job, jobs)
+        else:
+            context = multiprocessing.get_context(
+                "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+            )
+            # keep the workers' collections off the parsed rules, see prefork
+            gc.collect()
+            gc.freeze()
+            try:
+                pool = context.Pool(
+                    processes,
+                    _init_worker,
+                    (list(scripts.values()), conversations, backend),
+                )
+            finally:
+                gc.unfreeze()
+            chunksize = max(1, len(jobs) // (processes * 16))
+            outcomes = pool.imap(_run_job, jobs, chunksize)
+
+        row: typing.List[typing.List[str]] = []
+        for script_idx, conversation_idx, replies, seconds in outcomes:
+            result = results[script_idx]
+            result.turns += len(replies)
+            result.seconds += seconds
+            row.append(replies)
+            if len(row) == len(names):
+                _finish_row(
+                    conversation_names[conversation_idx],
+                    conversations[conversation_idx],
+                    row,
+                    names,
+                    results,
+                    matrix_out,
+                    diff_out,
+                )
+                row = []
+    finally:
+        _ELIZAS = _CORPUS = None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return SweepReport(
+        results, len(conversations), processes, time.perf_counter() - start
+    )
+
+
+def _finish_row(
+    conversation: str,
+    inputs: typing.List[str],
+    row: typing.List[typing.List[str]],
+    names: typing.List[str],
+    results: typing.List[ScriptResult],
+    matrix_out: typing.Optional[typing.TextIO],
+    diff_out: typing.Optional[typing.TextIO],
+) -> None:
+    baseline = row[0]
+    for script_idx in range(1, len(row)):
+        replies = row[script_idx]
+        different = sum(a != b for a, b in zip(baseline, replies))
+        if not different:
+            continue
+        results[script_idx].different_turns += different
+        results[script_idx].different_conversations += 1
+        if diff_out is not None:
+            for line in _diff(
+                inputs,
+                baseline,
+                replies,
+                f"{names[0]}:{conversation}",
+                f"{names[script_idx]}:{conversation}",
+            ):
+                diff_out.write(line + "\n")
+    if matrix_out is not None:
+        matrix_out.write(
+            json.dumps(
+                {
+                    "conversation": conversation,
+                    "inputs": inputs,
+                    "replies": dict(zip(names, row)),
+                }
+            )
+            + "\n"
+        )
@@ -0,0 +1,7 @@
+class TerminalColours:
+    ELIZA = 96
+    USER = 95
+
+
+def print_colour(text: str, colour_code: int, *args, **kwargs):
+    print(f"\033[{colour_code}m" + text + f"\033[0m", *args, **kwargs)
@@ -0,0 +1,171 @@
+import datetime
+import enum
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import typing
+
+
+class OverflowPolicy(enum.Enum):
+    BLOCK = "block"  # wait for space, the response path slows down
+    DROP_NEWEST = "drop-newest"  # lose the entry being recorded
+    DROP_OLDEST = "drop-oldest"  # lose the oldest entry still waiting
+
+
+class TranscriptWriter:
+    """Keeps a record of every exchange without writing on the response path.
+
+    Entries are put on a bounded queue and a background thread writes them
+    out in batches as json lines. The file is rotated once it is larger than
+    max_bytes or older than max_age seconds, rotated files can be gzipped.
+    """
+
+    _stop = object()
+
+    def __init__(
+        self,
+        path: typing.Union[str, os.PathLike],
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_bytes: typing.Optional[int] = None,
+        max_age: typing.Optional[float] = None,
+        compress: bool = False,
+        overflow: OverflowPolicy = OverflowPolicy.BLOCK,
+    ) -> None:
+        self._log = logging.getLogger("transcript")
+        self.path = os.fspath(path)
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._compress = compress
+        self._overflow = OverflowPolicy(overflow)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._file = None
+        self._opened_at = 0.0
+        self._thread = threading.Thread(
+            target=self._run, name="transcript-writer", daemon=True
+        )
+        self._thread.start()
+
+    def record(self, session_id: str, kind: str, text: str) -> None:
+        """Queue an entry, this is all the response path pays for.
+
+        Entries recorded once the writer is closed are dropped.
+        """
+        entry = (session_id, time.time(), kind, text)
+        # taken by close too, so an entry is either queued before the stop
+        # marker or counted as dropped
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                return
+            if self._overflow is OverflowPolicy.BLOCK:
+                self._queue.put(entry)
+                return
+            try:
+                self._queue.put_nowait(entry)
+                return
+            except queue.Full:
+                pass
+            if self._overflow is OverflowPolicy.DROP_OLDEST:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(entry)
+                except queue.Full:
+                    pass
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Write out everything still queued and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if not self._thread.is_alive():
+                return
+            self._queue.put(self._stop)
+        self._thread.join()
+
+    def __enter__(self) -> "TranscriptWriter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        running = True
+        while running:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self._flush_interval))
+                while len(batch) < self._batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if self._stop in batch:
+                batch.remove(self._stop)
+                running = False
+            try:
+                self._write(batch)
+            except OSError:
+                self._log.exception(f"lost {len(batch)} transcript entries")
+        if self._file is not None:
+            self._file.close()
+
+    def _write(self, batch) -> None:
+        if not batch:
+            return
+        if self._file is not None and self._should_rotate():
+            self._rotate()
+        if self._file is None:
+            self._open()
+        self._file.write(
+            "".join(
+                json.dumps(
+                    {"session": session, "time": stamp, "kind": kind, "text": text}
+                )
+                + "\n"
+                for session, stamp, kind, text in batch
+            )
+        )
+        self._file.flush()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a")
+        self._opened_at = time.time()
+
+    def _should_rotate(self) -> bool:
+        if self._max_bytes is not None and self._file.tell() >= self._max_bytes:
+            return True
+        if self._max_age is not None and time.time() - self._opened_at >= self._max_age:
+            return True
+        return False
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        rotated = f"{self.path}.{stamp}"
+        suffix = 0
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            suffix += 1
+            rotated = f"{self.path}.{stamp}.{suffix}"
+        os.replace(self.path, rotated)
+        if self._compress:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.unlink(rotated)
+        self._log.info(f"rotated transcript to {rotated}")
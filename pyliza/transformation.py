@@ -1,12 +1,172 @@
-from asyncore import read
 import dataclasses
 import logging
+import threading
+import time
 import typing
 
-from .processing import ProcessingPhrase, ProcessingWord, WordMatch_t
+from .processing import (
+    PhraseSpan,
+    ProcessingPhrase,
+    ProcessingWord,
+    WordMatch_t,
+    WordTest,
+)
+
+if typing.TYPE_CHECKING:
+    from .state import SessionState
 
 DecompositionPattern_t = typing.List[typing.Union[int, WordMatch_t]]
-DecomposedPhrase_t = typing.List[typing.List[ProcessingWord]]
+DecomposedPhrase_t = typing.List[PhraseSpan]
+
+
+class MatchBudgetExceeded(Exception):
+    """Matching took more steps or time than the turn was allowed."""
+
+
+class MatchBudget:
+    """Limits the matching work done in one turn.
+
+    Every attempt to match the rest of a pattern from a position is a step.
+    The clock is only read every few steps to keep the check cheap.
+    """
+
+    _clock_interval = 64
+
+    def __init__(
+        self,
+        max_steps: typing.Optional[int] = None,
+        max_seconds: typing.Optional[float] = None,
+    ) -> None:
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.reset()
+
+    def reset(self) -> None:
+        """Start the budget again for a new turn."""
+        self.steps = 0
+        self._next_clock = self._clock_interval
+        self._deadline = (
+            time.perf_counter() + self.max_seconds
+            if self.max_seconds is not None
+            else None
+        )
+
+    def charge(self, steps: int = 1) -> None:
+        self.steps += steps
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise MatchBudgetExceeded(f"matching exceeded {self.max_steps} steps")
+        if self._deadline is not None and self.steps >= self._next_clock:
+            self._next_clock = self.steps + self._clock_interval
+            if time.perf_counter() > self._deadline:
+                raise MatchBudgetExceeded(
+                    f"matching exceeded {self.max_seconds * 1000:g}ms"
+                )
+
+
+class MatchMemo:
+    """Decompositions already worked out this turn, by pattern id and phrase.
+
+    A phrase's version is its word list. Phrases are not changed once the
+    keystack is built, and a link that passes the phrase on unchanged passes
+    on the same list, so a pattern matched against it again by a linked rule
+    or a memory gets the answer it got the first time. The memo keeps the
+    lists it has seen, so their ids aren't reused within the turn.
+    """
+
+    UNKNOWN = object()
+
+    def __init__(self) -> None:
+        self._results: typing.Dict[
+            typing.Tuple[int, int],
+            typing.Tuple[list, typing.Optional[DecomposedPhrase_t]],
+        ] = {}
+        self.hits = 0
+
+    def lookup(
+        self,
+        pattern_id: int,
+        words: list,
+        budget: typing.Optional[MatchBudget] = None,
+    ):
+        """The parts or None found before, UNKNOWN if the pattern wasn't tried.
+
+        An answer from the memo still costs a step, so rules that link to each
+        other in a loop use up the budget as they did before.
+        """
+        entry = self._results.get((pattern_id, id(words)))
+        if entry is None or entry[0] is not words:
+            return self.UNKNOWN
+        self.hits += 1
+        if budget is not None:
+            budget.charge()
+        return entry[1]
+
+    def record(
+        self,
+        pattern_id: int,
+        words: list,
+        parts: typing.Optional[DecomposedPhrase_t],
+    ) -> None:
+        self._results[pattern_id, id(words)] = (words, parts)
+
+    def match(self, pattern_id: int, words: list, decompose, budget):
+        """decompose(words, len(words), budget), unless it was done already."""
+        parts = self.lookup(pattern_id, words, budget)
+        if parts is self.UNKNOWN:
+            parts = decompose(words, len(words), budget)
+            self.record(pattern_id, words, parts)
+        return parts
+
+
+class PatternTable:
+    """Gives decomposition patterns that match the same phrases the same id."""
+
+    def __init__(self) -> None:
+        self._ids: typing.Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def intern(self, decomposition: "DecompositionRule") -> int:
+        key = tuple(decomposition.compiled)
+        pattern_id = self._ids.get(key)
+        if pattern_id is None:
+            with self._lock:
+                pattern_id = self._ids.setdefault(key, len(self._ids))
+        return pattern_id
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+@dataclasses.dataclass(frozen=True)
+class PatternComplexity:
+    """Worst case matching cost of a decomposition pattern.
+
+    Rule sets match with DecompositionAutomaton, which keeps at most one
+    thread in each of the pattern's states at every word, so the cost grows
+    as the phrase length times the number of states.
+    """
+
+    typical_phrase_length: typing.ClassVar[int] = 40
+    risky_cost: typing.ClassVar[int] = 10_000
+
+    # one for each word an int takes, one for every other part and one to
+    # accept, as DecompositionAutomaton compiles the pattern
+    states: int
+
+    def estimate(self, phrase_length: typing.Optional[int] = None) -> int:
+        """Upper bound on the threads stepped for a phrase of this length."""
+        if phrase_length is None:
+            phrase_length = self.typical_phrase_length
+        return (phrase_length + 1) * self.states
+
+    def is_risky(
+        self,
+        phrase_length: typing.Optional[int] = None,
+        max_cost: typing.Optional[int] = None,
+    ) -> bool:
+        if max_cost is None:
+            max_cost = self.risky_cost
+        return self.estimate(phrase_length) > max_cost
 
 
 class DecompositionRule:
@@ -17,6 +177,12 @@ class DecompositionRule:
             raise ValueError("decomposition needs at least one part")
         self._validate_pattern(decompostion_pattern)
         self._pattern = decompostion_pattern
+        self._compiled = [
+            part if isinstance(part, int) else WordTest.compile(part)
+            for part in decompostion_pattern
+        ]
+        # shared by identical patterns in a rule set, see PatternTable
+        self.pattern_id: typing.Optional[int] = None
 
     def _validate_pattern(self, pattern) -> None:
         """Check the pattern is valid"""
@@ -41,17 +207,38 @@ class DecompositionRule:
     def pattern(self) -> DecompositionPattern_t:
         return self._pattern
 
+    @property
+    def compiled(self) -> typing.List[typing.Union[int, WordTest]]:
+        """The pattern with its words and option sets turned into WordTests."""
+        return self._compiled
+
+    def complexity(self) -> PatternComplexity:
+        return PatternComplexity(
+            states=sum(
+                part if isinstance(part, int) and part > 0 else 1
+                for part in self._pattern
+            )
+            + 1
+        )
+
     def decompose(
-        self, phrase: ProcessingPhrase
+        self, phrase: ProcessingPhrase, budget: typing.Optional[MatchBudget] = None
     ) -> typing.Union[None, DecomposedPhrase_t]:
-        """Attempt to decompose the user input, return None if cannot."""
+        """Attempt to decompose the user input, return None if cannot.
+
+        This is the backtracking matcher DecompositionAutomaton is tested
+        against, rule sets match with the automaton. Raises
+        MatchBudgetExceeded if a budget is given and it runs out.
+        """
         if not isinstance(phrase, ProcessingPhrase):
             raise ValueError("phrase is not a ProcessingPhrase")
         # print()
         # print()
         # print("phrase", phrase)
         # print("pattern", self._pattern)
-        decomposed_phrase = self._decompose_from(phrase, 0, self._pattern[:], [])
+        decomposed_phrase = self._decompose_from(
+            phrase, 0, self._compiled[:], [], budget
+        )
         if decomposed_phrase is None:
             return None
         self._log.debug(
@@ -66,14 +253,17 @@ class DecompositionRule:
         pos: int,
         remaining_pattern: DecompositionPattern_t,
         decomposed: DecomposedPhrase_t,
+        budget: typing.Optional[MatchBudget] = None,
     ) -> typing.Union[None, DecomposedPhrase_t]:
         # print()
         # print("pos", pos, "remain", remaining_pattern, "decomposed", decomposed)
+        if budget is not None:
+            budget.charge()
         if not remaining_pattern:
             return None
         next_requirement = remaining_pattern.pop(0)
         part, new_pos, rest_decomposed = self._decompose_next(
-            phrase, pos, next_requirement, remaining_pattern
+            phrase, pos, next_requirement, remaining_pattern, budget
         )
         # print("part", part, "new_pos", new_pos, "rest", rest_decomposed)
         if part is None:
@@ -85,11 +275,13 @@ class DecompositionRule:
             return decomposed + rest_decomposed
         if not remaining_pattern and new_pos == len(phrase):
             return decomposed
-        return self._decompose_from(phrase, new_pos, remaining_pattern, decomposed)
+        return self._decompose_from(
+            phrase, new_pos, remaining_pattern, decomposed, budget
+        )
 
-    def _decompose_next(self, phrase, pos, next_part, remaining_pattern):
+    def _decompose_next(self, phrase, pos, next_part, remaining_pattern, budget=None):
         if next_part == 0:
-            return self._decompose_zero(phrase, pos, remaining_pattern)
+            return self._decompose_zero(phrase, pos, remaining_pattern, budget)
         if isinstance(next_part, int):
             return self._decompose_int(phrase, pos, next_part)
         return self._decompose_word(phrase, pos, next_part)
@@ -99,38 +291,38 @@ class DecompositionRule:
         phrase: ProcessingPhrase,
         pos: int,
         remaining_pattern: DecompositionPattern_t,
+        budget: typing.Optional[MatchBudget] = None,
     ):
         # if this is handled as a special case then if it falls off then end
         # if it failed to match
         if not remaining_pattern:
-            return phrase[pos:], len(phrase), None
+            return phrase.span(pos), len(phrase), None
 
         for end_of_zero in range(pos, len(phrase)):
             # non-greedy match
             rest_decomposed = self._decompose_from(
-                phrase, end_of_zero, remaining_pattern[:], []
+                phrase, end_of_zero, remaining_pattern[:], [], budget
             )
             if rest_decomposed is not None:
-                return phrase[pos:end_of_zero], len(phrase), rest_decomposed
+                return phrase.span(pos, end_of_zero), len(phrase), rest_decomposed
         return None, None, None
 
     def _decompose_int(self, phrase: ProcessingPhrase, pos: int, num_words: int):
         if pos + num_words > len(phrase):
             return None, None, None
-        return phrase[pos : pos + num_words], pos + num_words, None
+        return phrase.span(pos, pos + num_words), pos + num_words, None
 
     def _decompose_word(
         self,
         phrase: ProcessingPhrase,
         pos: int,
-        key_word: ProcessingWord,
+        key_word: WordTest,
     ):
         if pos >= len(phrase):
             return None, None, None
-        if not phrase[pos].matches(key_word):
+        if not key_word.passes(phrase[pos]):
             return None, None, None
-        part = [phrase[pos]]
-        return part, pos + 1, None
+        return phrase.span(pos, pos + 1), pos + 1, None
 
     def __str__(self):
         return " ".join(f"{pt}" for pt in self._pattern)
@@ -140,6 +332,45 @@ class ReassemblyRule:
     def __init__(self, reassembly_parts, link):
         self._parts = reassembly_parts
         self._link = link
+        self._template, self._constant = self._compile(reassembly_parts)
+
+    @property
+    def link(self) -> typing.Optional[ProcessingWord]:
+        return self._link
+
+    @property
+    def parts(self):
+        """The reassembly's words and 1 based part numbers, None to pass the phrase on."""
+        return self._parts
+
+    @property
+    def template(self) -> typing.Tuple[typing.Union[str, int], ...]:
+        """Constant text and 0 based part numbers that render builds the reply from."""
+        return self._template
+
+    @staticmethod
+    def _compile(
+        parts,
+    ) -> typing.Tuple[typing.Tuple[typing.Union[str, int], ...], typing.Optional[str]]:
+        """Turn the parts into constant text and 0 based decomposition slots.
+
+        The constant is the whole reply when there are no slots to fill.
+        """
+        if parts is None:
+            return (), None
+        template = []
+        for part in parts:
+            if isinstance(part, int):
+                template.append(part - 1)
+            elif part:
+                text = " ".join([w.word for w in part])
+                if template and isinstance(template[-1], str):
+                    text = template.pop() + " " + text
+                template.append(text)
+        template = tuple(template)
+        if all(isinstance(piece, str) for piece in template):
+            return template, " ".join(template)
+        return template, None
 
     def __str__(self) -> str:
         ret = ""
@@ -151,8 +382,11 @@ class ReassemblyRule:
 
     def apply(self, decomposed_phrase):
         if self._parts is None:
+            if decomposed_phrase and isinstance(decomposed_phrase[0], PhraseSpan):
+                # the parts cover the phrase, pass on its own word list
+                return self._link, ProcessingPhrase.trusted(decomposed_phrase[0].source)
             new_phrase = [p for d in decomposed_phrase for p in d]
-            return self._link, ProcessingPhrase(new_phrase)
+            return self._link, ProcessingPhrase.trusted(new_phrase)
 
         new_phrase = []
         for part in self._parts:
@@ -160,34 +394,86 @@ class ReassemblyRule:
                 new_phrase.extend(decomposed_phrase[part - 1])
             else:
                 new_phrase.extend(part)
-        return self._link, ProcessingPhrase(new_phrase)
+        return self._link, ProcessingPhrase.trusted(new_phrase)
+
+    def render(self, decomposed_phrase: DecomposedPhrase_t) -> str:
+        """Build the reply text directly, only for rules without a link."""
+        if self._constant is not None:
+            return self._constant
+        pieces = []
+        for piece in self._template:
+            if piece.__class__ is int:
+                segment = decomposed_phrase[piece]
+                if segment:
+                    pieces.append(" ".join([w.word for w in segment]))
+            else:
+                pieces.append(piece)
+        return " ".join(pieces)
 
 
 @dataclasses.dataclass
 class TransformRule:
     decompose: DecompositionRule
     reassemble: typing.Iterable[ReassemblyRule]
-    _reassemble_idx: int = dataclasses.field(init=False)
+    rule_id: int = dataclasses.field(init=False, default=-1)
+    # where the rule has got to when it is applied without a session state
+    _cursor: int = dataclasses.field(init=False, default=0, compare=False)
     _log: logging.Logger = dataclasses.field(init=False)
 
     def __post_init__(self):
-        self._reassemble_idx = 0
         self._log = logging.getLogger("transform_rule")
 
-    def get_reassemble(self):
-        res = self.reassemble[self._reassemble_idx]
-        self._reassemble_idx = (self._reassemble_idx + 1) % len(self.reassemble)
-        return res
+    def get_reassemble(self, state: typing.Optional["SessionState"] = None):
+        """The reassembly to use, moving the session on to the next one.
 
-    def apply(self, phrase):
+        Without a state the rule keeps its own place, as it did before there
+        were sessions, and so does a rule that isn't part of a rule set.
+        """
+        if len(self.reassemble) == 1:
+            return self.reassemble[0]
+        if state is None or self.rule_id < 0:
+            idx = self._cursor
+            self._cursor = (idx + 1) % len(self.reassemble)
+            return self.reassemble[idx]
+        return self.reassemble[
+            state.next_reassembly(self.rule_id, len(self.reassemble))
+        ]
+
+    def apply(
+        self,
+        phrase,
+        render: bool = False,
+        budget: typing.Optional[MatchBudget] = None,
+        state: typing.Optional["SessionState"] = None,
+    ):
+        """Decompose and reassemble the phrase.
+
+        If render is set and the reassembly does not link to another rule the
+        reply is returned as text instead of a new phrase. The session state
+        says which of the reassemblies is next. Only for a rule on its own, as
+        in the tests, rule sets match all of a keyword's rules at once and
+        call apply_decomposed.
+        """
         self._log.debug(
             f"attempting to match against decomposition rule: {self.decompose}"
         )
-        decomposed = self.decompose.decompose(phrase)
+        decomposed = self.decompose.decompose(phrase, budget)
         if decomposed is None:
             return None, None
+        return self.apply_decomposed(decomposed, render, state)
 
-        reassembly = self.get_reassemble()
+    def apply_decomposed(
+        self,
+        decomposed: DecomposedPhrase_t,
+        render: bool = False,
+        state: typing.Optional["SessionState"] = None,
+    ):
+        """Reassemble a phrase this rule's decomposition has already matched."""
+        reassembly = self.get_reassemble(state)
+        if render and reassembly.link is None:
+            text = reassembly.render(decomposed)
+            self._log.debug(f"applied reassembly rule: {reassembly}\n\treply: {text}")
+            return None, text
         linked_rule, phrase = reassembly.apply(decomposed)
         self._log.debug(
             f"applied reassembly rule: {reassembly}\n\tphrase is now: {phrase}"
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import contextlib
 import pathlib
 import argparse
 import logging
@@ -31,14 +32,98 @@ parser.add_argument(
     type=argparse.FileType(),
     help="coversation to use instead of commandline, comments with #",
 )
+parser.add_argument(
+    "--eager",
+    action="store_true",
+    help="parse every rule at startup instead of when first used",
+)
+# rules are parsed lazily by default, as with python -m pyliza
+parser.add_argument("-l", "--lazy", action="store_true", help=argparse.SUPPRESS)
+parser.add_argument(
+    "--transcript",
+    default=None,
+    help="append every exchange to this file as json lines",
+)
+parser.add_argument(
+    "--profile",
+    default=None,
+    metavar="OUT",
+    help="write pstats to OUT and flamegraph collapsed stacks next to it",
+)
+parser.add_argument(
+    "--profile-mode",
+    choices=["cprofile", "sample"],
+    default="cprofile",
+    help="profile every call, or sample the stack every millisecond",
+)
+parser.add_argument(
+    "--profile-responses-only",
+    action="store_true",
+    help="only profile answering turns, not parsing the script",
+)
+parser.add_argument(
+    "--client",
+    action="store_true",
+    help="hand the conversation to a background daemon that keeps the script "
+    "parsed, starting it if it isn't running",
+)
+parser.add_argument(
+    "--daemon-socket",
+    default=None,
+    help="unix socket of the daemon for --client",
+)
+parser.add_argument(
+    "--idle-timeout",
+    type=float,
+    default=600.0,
+    help="seconds a daemon started by --client waits for another client",
+)
 args = parser.parse_args()
+if args.client and (args.transcript or args.profile):
+    parser.error("--client can't be used with --transcript or --profile")
 
 logging.basicConfig(
     level={0: logging.WARN, 1: logging.INFO}.get(args.verbose, logging.DEBUG)
 )
 
-if args.test_conversation is not None:
-    pyliza.simulate(args.script, args.test_conversation)
+if args.client:
+    from pyliza import daemon_client
+
+    script_path = args.script.name
+    args.script.close()
+    if args.test_conversation is not None:
+        daemon_client.simulate(
+            script_path, args.test_conversation, args.daemon_socket, args.idle_timeout
+        )
+    else:
+        daemon_client.run_commandline(
+            script_path, args.daemon_socket, args.idle_timeout
+        )
     exit()
 
-pyliza.run_commandline(args.script)
+transcript = None
+if args.transcript is not None:
+    from pyliza.transcript import TranscriptWriter
+
+    transcript = TranscriptWriter(args.transcript)
+
+profiler = None
+if args.profile is not None:
+    from pyliza.profiling import Profiler
+
+    profiler = Profiler(args.profile_mode, args.profile_responses_only)
+
+try:
+    with profiler.profiling() if profiler is not None else contextlib.nullcontext():
+        if args.test_conversation is not None:
+            pyliza.simulate(
+                args.script, args.test_conversation, not args.eager, transcript, profiler
+            )
+            exit()
+
+        pyliza.run_commandline(args.script, not args.eager, transcript, profiler)
+finally:
+    if transcript is not None:
+        transcript.close()
+    if profiler is not None:
+        profiler.write(args.profile)
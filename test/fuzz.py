@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Search for patterns and inputs that make matching slow.
+
+Hypothesis is steered towards inputs that take more matching steps, every
+input found over the threshold is shrunk to a minimal reproducer and added
+to the regression corpus that `python -m pyliza bench` replays.
+"""
+
+import argparse
+import json
+import logging
+import pathlib
+
+import hypothesis
+from hypothesis import settings, target
+from hypothesis.errors import NoSuchExample
+
+from tests import pyliza_strategies as liza_st
+from pyliza import benchmark
+
+DEFAULT_CORPUS = pathlib.Path(__file__).parent / "../benchmarks/slow_inputs.json"
+
+
+def _entry_strategies():
+    return {
+        "decompose": liza_st.slow_decomposition().map(
+            lambda eg: {"kind": "decompose", "pattern": eg[0], "phrase": eg[1]}
+        ),
+        "response": liza_st.script_and_input().map(
+            lambda eg: {"kind": "response", "script": eg[0], "input": eg[1]}
+        ),
+    }
+
+
+def find_slow_input(strategy, max_steps, max_seconds, examples):
+    """Minimal entry taking more than max_steps or max_seconds, or None."""
+
+    def is_slow(entry):
+        steps, seconds = benchmark.measure_slow_input(entry, max_steps * 10)
+        target(float(steps))
+        return steps > max_steps or seconds > max_seconds
+
+    try:
+        entry = hypothesis.find(
+            strategy,
+            is_slow,
+            settings=settings(max_examples=examples, database=None, deadline=None),
+        )
+    except NoSuchExample:
+        return None
+    entry["max_steps"] = max_steps * 10
+    entry["steps"], _ = benchmark.measure_slow_input(entry, entry["max_steps"])
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--kind", choices=["decompose", "response"], action="append", default=None
+    )
+    parser.add_argument("--max-steps", type=int, default=1000)
+    parser.add_argument("--max-ms", type=float, default=50)
+    parser.add_argument(
+        "--examples", type=int, default=2000, help="examples to try per search"
+    )
+    parser.add_argument("--rounds", type=int, default=3, help="searches per kind")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    corpus = (
+        benchmark.load_corpus(args.corpus) if pathlib.Path(args.corpus).exists() else []
+    )
+    known = {
+        json.dumps({k: v for k, v in e.items() if k not in ("steps", "max_steps")})
+        for e in corpus
+    }
+    strategies = _entry_strategies()
+    for kind in args.kind or sorted(strategies):
+        for _ in range(args.rounds):
+            entry = find_slow_input(
+                strategies[kind], args.max_steps, args.max_ms / 1000, args.examples
+            )
+            if entry is None:
+                print(f"{kind}: nothing slow found")
+                continue
+            key = json.dumps(
+                {k: v for k, v in entry.items() if k not in ("steps", "max_steps")}
+            )
+            print(f"{kind}: {entry['steps']} steps {key}")
+            if key not in known:
+                known.add(key)
+                corpus.append(entry)
+
+    with open(args.corpus, "w") as fobj:
+        json.dump(corpus, fobj, indent=2)
+        fobj.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,20 @@
 from .parsing import *
 
 from .transformation_test import *
+from .startup_test import *
+from .loadtest_test import *
+from .transcript_test import *
+from .session_test import *
+from .benchmark_test import *
+from .automaton_test import *
+from .rpc_test import *
+from .store_test import *
+from .router_test import *
+from .codegen_test import *
+from .profiling_test import *
+from .capture_test import *
+from .prefork_test import *
+from .shadow_test import *
+from .sweep_test import *
+from .daemon_test import *
+from .optimizer_test import *
@@ -0,0 +1,36 @@
+import unittest
+from hypothesis import given, strategies as st
+
+from . import pyliza_strategies as liza_st
+from pyliza.automaton import DecompositionAutomaton
+from pyliza.processing import ProcessingPhrase as PPhrase
+from pyliza.transformation import MatchBudget
+from pyliza.transformation_parser import DecompositionParser
+
+
+class DecompositionAutomatonTestCase(unittest.TestCase):
+    @given(
+        st.lists(liza_st.slow_decomposition(), min_size=1, max_size=6),
+        st.lists(st.sampled_from(liza_st.SCRIPT_WORDS), max_size=12),
+    )
+    def test_first_match(self, patterns, words):
+        """The automaton finds the same rule and parts as trying each rule in turn."""
+        rules = [DecompositionParser.parse(pattern) for pattern, _ in patterns]
+        phrase = PPhrase(" ".join(words))
+        expected = None
+        for idx, rule in enumerate(rules):
+            decomposed = rule.decompose(phrase)
+            if decomposed is not None:
+                expected = (idx, decomposed)
+                break
+        self.assertEqual(expected, DecompositionAutomaton(rules).match(phrase))
+
+    def test_no_backtracking(self):
+        """A pattern that backtracks badly takes steps linear in the phrase."""
+        rule = DecompositionParser.parse("0 A 0 A 0 B")
+        phrase = PPhrase(" ".join(["A"] * 30))
+        backtracking, automaton = MatchBudget(), MatchBudget()
+        self.assertIsNone(rule.decompose(phrase, backtracking))
+        self.assertIsNone(DecompositionAutomaton([rule]).match(phrase, automaton))
+        self.assertLess(automaton.steps, 30 * 6)
+        self.assertGreater(backtracking.steps, 30 * 30)
@@ -0,0 +1,71 @@
+import unittest
+
+from pyliza import benchmark
+from pyliza.eliza import Eliza
+from pyliza.rule_parsing import ScriptParser
+
+from . import utils
+
+
+class MemoryBenchmarkTestCase(unittest.TestCase):
+    def test_synthetic_script(self):
+        """A synthetic script and its conversation can be measured."""
+        report = benchmark.measure_memory(
+            "synthetic",
+            benchmark.synthetic_script(5),
+            benchmark.synthetic_conversation(5, turns=5),
+            sessions=2,
+        )
+        self.assertGreater(report.script_bytes, 0)
+        self.assertGreater(report.session_bytes, 0)
+        self.assertIn("synthetic.script_words_bytes", report.metrics())
+
+    def test_breakdown(self):
+        """Every part of a parsed script is charged to something."""
+        rule_set = ScriptParser.parse(benchmark.synthetic_script(3))
+        sizes = benchmark.rule_set_sizes(rule_set)
+        for part in ["words", "patterns", "reassemblies"]:
+            self.assertGreater(sizes[part], 0)
+
+    def test_check_budget(self):
+        """Only measured metrics over their limit are reported."""
+        over = benchmark.check_budget(
+            {"a.session_bytes": 100, "b.session_bytes": 10},
+            {"a.session_bytes": 50, "b.session_bytes": 50, "c.session_bytes": 1},
+        )
+        self.assertEqual(["a.session_bytes: 100 > 50"], over)
+
+
+class SlowInputTestCase(unittest.TestCase):
+    def test_step_limit(self):
+        """A keyword that links to itself is stopped by the step limit."""
+        entry = {
+            "kind": "response",
+            "script": [
+                "(HI)\n",
+                "START\n",
+                "(A ((0) (=A)))\n",
+                "(NONE ((0) (GO ON)))\n",
+                "()\n",
+            ],
+            "input": "A",
+        }
+        steps, _ = benchmark.measure_slow_input(entry, max_steps=100)
+        self.assertEqual(101, steps)
+
+    def test_corpus(self):
+        """None of the saved slow inputs has got slower."""
+        report = benchmark.replay_corpus(utils.REPO_DIR / "benchmarks/slow_inputs.json")
+        self.assertGreater(report.entries, 0)
+        self.assertEqual([], report.regressions)
+
+    def test_found_inputs_finish(self):
+        """Without a step limit the saved inputs still get a reply."""
+        for entry in benchmark.load_corpus(
+            utils.REPO_DIR / "benchmarks/slow_inputs.json"
+        ):
+            if entry["kind"] != "response":
+                continue
+            eliza = Eliza(entry["script"])
+            with self.assertLogs("pyliza", "WARNING"):
+                self.assertEqual("GO ON\n", eliza.respond_to(entry["input"]))
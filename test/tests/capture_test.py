@@ -0,0 +1,108 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from . import utils
+from pyliza.capture import CaptureWriter, CapturedTurn, read_capture, replay
+from pyliza.eliza import Eliza
+from pyliza.loadtest import EngineTarget
+from pyliza.profiling import Profiler
+
+
+class CaptureTestCase(unittest.TestCase):
+    def capture(self, path):
+        with CaptureWriter(path) as capture:
+            eliza = Eliza(utils.read_lines(utils.CACM_SCRIPT), capture=capture)
+            sessions = [eliza.session(f"s{idx}") for idx in range(2)]
+            for line in utils.conversation_inputs():
+                for session in sessions:
+                    session.respond_to(line)
+
+    def test_round_trip(self):
+        """Every turn is read back in order, a partial last record is skipped."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "turns.cap")
+            self.capture(path)
+            turns = list(read_capture(path))
+            inputs = utils.conversation_inputs()
+            self.assertEqual(len(turns), 2 * len(inputs))
+            self.assertEqual([t.text for t in turns[::2]], inputs)
+            self.assertEqual({t.session_id for t in turns}, {"s0", "s1"})
+            self.assertEqual(turns, sorted(turns, key=lambda t: t.timestamp))
+            with open(path, "ab") as fobj:
+                fobj.write(b"\0\0\0")
+            with self.assertLogs("capture", "WARNING"):
+                self.assertEqual(list(read_capture(path)), turns)
+
+    def test_replay_matches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "turns.cap")
+            self.capture(path)
+            target = EngineTarget(utils.read_lines(utils.CACM_SCRIPT))
+            report = replay(read_capture(path), target, speed=None)
+            self.assertEqual(report.sessions, 2)
+            self.assertEqual(report.turns, 2 * len(utils.conversation_inputs()))
+            self.assertEqual(report.mismatches, 0)
+
+    def test_replay_timing_and_diff(self):
+        """Turns are spaced out as captured, and changed replies are reported."""
+        turns = [
+            CapturedTurn(
+                "a", 100.0, "HELLO", "HOW DO YOU DO. PLEASE STATE YOUR PROBLEM\n"
+            ),
+            CapturedTurn("a", 100.2, "HELLO", "not what eliza says\n"),
+        ]
+        target = EngineTarget(utils.read_lines(utils.CACM_SCRIPT))
+        report = replay(turns, target, speed=2.0)
+        self.assertGreaterEqual(report.duration_s, 0.1)
+        self.assertEqual(report.mismatches, 1)
+        self.assertEqual(report.examples[0].expected, "not what eliza says\n")
+
+    def test_replay_closes_finished_sessions(self):
+        """A session is closed after its last captured turn, not at the end."""
+        script = utils.read_lines(utils.CACM_SCRIPT)
+        engine = EngineTarget(script)
+        open_sessions = []
+        most_open = 0
+
+        class Target:
+            def open_session(self):
+                nonlocal most_open
+                session = engine.open_session()
+                close = session.close
+
+                def closed():
+                    open_sessions.remove(session)
+                    close()
+
+                session.close = closed
+                open_sessions.append(session)
+                most_open = max(most_open, len(open_sessions))
+                return session
+
+        reply = Eliza(script).respond_to("HELLO")
+        turns = [
+            CapturedTurn(f"s{idx // 2}", 100.0 + idx, "HELLO", reply)
+            for idx in range(20)
+        ]
+        report = replay(turns, Target(), speed=None)
+        self.assertEqual(report.sessions, 10)
+        self.assertEqual(report.mismatches, 0)
+        self.assertEqual(most_open, 1)
+        self.assertEqual(open_sessions, [])
+
+    def test_replay_profiled(self):
+        """Replayed turns are profiled when the target is given a profiler."""
+        turns = [CapturedTurn("a", 100.0, "HELLO", "")]
+        profiler = Profiler(responses_only=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.prof")
+            with profiler.profiling():
+                target = EngineTarget(
+                    utils.read_lines(utils.CACM_SCRIPT), profiler=profiler
+                )
+                replay(turns, target, speed=None)
+            profiler.write(path)
+            functions = {name for _, _, name in pstats.Stats(path).stats}
+            self.assertIn("get_response_for", functions)
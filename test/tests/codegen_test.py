@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from hypothesis import assume, given, settings
+
+from . import pyliza_strategies as liza_st
+from . import utils
+from pyliza import metrics
+from pyliza.codegen import cache_path_for, generate_source
+from pyliza.eliza import Eliza
+
+
+class CodegenTestCase(unittest.TestCase):
+    def test_conversation(self):
+        """The compiled rules give the same replies as the interpreter."""
+        script = utils.read_lines(utils.CACM_SCRIPT)
+        inputs = utils.conversation_inputs() * 3
+        interpreted = Eliza(script).session("a")
+        compiled = Eliza(script, backend="codegen").session("a")
+        self.assertEqual(
+            [interpreted.respond_to(line) for line in inputs],
+            [compiled.respond_to(line) for line in inputs],
+        )
+
+    @settings(deadline=None)
+    @given(liza_st.script_and_input())
+    def test_generated_scripts(self, script_input):
+        """Compiled and interpreted rules agree on random scripts."""
+        script, text = script_input
+        exhausted = metrics.METRICS.get("match_budget_exhausted")
+        expected = Eliza(script, max_match_steps=100_000).respond_to(text)
+        assume(metrics.METRICS.get("match_budget_exhausted") == exhausted)
+        compiled = Eliza(script, max_match_steps=100_000, backend="codegen")
+        self.assertEqual(expected, compiled.respond_to(text))
+
+    def test_same_step_limit(self):
+        """Both backends run out of steps on the same turns and reply alike."""
+        script = [
+            "(HELLO)\n",
+            "START\n",
+            "(A ((0 A 0 B 0) (YES)) ((0) (NOPE)))\n",
+            "(NONE ((0) (GO ON)))\n",
+            "()\n",
+        ]
+        for words, steps in [(300, 5000), (300, 100), (3, 100)]:
+            text = " ".join(["A"] * words)
+            expected = Eliza(script, max_match_steps=steps).respond_to(text)
+            compiled = Eliza(script, max_match_steps=steps, backend="codegen")
+            self.assertEqual(expected, compiled.respond_to(text))
+
+    def test_linear_matching(self):
+        """A 0 with more pattern after it is matched in one scan, not by loops."""
+        script = [
+            "(HELLO)\n",
+            "START\n",
+            "(A ((0 A 0 B 0) (YES)) ((0) (NOPE)))\n",
+            "(NONE ((0) (GO ON)))\n",
+            "()\n",
+        ]
+        rule_set = Eliza(script).rule_set
+        source = generate_source(rule_set)
+        self.assertNotIn("for ", source)
+        self.assertIn("_fallback(", source)
+
+    def test_cache(self):
+        """The compiled code is cached next to the script and rebuilt when it changes."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "script.txt")
+            cache = cache_path_for(path)
+            script = utils.read_lines(utils.CACM_SCRIPT)
+            Eliza(script, backend="codegen", codegen_cache=cache)
+            with open(cache, "rb") as fobj:
+                cached = fobj.read()
+            eliza = Eliza(script, lazy=True, backend="codegen", codegen_cache=cache)
+            self.assertEqual("IN WHAT WAY\n", eliza.respond_to("Men are all alike."))
+            with open(cache, "rb") as fobj:
+                self.assertEqual(cached, fobj.read())
+            changed = [line.replace("IN WHAT WAY", "HOW") for line in script]
+            eliza = Eliza(changed, backend="codegen", codegen_cache=cache)
+            self.assertEqual("HOW\n", eliza.respond_to("Men are all alike."))
+            with open(cache, "rb") as fobj:
+                self.assertNotEqual(cached, fobj.read())
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Eliza(utils.read_lines(utils.CACM_SCRIPT), backend="jit")
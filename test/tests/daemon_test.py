@@ -0,0 +1,134 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from . import utils
+from pyliza.daemon import DaemonServer
+from pyliza.daemon_client import DaemonError, DaemonSession
+from pyliza.eliza import Eliza
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.socket_path = os.path.join(self.tmp, "daemon.sock")
+        self.script_path = os.path.join(self.tmp, "script.txt")
+        shutil.copy(utils.CACM_SCRIPT, self.script_path)
+
+    def start(self, idle_timeout=None):
+        server = DaemonServer(self.socket_path, idle_timeout)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+        self.addCleanup(stop)
+        return server, thread
+
+    def test_conversation(self):
+        self.start()
+        eliza = Eliza(utils.read_lines(utils.CACM_SCRIPT))
+        with DaemonSession(self.script_path, self.socket_path) as session:
+            self.assertEqual(session.greet(), eliza.greet())
+            for line in utils.conversation_inputs():
+                self.assertEqual(session.respond(line), eliza.respond_to(line))
+        with self.assertRaises(DaemonError):
+            DaemonSession(os.path.join(self.tmp, "missing.txt"), self.socket_path)
+
+    def test_bad_script(self):
+        """A script that fails to parse is reported straight away."""
+        self.start()
+        bad_path = os.path.join(self.tmp, "bad.txt")
+        with open(bad_path, "w") as fobj:
+            fobj.write("garbage\n")
+        start = time.monotonic()
+        with self.assertLogs("daemon", "WARNING"):
+            with self.assertRaises(DaemonError) as raised:
+                DaemonSession(bad_path, self.socket_path)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(str(raised.exception))
+        # the daemon carries on serving other scripts
+        with DaemonSession(self.script_path, self.socket_path) as session:
+            self.assertEqual(session.respond("MEN ARE ALL ALIKE"), "IN WHAT WAY\n")
+
+    def test_closed_before_answering(self):
+        """A daemon going away mid-handshake isn't taken for one that isn't there."""
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(self.socket_path)
+        listener.listen()
+
+        def hang_up():
+            connection, _ = listener.accept()
+            connection.recv(1024)
+            connection.close()
+
+        thread = threading.Thread(target=hang_up)
+        thread.start()
+        self.addCleanup(thread.join)
+        with self.assertRaises(DaemonError):
+            DaemonSession(self.script_path, self.socket_path, start_timeout=0)
+
+    def test_reloads_changed_script(self):
+        server, _ = self.start()
+        old = DaemonSession(self.script_path, self.socket_path)
+        self.addCleanup(old.close)
+        first = server.eliza_for(self.script_path)
+        self.assertIs(server.eliza_for(self.script_path), first)
+        with open(self.script_path) as fobj:
+            script = fobj.read()
+        with open(self.script_path, "w") as fobj:
+            fobj.write(script.replace("IN WHAT WAY", "IN WHICH WAY"))
+        with DaemonSession(self.script_path, self.socket_path) as session:
+            self.assertEqual(session.respond("MEN ARE ALL ALIKE"), "IN WHICH WAY\n")
+        # a conversation already going keeps the rules it started with
+        self.assertEqual(old.respond("MEN ARE ALL ALIKE"), "IN WHAT WAY\n")
+
+    def test_idle_timeout(self):
+        _, thread = self.start(idle_timeout=0.2)
+        with DaemonSession(self.script_path, self.socket_path) as session:
+            time.sleep(0.5)  # a client that is connected isn't idle
+            self.assertTrue(thread.is_alive())
+            session.respond("HELLO")
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    def test_client_starts_daemon(self):
+        """run_pyliza.py --client starts a daemon, which exits once idle."""
+        conversation = os.path.join(utils.REPO_DIR, "original_conversation.txt")
+        command = [
+            sys.executable,
+            os.path.join(utils.REPO_DIR, "run_pyliza.py"),
+            "-s",
+            self.script_path,
+            "-t",
+            conversation,
+        ]
+        expected = subprocess.run(
+            command, capture_output=True, text=True, check=True
+        ).stdout
+        client = command + ["--client", "--daemon-socket", self.socket_path]
+        for _ in range(2):
+            output = subprocess.run(
+                client + ["--idle-timeout", "1"],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=30,
+            ).stdout
+            self.assertEqual(output, expected)
+        deadline = time.monotonic() + 30
+        while os.path.exists(self.socket_path):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+import unittest
+from hypothesis import given, strategies as st
+
+from . import utils
+from pyliza import loadtest
+from pyliza.server import make_server
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    @given(st.lists(st.floats(min_value=0, max_value=10), min_size=1))
+    def test_percentile_accuracy(self, samples):
+        """Percentiles are within the histogram's relative precision."""
+        hist = loadtest.LatencyHistogram(precision_bits=7)
+        for sample in samples:
+            hist.record(sample)
+        values = sorted(int(s * 1_000_000) for s in samples)
+        self.assertEqual(values[-1], hist.max_us)
+        median = values[max(0, (len(values) + 1) // 2 - 1)]
+        self.assertLessEqual(hist.percentile(50), median)
+        self.assertGreaterEqual(hist.percentile(50), median * (1 - 2**-6) - 1)
+
+    def test_merge(self):
+        """Merging keeps every sample."""
+        first, second = loadtest.LatencyHistogram(), loadtest.LatencyHistogram()
+        first.record(0.001)
+        second.record(0.002)
+        first.merge(second)
+        self.assertEqual(2, first.count)
+        self.assertEqual(2000, first.max_us)
+
+
+class LoadTestTestCase(unittest.TestCase):
+    corpus = [["Men are all alike.", "I need some help"], ["hello"]]
+
+    def test_engine_closed_loop(self):
+        """Every turn of every session is answered."""
+        target = loadtest.EngineTarget(utils.read_lines(utils.CACM_SCRIPT))
+        report = loadtest.LoadTest(target, self.corpus, sessions=3).run()
+        self.assertEqual(5, report.turns)
+        self.assertEqual(0, sum(report.errors.values()))
+        self.assertGreater(report.throughput, 0)
+
+    def test_engine_open_loop(self):
+        """At a fixed rate the turns are spread over the schedule."""
+        target = loadtest.EngineTarget(utils.read_lines(utils.CACM_SCRIPT))
+        report = loadtest.LoadTest(target, self.corpus, sessions=3, rate=50).run()
+        self.assertEqual(5, report.turns)
+        self.assertEqual(0, sum(report.errors.values()))
+        # the last turn is due 4 turns after the first
+        self.assertGreaterEqual(report.duration_s, 4 / 50)
+        self.assertIn("open loop at 50 turns/s", report.format())
+
+    def test_socket_target(self):
+        """Sessions against a running server each get their own connection."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "server.sock")
+            with make_server(utils.read_lines(utils.CACM_SCRIPT), path) as server:
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                target = loadtest.SocketTarget(path)
+                report = loadtest.LoadTest(target, self.corpus, sessions=3).run()
+                server.shutdown()
+        self.assertEqual(5, report.turns)
+        self.assertEqual(0, sum(report.errors.values()))
@@ -0,0 +1,71 @@
+import unittest
+
+from . import utils
+from pyliza import optimizer
+from pyliza.eliza import Eliza
+from pyliza.processing import ProcessingWord
+from pyliza.rule_parsing import ScriptParser
+from pyliza.ruleset import UnconditionalSubstitution
+
+
+class OptimizerTestCase(unittest.TestCase):
+    rules = """
+(FOO ((0) (FIRST FOO)))
+(ZORP ((0) (=NOWHERE)))
+(BLIP = BLOP ((0 BLIP 0) (=ZORP)))
+(FOO
+    ((0 FOO 0 BAR 0) (FOO THEN 4))
+    ((0) (WHAT ABOUT FOO) (=WHAT))
+    ((0 BAR 0) (NEVER))
+    ((0 FOO 0 BAR 0) (NOR THIS)))
+(FLUB ((0) (=MISSING) (FLUB)))
+"""
+
+    def script(self):
+        script = "".join(utils.read_lines(utils.CACM_SCRIPT))
+        return script.replace("START\n", "START\n" + self.rules, 1).splitlines(True)
+
+    def test_findings(self):
+        rule_set = ScriptParser.parse(self.script())
+        report = optimizer.optimize(rule_set)
+        kinds = {(f.keyword, f.kind) for f in report.findings}
+        self.assertLessEqual(
+            {
+                ("FOO", optimizer.OVERWRITTEN),
+                ("FOO", optimizer.SHADOWED),
+                ("ZORP", optimizer.DEAD_KEYWORD),
+                ("BLIP", optimizer.DEAD_KEYWORD),
+                ("FLUB", optimizer.DEAD_LINK),
+                ("MEMORY MY", optimizer.SHADOWED),
+            },
+            kinds,
+        )
+        # the states of 0 BAR 0 and 0 FOO 0 BAR 0 at each word of a 40 word phrase
+        self.assertEqual(41 * (4 + 6), report.saved_by_keyword()["FOO"])
+        self.assertNotIn(ProcessingWord("ZORP"), rule_set.rules)
+        # the substitution is still made
+        self.assertIsInstance(
+            rule_set.rules[ProcessingWord("BLIP")], UnconditionalSubstitution
+        )
+        foo = rule_set.rules[ProcessingWord("FOO")]
+        self.assertEqual(len(foo.transformation_rules), 2)
+        self.assertGreater(report.merged_reassemblies, 0)
+        self.assertIn("FOO", report.format())
+
+    def test_same_replies(self):
+        inputs = utils.conversation_inputs() + [
+            "FOO AND BAR",
+            "JUST FOO",
+            "BLIP IS MY FAMILY",
+            "FLUB",
+            "FLUB",
+        ]
+        for backend in ("interpreter", "codegen"):
+            plain = Eliza(self.script(), backend=backend)
+            optimized = Eliza(self.script(), backend=backend, optimize=True)
+            for text in inputs:
+                self.assertEqual(plain.respond_to(text), optimized.respond_to(text))
+            # rules keep their ids, so a session can move between the two
+            session = optimized.session(state=plain.snapshot())
+            for text in inputs:
+                self.assertEqual(plain.respond_to(text), session.respond_to(text))
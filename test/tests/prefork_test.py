@@ -0,0 +1,79 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.prefork import read_memory
+from pyliza.ruleset import Memory, Transformation
+
+
+class PreforkTestCase(unittest.TestCase):
+    def converse(self, path, lines):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(10)
+        sock.connect(path)
+        with sock, sock.makefile("rb") as reader:
+            reader.readline()  # greeting
+            replies = []
+            for line in lines:
+                sock.sendall(line.encode() + b"\n")
+                replies.append(reader.readline().decode())
+        return replies
+
+    def test_workers_retire(self):
+        """Workers are replaced after max requests without losing conversations."""
+        lines = utils.conversation_inputs()[:3]
+        expected = [
+            Eliza(utils.read_lines(utils.CACM_SCRIPT)).respond_to(line)
+            for line in lines
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "prefork.sock")
+            process = subprocess.Popen(
+                [sys.executable, "-m", "pyliza", "-v", "serve", path]
+                + ["--workers", "2", "--max-requests", "3"],
+                cwd=utils.REPO_DIR,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            try:
+                deadline = time.monotonic() + 30
+                while not os.path.exists(path):
+                    self.assertIsNone(process.poll())
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.05)
+                for _ in range(5):
+                    self.assertEqual(expected, self.converse(path, lines))
+            finally:
+                process.terminate()
+                _, log = process.communicate(timeout=30)
+            self.assertEqual(process.returncode, 0)
+            self.assertGreaterEqual(log.count("retiring, served 3 turns"), 2)
+            self.assertFalse(os.path.exists(path))
+
+    @unittest.skipUnless(os.path.exists("/proc/self/smaps_rollup"), "needs linux")
+    def test_read_memory(self):
+        usage = read_memory(os.getpid())
+        self.assertGreater(usage.rss, 0)
+        self.assertEqual(usage.rss, usage.shared + usage.private)
+        self.assertIsNone(read_memory(-1))
+
+    def test_precompile(self):
+        """Every rule is parsed and given its automaton before workers fork."""
+        eliza = Eliza(utils.read_lines(utils.CACM_SCRIPT), lazy=True)
+        rule_set = eliza.rule_set
+        rule_set.precompile()
+        for rule in list(rule_set.rules.values()) + list(
+            rule_set.memory_rules.values()
+        ):
+            if isinstance(rule, (Transformation, Memory)):
+                self.assertIn(0, rule._automata)
+        codegen = Eliza(utils.read_lines(utils.CACM_SCRIPT), backend="codegen")
+        codegen.rule_set.precompile()
+        for line in utils.conversation_inputs():
+            self.assertEqual(codegen.respond_to(line), eliza.respond_to(line))
@@ -0,0 +1,55 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.profiling import Profiler, folded_path
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def converse(self, profiler, repeats=1):
+        with profiler.profiling():
+            eliza = Eliza(utils.read_lines(utils.CACM_SCRIPT), profiler=profiler)
+            for line in utils.conversation_inputs() * repeats:
+                eliza.respond_to(line)
+
+    def functions(self, path):
+        return {name for _, _, name in pstats.Stats(path).stats}
+
+    def test_responses_only(self):
+        """Only the response path is profiled, parsing the script is left out."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.prof")
+            profiler = Profiler(responses_only=True)
+            self.converse(profiler)
+            profiler.write(path)
+            functions = self.functions(path)
+            self.assertIn("get_response_for", functions)
+            self.assertNotIn("_parse_rules", functions)
+            with open(folded_path(path)) as fobj:
+                stacks = [line.rsplit(" ", 1) for line in fobj.read().splitlines()]
+            self.assertTrue(stacks)
+            self.assertTrue(all(int(count) > 0 for _, count in stacks))
+            self.assertTrue(any(stack.startswith("_respond_to") for stack, _ in stacks))
+            self.assertFalse(any("_parse_rules" in stack for stack, _ in stacks))
+
+    def test_everything(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.prof")
+            profiler = Profiler()
+            self.converse(profiler)
+            profiler.write(path)
+            self.assertIn("_parse_rules", self.functions(path))
+
+    def test_sampling(self):
+        """Sampled stacks are written in both formats."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.prof")
+            profiler = Profiler("sample", responses_only=True)
+            self.converse(profiler, repeats=20)
+            profiler.write(path)
+            self.assertIn("respond_to", self.functions(path))
+            with open(folded_path(path)) as fobj:
+                self.assertIn("respond_to (session.py", fobj.read())
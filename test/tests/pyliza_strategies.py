@@ -26,12 +26,16 @@ def tag_words(draw: st.DrawFn, used_words=None):
 
 
 @st.composite
-def decomposition_pattern(draw: st.DrawFn) -> Tuple[DecompositionPattern_t, Set[str]]:
-    """Make a valid decomposition pattern."""
-    int_strat = st.integers(min_value=0, max_value=10)
-    str_strat = new_words()
+def decomposition_pattern(
+    draw: st.DrawFn, words=None, ints=None
+) -> Tuple[DecompositionPattern_t, Set[str]]:
+    """Make a valid decomposition pattern, optionally from given word and int strategies."""
+    if words is None:
+        words = new_words()
+    int_strat = st.integers(min_value=0, max_value=10) if ints is None else ints
+    str_strat = words
     tag_strat = tag_words()
-    set_strat = st.sets(new_words(), min_size=1)
+    set_strat = st.sets(words, min_size=1)
 
     initial_pattern = draw(
         st.lists(st.one_of(int_strat, str_strat, tag_strat, set_strat), min_size=1)
@@ -117,3 +121,84 @@ def invalid_decomposition(
 
     phrase = ProcessingPhrase([w for d in decomposed_phrase for w in d])
     return pattern, phrase
+
+
+@st.composite
+def valid_reassembly(
+    draw: st.DrawFn,
+) -> Tuple[List, List[List[ProcessingWord]]]:
+    """Make reassembly parts and a decomposed phrase they can be applied to."""
+    _, decomposed, _ = draw(valid_decomposition())
+    # words in a real phrase always have text, even when they are tagged
+    decomposed_phrase = [
+        [ProcessingWord(w.word or "TAGGED", w.tags) for w in part]
+        for part in decomposed
+    ]
+    slot_strat = st.integers(min_value=1, max_value=len(decomposed_phrase))
+    words_strat = st.lists(new_words(), min_size=1, max_size=4)
+    parts = draw(st.lists(st.one_of(slot_strat, words_strat), max_size=6))
+    return parts, decomposed_phrase
+
+
+def pattern_text(pattern: DecompositionPattern_t) -> str:
+    """Write a decomposition pattern the way a script would."""
+
+    def part_text(part):
+        if isinstance(part, int):
+            return str(part)
+        if isinstance(part, set):
+            return "(*" + " ".join(sorted(w.word for w in part)) + ")"
+        if part.word is None:
+            return "(/" + next(iter(part.tags)) + ")"
+        return part.word
+
+    return " ".join(map(part_text, pattern))
+
+
+SCRIPT_WORDS = ["A", "B", "C", "D"]  # few enough that keywords and patterns overlap
+
+
+@st.composite
+def slow_decomposition(draw: st.DrawFn) -> Tuple[str, str]:
+    """Make pattern and phrase text built from the same few words.
+
+    Wildcards are common and the phrase repeats the pattern's words, that
+    gives the wildcards the most ways to split it, which is where matching
+    gets slow.
+    """
+    pattern, _ = draw(
+        decomposition_pattern(
+            st.sampled_from(SCRIPT_WORDS).map(ProcessingWord),
+            st.integers(min_value=0, max_value=2),
+        )
+    )
+    phrase = draw(st.lists(st.sampled_from(SCRIPT_WORDS), max_size=40))
+    return pattern_text(pattern), " ".join(phrase)
+
+
+@st.composite
+def script_and_input(draw: st.DrawFn) -> Tuple[List[str], str]:
+    """Make a small script and an input that uses its keywords."""
+    words = st.sampled_from(SCRIPT_WORDS).map(ProcessingWord)
+    keywords = draw(
+        st.lists(st.sampled_from(SCRIPT_WORDS), min_size=1, max_size=3, unique=True)
+    )
+    reassembly = st.one_of(
+        st.sampled_from(["(OK)", "(OK 1)"]),
+        st.sampled_from(keywords).map(lambda k: f"(={k})"),
+    )
+    lines = ["(HELLO)", "START"]
+    for keyword in keywords:
+        lines.append(f"({keyword} {draw(st.integers(min_value=0, max_value=3))}")
+        for pattern, _ in draw(
+            st.lists(
+                decomposition_pattern(words, st.integers(min_value=0, max_value=2)),
+                min_size=1,
+                max_size=3,
+            )
+        ):
+            lines.append(f"    (({pattern_text(pattern)}) {draw(reassembly)})")
+        lines[-1] += ")"
+    lines += ["(NONE", "    ((0)", "        (GO ON)))", "()"]
+    text = draw(st.lists(st.sampled_from(SCRIPT_WORDS), min_size=1, max_size=40))
+    return [line + "\n" for line in lines], " ".join(text)
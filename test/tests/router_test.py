@@ -0,0 +1,130 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.router import HashRing, Router, make_route_server
+from pyliza.rpc_client import RpcClient
+
+
+def start_node(path):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "pyliza", "rpc", path],
+        cwd=utils.REPO_DIR,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while not os.path.exists(path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f"rpc node on {path} did not start")
+        time.sleep(0.05)
+    time.sleep(0.05)
+    return process
+
+
+class HashRingTestCase(unittest.TestCase):
+    def test_only_moves_keys_to_new_node(self):
+        """Adding a node only moves keys onto it, and removing it moves them back."""
+        ring = HashRing(["a", "b", "c"])
+        keys = [str(idx) for idx in range(1000)]
+        before = {key: ring.node_for(key) for key in keys}
+        ring.add("d")
+        after = {key: ring.node_for(key) for key in keys}
+        moved = [key for key in keys if before[key] != after[key]]
+        self.assertTrue(all(after[key] == "d" for key in moved))
+        self.assertGreater(len(moved), 100)
+        self.assertLess(len(moved), 400)
+        ring.remove("d")
+        self.assertEqual(before, {key: ring.node_for(key) for key in keys})
+
+
+class RouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.nodes = [
+            os.path.join(self.tmp.name, f"node{idx}.sock") for idx in range(3)
+        ]
+        self.processes = [start_node(path) for path in self.nodes]
+
+    def tearDown(self):
+        for process in self.processes:
+            process.terminate()
+            process.wait()
+        self.tmp.cleanup()
+
+    def test_sessions_move_between_nodes(self):
+        """Conversations carry on unchanged while nodes join and leave."""
+        inputs = utils.conversation_inputs()
+        sessions = [f"session{idx}" for idx in range(20)]
+        eliza = Eliza(utils.read_lines(utils.CACM_SCRIPT))
+        expected = {sid: eliza.session(sid) for sid in sessions}
+        expected = {
+            sid: [session.respond_to(line) for line in inputs]
+            for sid, session in expected.items()
+        }
+        replies = {sid: [] for sid in sessions}
+
+        def talk(router, lines):
+            for line in lines:
+                for sid in sessions:
+                    replies[sid].append(router.respond(sid, line))
+
+        third = len(inputs) // 3
+        with Router(self.nodes[:2]) as router:
+            talk(router, inputs[:third])
+            # turns keep arriving while the new node takes its sessions
+            talker = threading.Thread(
+                target=talk, args=(router, inputs[third : 2 * third])
+            )
+            talker.start()
+            moved = router.add_node(self.nodes[2])
+            talker.join()
+            on_new = [sid for sid in sessions if router.owner(sid) == self.nodes[2]]
+            self.assertTrue(on_new)
+            self.assertEqual(len(on_new), moved)
+            router.remove_node(self.nodes[0])
+            self.assertNotIn(self.nodes[0], {router.owner(sid) for sid in sessions})
+            talk(router, inputs[2 * third :])
+        self.assertEqual(expected, replies)
+
+    def test_route_server(self):
+        """The router speaks the same protocol as a node."""
+        path = os.path.join(self.tmp.name, "router.sock")
+        with Router(self.nodes) as router, make_route_server(router, path) as server:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            with RpcClient(path) as client:
+                replies = client.respond_many([("a", "Men are all alike.")] * 2)
+            server.shutdown()
+        self.assertEqual("IN WHAT WAY\n", replies[0])
+
+    def test_malformed_request(self):
+        """A request that can't be decoded drops the connection, not the server."""
+        path = os.path.join(self.tmp.name, "router.sock")
+        with Router(self.nodes) as router, make_route_server(router, path) as server:
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(path)
+                sock.sendall(b"\x00\x00\x00\x01x")  # a frame too short to decode
+                self.assertEqual(b"", sock.recv(16))
+            with RpcClient(path) as client:
+                reply = client.respond("a", "Men are all alike.")
+            server.shutdown()
+        self.assertEqual("IN WHAT WAY\n", reply)
+
+    def test_forgets_least_recently_used(self):
+        """Only the most recently used sessions are remembered."""
+        with Router(self.nodes, max_sessions=2) as router:
+            for session_id in ("a", "b", "a", "c"):
+                router.respond(session_id, "HELLO")
+            self.assertIsNone(router.owner("b"))
+            self.assertIsNotNone(router.owner("a"))
+            self.assertIsNotNone(router.owner("c"))
@@ -0,0 +1,77 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.rpc import RpcServer
+from pyliza.rpc_client import RpcClient
+
+
+class RpcTestCase(unittest.TestCase):
+    def setUp(self):
+        self.eliza = Eliza(utils.read_lines(utils.CACM_SCRIPT))
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "rpc.sock")
+        self.server = RpcServer(self.eliza, self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_pipelined_conversation(self):
+        """Pipelined requests get the same replies as talking to the engine."""
+        inputs = utils.conversation_inputs()
+        session = self.eliza.session()
+        expected = [session.respond_to(line) for line in inputs]
+        with RpcClient(self.path) as client:
+            replies = client.respond_many([("a", line) for line in inputs])
+        self.assertEqual(expected, replies)
+
+    def test_sessions_by_id(self):
+        """Each session id carries on its own conversation."""
+        with RpcClient(self.path, pool_size=2) as client:
+            first = [client.respond("a", "I AM SAD") for _ in range(3)]
+            second = [client.respond("b", "I AM SAD") for _ in range(3)]
+        self.assertEqual(first, second)
+        self.assertGreater(len(set(first)), 1)
+
+    def test_least_recently_used_evicted(self):
+        """Only the most recently used sessions are kept."""
+        self.server.max_sessions = 2
+        with RpcClient(self.path) as client:
+            for session_id in ("a", "b", "a", "c"):
+                client.respond(session_id, "HELLO")
+        self.assertEqual(["a", "c"], list(self.server.sessions))
+
+    def test_bad_frame(self):
+        """A frame that is too big drops the connection but not the server."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.path)
+            sock.sendall(b"\xff\xff\xff\xff")
+            self.assertEqual(b"", sock.recv(16))
+        with RpcClient(self.path) as client:
+            self.assertEqual("IN WHAT WAY\n", client.respond("c", "Men are all alike."))
+
+    def test_client_without_engine(self):
+        """The client can be imported without loading the engine."""
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, pyliza.rpc_client; print('pyliza.eliza' in sys.modules)",
+            ],
+            cwd=utils.REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        self.assertEqual("False", loaded.strip())
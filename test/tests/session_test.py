@@ -0,0 +1,147 @@
+import unittest
+from hypothesis import given, strategies as st
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.state import SessionState, _write_varint
+
+
+class SessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.eliza = Eliza(utils.read_lines(utils.CACM_SCRIPT))
+        self.inputs = utils.conversation_inputs()
+
+    def test_sessions_independent(self):
+        """Sessions sharing a script do not see each other's state."""
+        first, second = self.eliza.session(), self.eliza.session()
+        replies = [first.respond_to(line) for line in self.inputs]
+        self.assertEqual(replies, [second.respond_to(line) for line in self.inputs])
+
+    def test_fork_matches_replay(self):
+        """A fork carries on exactly as replaying the history would."""
+        history, future = self.inputs[:10], self.inputs[10:]
+        session = self.eliza.session()
+        for line in history:
+            session.respond_to(line)
+        forks = [session.fork() for _ in range(3)]
+        replayed = self.eliza.session()
+        for line in history:
+            replayed.respond_to(line)
+        expected = [replayed.respond_to(line) for line in future]
+        for fork in forks:
+            self.assertEqual(expected, [fork.respond_to(line) for line in future])
+
+    def test_snapshot_restore(self):
+        """Restoring a snapshot repeats the same replies."""
+        session = self.eliza.session()
+        for line in self.inputs[:5]:
+            session.respond_to(line)
+        snapshot = session.snapshot()
+        first = [session.respond_to(line) for line in self.inputs[5:]]
+        session.restore(snapshot)
+        self.assertEqual(first, [session.respond_to(line) for line in self.inputs[5:]])
+        restored = self.eliza.session(
+            state=SessionState.from_bytes(snapshot.to_bytes())
+        )
+        self.assertEqual(first, [restored.respond_to(line) for line in self.inputs[5:]])
+
+
+class KeywordPhraseTestCase(unittest.TestCase):
+    phrase_rules = """
+((I AM) 20
+    ((0 YOU ARE 0)
+        (HOW LONG HAVE YOU BEEN 4)))
+((DON'T YOU) ((0) (=WHAT)))
+"""
+
+    def script(self, rules):
+        script = "".join(utils.read_lines(utils.CACM_SCRIPT))
+        return script.replace("START\n", "START\n" + rules, 1).splitlines(True)
+
+    def test_phrase_keywords(self):
+        """A keyword of several words fires instead of its words' keywords."""
+        for backend in ("interpreter", "codegen"):
+            eliza = Eliza(self.script(self.phrase_rules), backend=backend)
+            self.assertEqual(
+                eliza.respond_to("WELL I AM SAD"), "HOW LONG HAVE YOU BEEN SAD\n"
+            )
+            self.assertEqual(eliza.respond_to("DON'T YOU KNOW"), "WHY DO YOU ASK\n")
+            self.assertEqual(eliza.respond_to("I AM"), "HOW LONG HAVE YOU BEEN\n")
+
+    def test_same_without_phrase_keywords(self):
+        """Inputs without the new keywords get the replies they got before."""
+        plain = Eliza(utils.read_lines(utils.CACM_SCRIPT))
+        eliza = Eliza(self.script(self.phrase_rules))
+        for line in utils.conversation_inputs():
+            if "I AM" not in line.upper() and "DON'T YOU" not in line.upper():
+                self.assertEqual(plain.respond_to(line), eliza.respond_to(line))
+
+    def test_phrase_memory_rejected(self):
+        """A memory keyword of several words is an error in the script."""
+        with self.assertRaises(ValueError):
+            Eliza(self.script("(MEMORY (MY SELF) (0 = 0))\n"))
+
+
+class SessionStateTestCase(unittest.TestCase):
+    @given(
+        st.dictionaries(st.integers(0, 2**32), st.integers(1, 100)),
+        st.dictionaries(st.integers(0, 1000), st.lists(st.text(), max_size=4)),
+    )
+    def test_serialise_round_trip(self, cursors, memories):
+        """State survives serialisation."""
+        state = SessionState()
+        for rule_id, num in cursors.items():
+            for _ in range(num):
+                state.next_reassembly(rule_id, 101)
+        for memory_id, texts in memories.items():
+            for text in texts:
+                state.remember(memory_id, text)
+        self.assertEqual(state, SessionState.from_bytes(state.to_bytes()))
+
+    def test_bad_serialised_state(self):
+        """Cursors and ids no rule set could have made are rejected."""
+
+        def serialised(rule_id, idx):
+            out = bytearray([SessionState._format_version, 1])
+            _write_varint(out, rule_id)
+            _write_varint(out, idx)
+            return bytes(out + b"\0")
+
+        SessionState.from_bytes(serialised(2**63, 0xFFFF))
+        for data in (
+            serialised(1, 0x10000),
+            serialised(2**64, 1),
+            serialised(1, 1)[:-2],
+        ):
+            with self.assertRaises(ValueError):
+                SessionState.from_bytes(data)
+        with self.assertRaises(ValueError):
+            SessionState().next_reassembly(-1, 2)
+
+    def test_sparse(self):
+        """Nothing is stored for a session until it is used, then only what it touched."""
+        state = SessionState()
+        self.assertIsNone(state._rule_ids)
+        self.assertIsNone(state._memories)
+        self.assertEqual("", state.recall(0))
+        self.assertIsNone(state._memories)
+        state.next_reassembly(5 << 16, 2)
+        state.next_reassembly(5 << 16, 2)
+        state.next_reassembly(7 << 16 | 1, 3)
+        self.assertEqual(list(state._rule_ids), [5 << 16, 7 << 16 | 1])
+        self.assertEqual(list(state._cursors), [0, 1])
+
+    def test_copy_on_write(self):
+        """A fork shares storage until one side changes."""
+        state = SessionState()
+        state.next_reassembly(1, 3)
+        state.remember(0, "YOUR MOTHER")
+        fork = state.fork()
+        self.assertIs(state._cursors, fork._cursors)
+        self.assertEqual(1, fork.next_reassembly(1, 3))
+        self.assertIsNot(state._cursors, fork._cursors)
+        self.assertIsNot(state._rule_ids, fork._rule_ids)
+        self.assertIs(state._memories, fork._memories)
+        self.assertEqual("YOUR MOTHER", fork.recall(0))
+        self.assertEqual("YOUR MOTHER", state.recall(0))
+        self.assertEqual(1, state.next_reassembly(1, 3))
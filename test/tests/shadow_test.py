@@ -0,0 +1,62 @@
+import unittest
+
+from . import utils
+from pyliza.backends import backend_names, register_backend, use_backend
+from pyliza.eliza import Eliza
+from pyliza.processing import ProcessingWord
+from pyliza.shadow import ShadowRunner
+
+
+class ShadowTestCase(unittest.TestCase):
+    def converse(self, shadow, backend="codegen"):
+        script = utils.read_lines(utils.CACM_SCRIPT)
+        eliza = Eliza(script, backend=backend, shadow=shadow)
+        session = eliza.session("shadowed")
+        replies = [session.respond_to(line) for line in utils.conversation_inputs()]
+        return eliza, session, replies
+
+    def test_codegen_matches_reference(self):
+        script = utils.read_lines(utils.CACM_SCRIPT)
+        with ShadowRunner(script, 1.0) as shadow:
+            _, session, replies = self.converse(shadow)
+            shadow.wait()
+            report = shadow.report()
+        self.assertEqual(report.turns, len(replies))
+        self.assertEqual((report.mismatches, report.state_mismatches), (0, 0))
+        self.assertEqual(report.latency.count, len(replies))
+        # the reference runs don't touch the session's own state
+        _, plain, plain_replies = self.converse(None)
+        self.assertEqual(replies, plain_replies)
+        self.assertEqual(session.state, plain.state)
+
+    def test_reports_mismatch(self):
+        script = utils.read_lines(utils.CACM_SCRIPT)
+        with ShadowRunner(script, 1.0) as shadow:
+            eliza = Eliza(script, shadow=shadow)
+            eliza.rule_set.rules[ProcessingWord("DIT")].compiled = lambda *_: (
+                None,
+                "I ONLY SAY THIS",
+            )
+            with self.assertLogs("shadow", "WARNING"):
+                eliza.respond_to("MEN ARE ALL ALIKE")
+                shadow.wait()
+            report = shadow.report()
+        self.assertEqual(report.mismatches, 1)
+        self.assertEqual(report.examples[0].reply, "I ONLY SAY THIS\n")
+        self.assertEqual(report.examples[0].reference_reply, "IN WHAT WAY\n")
+
+    def test_sample_rate(self):
+        script = utils.read_lines(utils.CACM_SCRIPT)
+        with ShadowRunner(script, 0.0) as shadow:
+            self.converse(shadow)
+            shadow.wait()
+            self.assertEqual(shadow.report().turns, 0)
+        with self.assertRaises(ValueError):
+            ShadowRunner(script, 1.5)
+
+    def test_registry(self):
+        self.assertEqual(backend_names()[:2], ("interpreter", "codegen"))
+        with self.assertRaises(ValueError):
+            register_backend("codegen", lambda *_: None)
+        with self.assertRaises(ValueError):
+            use_backend(None, "no such backend", "")
@@ -0,0 +1,99 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.rule_parsing import ScriptParser
+from pyliza.ruleset import DeferredRules
+from pyliza.transformation_parser import DecompositionParser
+
+
+class LazyStartupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.script = utils.read_lines(utils.CACM_SCRIPT)
+
+    def test_lazy_parses_less(self):
+        """Loading lazily parses no decompositions, a conversation only some."""
+        lazy = self._count_parsed(lambda: Eliza(self.script, lazy=True))
+        eager = self._count_parsed(lambda: Eliza(self.script))
+        self.assertEqual(lazy, 0)
+        self.assertGreater(eager, 0)
+
+        eliza = Eliza(self.script, lazy=True)
+        used = self._count_parsed(
+            lambda: [eliza.respond_to(line) for line in utils.conversation_inputs()]
+        )
+        self.assertLess(used, eager)
+
+    def test_startup_time(self):
+        """Importing the engine and loading a script lazily stays quick.
+
+        Run in a fresh interpreter so nothing is imported already, the budget
+        is generous and only catches the engine pulling in much more at start.
+        """
+        code = (
+            "import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "from pyliza.eliza import Eliza\n"
+            f"Eliza(open({str(utils.CACM_SCRIPT)!r}), lazy=True)\n"
+            "print(json.dumps([time.perf_counter() - start, list(sys.modules)]))\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=utils.REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        seconds, modules = json.loads(output)
+        self.assertLess(seconds, 1.0)
+        for module in ("sqlite3", "pyliza.optimizer", "pyliza.store"):
+            self.assertNotIn(module, modules)
+
+    def test_rules_deferred(self):
+        """No rule bodies are parsed until a keyword fires."""
+        rule_set = ScriptParser.parse(self.script, lazy=True)
+        deferred = [
+            r._transformation_rules
+            for r in rule_set.rules.values()
+            if isinstance(getattr(r, "_transformation_rules", None), DeferredRules)
+        ]
+        self.assertTrue(deferred)
+        self.assertFalse(any(d.loaded for d in deferred))
+
+    def test_same_responses(self):
+        """Lazy and eager parsing give the same conversation."""
+        lazy = Eliza(self.script, lazy=True)
+        eager = Eliza(self.script)
+        for line in utils.conversation_inputs():
+            self.assertEqual(eager.respond_to(line), lazy.respond_to(line))
+
+    def test_concurrent_first_use(self):
+        """A deferred rule is only parsed once when threads race to use it."""
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.01)
+            return []
+
+        rules = DeferredRules(loader)
+        threads = [threading.Thread(target=rules.load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(calls))
+
+    def _count_parsed(self, run):
+        parse = DecompositionParser.parse
+        with mock.patch.object(
+            DecompositionParser, "parse", side_effect=parse
+        ) as parsed:
+            run()
+        return parsed.call_count
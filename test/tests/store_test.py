@@ -0,0 +1,81 @@
+import os
+import tempfile
+import time
+import unittest
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.state import SessionState
+from pyliza.store import SessionStore
+
+
+class SessionStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "sessions.db")
+        self.script = utils.read_lines(utils.CACM_SCRIPT)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_survives_restart(self):
+        """A conversation carries on where it was when the store was closed."""
+        inputs = utils.conversation_inputs()
+        half = len(inputs) // 2
+        expected = Eliza(self.script).session("a")
+        expected = [expected.respond_to(line) for line in inputs]
+
+        with SessionStore(self.path, flush_interval=60) as store:
+            session = Eliza(self.script, store=store).session("a")
+            replies = [session.respond_to(line) for line in inputs[:half]]
+        with SessionStore(self.path, flush_interval=60) as store:
+            session = Eliza(self.script, store=store).session("a")
+            replies += [session.respond_to(line) for line in inputs[half:]]
+        self.assertEqual(expected, replies)
+
+    def test_saves_are_batched(self):
+        """Saved sessions are readable before they are written, and flush writes them."""
+        state = SessionState()
+        state.remember(1, "MY MOTHER")
+        with SessionStore(self.path, flush_interval=60, flush_count=1000) as store:
+            store.save("a", state)
+            state.remember(1, "MY FATHER")  # the saved state is a snapshot
+            self.assertEqual("MY MOTHER", store.load("a").recall(1))
+            with SessionStore(self.path) as other:
+                self.assertIsNone(other.load("a"))
+                store.flush()
+                self.assertEqual("MY MOTHER", other.load("a").recall(1))
+            self.assertIsNone(store.load("b"))
+
+    def test_flush_count(self):
+        """The writer doesn't wait for the timer once enough sessions are dirty."""
+        with SessionStore(self.path, flush_interval=60, flush_count=2) as store:
+            with SessionStore(self.path) as other:
+                store.save("a", SessionState())
+                store.save("b", SessionState())
+                for _ in range(200):
+                    if other.load("b") is not None:
+                        break
+                    time.sleep(0.01)
+                self.assertIsNotNone(other.load("a"))
+
+    def test_other_script_ignored(self):
+        """State saved with a different script isn't carried on."""
+        with SessionStore(self.path) as store:
+            Eliza(self.script, store=store).session("a").respond_to("I AM SAD")
+        changed = [line.replace("I AM SAD", "I AM BLUE") for line in self.script]
+        changed.append("; edited\n")
+        with SessionStore(self.path) as store:
+            Eliza(changed, store=store)
+            self.assertIsNone(store.load("a"))
+        with SessionStore(self.path) as store:
+            Eliza(self.script, store=store)
+            self.assertIsNotNone(store.load("a"))
+
+    def test_stale_cursor(self):
+        """A cursor past the end of a rule's reassemblies wraps round."""
+        state = SessionState()
+        for _ in range(4):
+            state.next_reassembly(7, 5)
+        state = SessionState.from_bytes(state.to_bytes())
+        self.assertEqual(1, state.next_reassembly(7, 3))
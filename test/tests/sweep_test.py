@@ -0,0 +1,46 @@
+import io
+import json
+import unittest
+
+from . import utils
+from pyliza.sweep import sweep
+
+
+class SweepTestCase(unittest.TestCase):
+    def setUp(self):
+        script = utils.read_lines(utils.CACM_SCRIPT)
+        self.scripts = {
+            "cacm": script,
+            "copy": list(script),
+            "which": [line.replace("IN WHAT WAY", "IN WHICH WAY") for line in script],
+        }
+        inputs = utils.conversation_inputs()
+        self.corpus = {"original": inputs, "short": inputs[:3], "later": inputs[3:]}
+
+    def run_sweep(self, processes):
+        matrix, diff = io.StringIO(), io.StringIO()
+        report = sweep(
+            self.scripts, self.corpus, processes, matrix_out=matrix, diff_out=diff
+        )
+        return report, matrix.getvalue(), diff.getvalue()
+
+    def test_sweep(self):
+        report, matrix, diff = self.run_sweep(1)
+        turns = sum(map(len, self.corpus.values()))
+        self.assertEqual([r.turns for r in report.scripts], [turns] * 3)
+        self.assertEqual(
+            [(r.different_turns, r.different_conversations) for r in report.scripts],
+            # "later" gets to "like" before "alike" moves it past IN WHAT WAY
+            [(0, 0), (0, 0), (3, 3)],
+        )
+        rows = [json.loads(line) for line in matrix.splitlines()]
+        self.assertEqual([row["conversation"] for row in rows], list(self.corpus))
+        self.assertEqual(rows[1]["replies"]["which"][0], "IN WHICH WAY\n")
+        self.assertIn("+Men are all alike. => IN WHICH WAY", diff)
+        self.assertNotIn("copy:", diff)
+
+    def test_pool_gives_same_results(self):
+        _, matrix, diff = self.run_sweep(1)
+        report, pool_matrix, pool_diff = self.run_sweep(2)
+        self.assertEqual(report.processes, 2)
+        self.assertEqual((pool_matrix, pool_diff), (matrix, diff))
@@ -0,0 +1,82 @@
+import glob
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from . import utils
+from pyliza.eliza import Eliza
+from pyliza.transcript import TranscriptWriter
+
+
+class TranscriptWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "transcript.jsonl")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_records_exchanges(self):
+        """Greeting, user turn and reply are all kept in order."""
+        with TranscriptWriter(self.path, flush_interval=0.01) as transcript:
+            eliza = Eliza(
+                utils.read_lines(utils.CACM_SCRIPT), transcript=transcript
+            )
+            greeting = eliza.greet()
+            reply = eliza.respond_to("Men are all alike.")
+        with open(self.path) as fobj:
+            entries = list(map(json.loads, fobj))
+        self.assertEqual(
+            [("greeting", greeting), ("user", "Men are all alike."), ("eliza", reply)],
+            [(e["kind"], e["text"]) for e in entries],
+        )
+        self.assertEqual({eliza.session_id}, {e["session"] for e in entries})
+
+    def test_rotation_and_compression(self):
+        """Rotated files are gzipped and nothing is lost."""
+        with TranscriptWriter(
+            self.path, batch_size=1, max_bytes=1, compress=True, flush_interval=0.01
+        ) as transcript:
+            for idx in range(5):
+                transcript.record("session", "user", f"line {idx}")
+        texts = []
+        for rotated in glob.glob(self.path + ".*.gz"):
+            with gzip.open(rotated, "rt") as fobj:
+                texts.extend(json.loads(line)["text"] for line in fobj)
+        with open(self.path) as fobj:
+            texts.extend(json.loads(line)["text"] for line in fobj)
+        self.assertEqual([f"line {idx}" for idx in range(5)], sorted(texts))
+
+    def test_record_after_close(self):
+        """Recording once closed drops the entry rather than waiting for space."""
+        transcript = TranscriptWriter(self.path, max_queue=1)
+        transcript.close()
+        for _ in range(3):
+            transcript.record("session", "user", "HELLO")
+        self.assertEqual(transcript.dropped, 3)
+
+    def test_close_while_recording(self):
+        """Every entry recorded around a close is either written or dropped."""
+        transcript = TranscriptWriter(self.path, flush_interval=0.01)
+        started = threading.Barrier(5)
+
+        def record():
+            started.wait()
+            for idx in range(200):
+                transcript.record("session", "user", f"line {idx}")
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        started.wait()
+        transcript.close()
+        for thread in threads:
+            thread.join()
+        written = 0
+        if os.path.exists(self.path):  # nothing was queued before the close
+            with open(self.path) as fobj:
+                written = sum(1 for _ in fobj)
+        self.assertEqual(800, written + transcript.dropped)
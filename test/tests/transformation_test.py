@@ -2,9 +2,21 @@ import unittest
 from hypothesis import given, example
 
 from . import pyliza_strategies as liza_st
-from pyliza.transformation import DecompositionRule
+from . import utils
+from pyliza.automaton import DecompositionAutomaton
+from pyliza.rule_parsing import ScriptParser
+from pyliza.transformation import (
+    DecompositionRule,
+    MatchBudget,
+    MatchBudgetExceeded,
+    MatchMemo,
+    ReassemblyRule,
+    TransformRule,
+)
 from pyliza.processing import ProcessingWord as PW
 from pyliza.processing import ProcessingPhrase as PPhrase
+from pyliza.processing import WordTest
+from pyliza.state import SessionState
 
 
 class DecompositionTestCase(unittest.TestCase):
@@ -39,3 +51,125 @@ class DecompositionTestCase(unittest.TestCase):
         self.assertRaises(ValueError, DecompositionRule, [{0.99}])
         self.assertRaises(ValueError, DecompositionRule, [{None}])
         self.assertRaises(ValueError, DecompositionRule, [{""}])
+
+
+class ReassemblyTestCase(unittest.TestCase):
+    @given(liza_st.valid_reassembly())
+    def test_render_matches_apply(self, eg):
+        """Rendering straight to text gives the same reply as building a phrase."""
+        parts, decomposed_phrase = eg
+        rule = ReassemblyRule(parts, None)
+        _, phrase = rule.apply(decomposed_phrase)
+        self.assertEqual(phrase.to_string(), rule.render(decomposed_phrase))
+
+    def test_constant_prerendered(self):
+        """A reply without any slots is the same string every time."""
+        rule = ReassemblyRule([[PW("PLEASE"), PW("GO"), PW("ON")]], None)
+        self.assertEqual("PLEASE GO ON", rule.render([]))
+        self.assertIs(rule.render([]), rule.render([[PW("X")]]))
+
+    def test_cycles_without_state(self):
+        """A rule applied without a session state still takes turns."""
+        trule = TransformRule(
+            DecompositionRule([0]),
+            [ReassemblyRule([[PW(word)]], None) for word in ("A", "B")],
+        )
+        phrase = PPhrase("HELLO")
+        replies = [trule.apply(phrase, render=True)[1] for _ in range(3)]
+        self.assertEqual(["A", "B", "A"], replies)
+        # a rule that isn't numbered has no place in a session's state
+        state = SessionState()
+        replies = [trule.apply(phrase, render=True, state=state)[1] for _ in range(3)]
+        self.assertEqual(["B", "A", "B"], replies)
+        self.assertEqual(SessionState(), state)
+
+
+class MatchBudgetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rule = DecompositionRule([0, PW("A"), 0, PW("B"), 0, PW("C"), 0])
+        self.phrase = PPhrase([PW("A")] * 20 + [PW("B")] * 20)
+
+    def test_budget_exhausted(self):
+        """Matching gives up once the step budget is used."""
+        budget = MatchBudget(max_steps=100)
+        self.assertRaises(
+            MatchBudgetExceeded, self.rule.decompose, self.phrase, budget
+        )
+
+    def test_within_budget(self):
+        """A generous budget does not change the result."""
+        budget = MatchBudget(max_steps=1_000_000)
+        self.assertIsNone(self.rule.decompose(self.phrase, budget))
+        self.assertGreater(budget.steps, 100)
+
+    def test_complexity(self):
+        """The cost grows with the phrase length times the automaton's states."""
+        complexity = self.rule.complexity()
+        self.assertEqual(8, complexity.states)
+        self.assertEqual(51 * 8, complexity.estimate(50))
+        self.assertFalse(complexity.is_risky(50))
+        self.assertTrue(complexity.is_risky(50, 100))
+        self.assertEqual(5, DecompositionRule([0, 2, PW("A")]).complexity().states)
+        # the automaton never steps more threads than the estimate
+        budget = MatchBudget()
+        DecompositionAutomaton([self.rule]).match(self.phrase, budget)
+        self.assertLessEqual(budget.steps, complexity.estimate(len(self.phrase)))
+
+
+class TagMatchTestCase(unittest.TestCase):
+    def test_tag_and_option_tests(self):
+        """Tagged words pass tag patterns and option sets match by word or tag."""
+        mother = PW("MOTHER")
+        mother.tags = {"NOUN", "FAMILY"}
+        self.assertTrue(WordTest.compile(PW(None, {"FAMILY"})).passes(mother))
+        self.assertFalse(WordTest.compile(PW(None, {"BELIEF"})).passes(mother))
+        options = WordTest.compile({PW("WANT"), PW("NEED"), PW(None, {"FAMILY"})})
+        self.assertTrue(options.passes(PW("NEED")))
+        self.assertTrue(options.passes(mother))
+        self.assertFalse(options.passes(PW("HAVE")))
+
+    def test_tagged_decomposition(self):
+        """A DLIST tagged word fills a (/TAG) slot."""
+        father = PW("FATHER")
+        father.tags = ["FAMILY"]
+        rule = DecompositionRule([0, PW("YOUR"), 0, PW(None, {"FAMILY"}), 0])
+        phrase = PPhrase([PW("YOUR"), father])
+        self.assertEqual([[], [PW("YOUR")], [], [father], []], rule.decompose(phrase))
+
+    def test_parts_are_views(self):
+        """Decomposed parts are spans over the phrase's words, not copies."""
+        phrase = PPhrase("I AM VERY SAD")
+        rule = DecompositionRule([0, PW("AM"), 0])
+        first, am, rest = rule.decompose(phrase)
+        self.assertEqual((0, 1, 2, 4), (first.start, am.start, rest.start, rest.end))
+        self.assertIs(phrase[3], rest[1])
+        self.assertEqual([phrase[2]], rest[:1])
+        self.assertFalse(rule.decompose(PPhrase("I AM"))[2])
+        _, reassembled = ReassemblyRule([[PW("WHY")], 3], None).apply([first, am, rest])
+        self.assertEqual("WHY VERY SAD", reassembled.to_string())
+
+
+class MatchMemoTestCase(unittest.TestCase):
+    def test_shared_pattern_matched_once(self):
+        """Identical patterns share an id, so a turn only matches them once."""
+        rule_set = ScriptParser.parse(utils.read_lines(utils.CACM_SCRIPT))
+        none, what = rule_set.rules[PW("NONE")], rule_set.rules[PW("WHAT")]
+        self.assertEqual(
+            none.transformation_rules[0].decompose.pattern_id,
+            what.transformation_rules[0].decompose.pattern_id,
+        )
+        memo = MatchMemo()
+        phrase = PPhrase("WHY IS THE SKY BLUE")
+        none.apply_transform(None, phrase, memo=memo)
+        self.assertEqual(memo.hits, 0)
+        _, reply = what.apply_transform(None, phrase, render=True, memo=memo)
+        self.assertEqual(memo.hits, 1)
+        self.assertEqual(reply, "WHY DO YOU ASK")
+
+    def test_link_passes_words_on(self):
+        """A bare link hands on the phrase's words without copying them."""
+        phrase = PPhrase("WHY IS THE SKY BLUE")
+        parts = DecompositionRule([0, PW("THE"), 0]).decompose(phrase)
+        link, passed_on = ReassemblyRule(None, PW("WHAT")).apply(parts)
+        self.assertEqual(link, PW("WHAT"))
+        self.assertIs(passed_on.words, phrase.words)
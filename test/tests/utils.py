@@ -3,3 +3,21 @@ import sys
 
 sys.path.insert(0, str(pathlib.Path(__file__).parent / "../.."))
 import pyliza
+
+REPO_DIR = pathlib.Path(__file__).parent / "../.."
+CACM_SCRIPT = REPO_DIR / "1966_01_CACM_article_Eliza_script.txt"
+ORIGINAL_CONVERSATION = REPO_DIR / "original_conversation.txt"
+
+
+def read_lines(path):
+    with open(path) as fobj:
+        return fobj.readlines()
+
+
+def conversation_inputs(path=ORIGINAL_CONVERSATION):
+    """The user side of a recorded conversation."""
+    return [
+        line
+        for line in map(str.strip, read_lines(path))
+        if line and not line.startswith("#")
+    ]